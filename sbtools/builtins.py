@@ -1,9 +1,13 @@
-from sbtool import SBTool
-from sbtools import UnknownSubcommandError
+from sbtool import SBTool, SBToolError, find_plugin_record
+from sbtools import SBTools, UnknownSubcommandError
 from sboptparse import SBToolOptionParser
 import os
+import sys
 import textwrap
-import pkg_resources
+
+# The modules that only some tools need (sbindex, sbserver, sbbatch,
+# sbchain, and the standard modules they use) are imported by those
+# tools, so that dispatching the other tools does not load them.
 
 class Help(SBTool):
     """The Help plug-in."""
@@ -37,6 +41,10 @@ class Help(SBTool):
             if cls is None:
                 # An unrecognized subcommand was used.
                 raise UnknownSubcommandError(sc)
+            helpstr = self.sbtools.get_static_help_by_subcommand(sc)
+            if helpstr is not None:
+                sys.stdout.write(helpstr)
+                return
             tool = cls(self.sbtools)
             try:
                 tool.print_help()
@@ -76,15 +84,22 @@ class About(SBTool):
             if cls is None:
                 # An unrecognized subcommand was used.
                 raise UnknownSubcommandError(sc)
+            aboutstr = self.sbtools.get_static_about_by_subcommand(sc)
+            if aboutstr is not None:
+                self.print_about(aboutstr)
+                return
             tool = cls(self.sbtools)
         try:
-            aboutstr = tool.get_about()
-            lines = aboutstr.splitlines()
-            for line in lines:
-                print textwrap.fill(line, 78)
+            self.print_about(tool.get_about())
         except NotImplementedError:
             print "No 'about' information available."
 
+    def print_about(self, aboutstr):
+        """Print the 'about' information aboutstr."""
+        lines = aboutstr.splitlines()
+        for line in lines:
+            print textwrap.fill(line, 78)
+
 class File(SBTool):
     """The File plug-in."""
     def __init__(self, sbtools):
@@ -122,6 +137,353 @@ class File(SBTool):
             if isbuiltin:
                 print "%s is a builtin tool." % (tool.get_name())
             else:
-                pkg_env = pkg_resources.Environment()
-                egg = pkg_env[tool.__module__.split('.')[0]][0]
-                print egg.location
+                # The record knows the distribution the plug-in came
+                # from; plug-ins added without one are looked up by the
+                # top-level name of their module.
+                record = find_plugin_record(tool.__class__)
+                if record is not None:
+                    print record.location
+                else:
+                    print self.sbtools.metadata.get_location(tool.__module__.split('.')[0])
+
+class RebuildIndex(SBTool):
+    """The RebuildIndex plug-in."""
+    def __init__(self, sbtools):
+        self.sbtools = sbtools
+        self.parser = self.init_parser()
+
+    def init_parser(self):
+        """Populate and return the parser object."""
+        usage = "%s [options]" % (self.get_command())
+        description = "Scan the installed plug-ins and write the dispatch table that sbtools loads instead of scanning at startup. The table is written to the cache directory (SBTOOLS_CACHE_DIR, or ~/.sbtools) and is ignored once the installed plug-ins change."
+        parser = SBToolOptionParser(self, self.sbtools, usage, description=description)
+        parser.add_option("--remove", action="store_true", dest="remove",
+                          default=False, help="remove the dispatch table")
+        return parser
+
+    def get_about(self):
+        """Return this tool's 'about' information."""
+        return "The RebuildIndex tool is a core component of the SBTools package."
+
+    def print_help(self):
+        """Print this tool's help information."""
+        self.parser.print_help()
+
+    def run(self):
+        """Run the tool."""
+        (self.options, self.args) = self.parser.parse_args()
+        if len(self.args) != 1:
+            self.parser.error_exit("Unexpected argument: '%s'." % (self.args[1]))
+
+        from sbindex import get_dispatch_table_file, write_dispatch_table, remove_dispatch_table
+        path = get_dispatch_table_file(self.sbtools.registry_cache.cachedir)
+        if self.options.remove:
+            try:
+                if remove_dispatch_table(path):
+                    print "Removed %s." % (path)
+                else:
+                    print "No dispatch table to remove."
+            except OSError, e:
+                self.parser.error_exit("Cannot remove the dispatch table: %s" % (e))
+            return
+
+        # Scan the environment with a fresh SBTools object so the table
+        # does not depend on any cached registry.
+        sbtools = SBTools(self.sbtools.metadata, config=self.sbtools.config)
+        searchpath = sbtools.get_search_path()
+        sbtools.build_tool_list(lazy=True)
+        fingerprint = sbtools.registry_cache.get_fingerprint(searchpath)
+        try:
+            write_dispatch_table(path, searchpath, fingerprint, sbtools.records)
+        except (IOError, OSError), e:
+            self.parser.error_exit("Cannot write the dispatch table: %s" % (e))
+        print "Wrote the dispatch table for %d plug-ins to %s." % (len(sbtools.records), path)
+
+class Serve(SBTool):
+    """The Serve plug-in."""
+    def __init__(self, sbtools):
+        self.sbtools = sbtools
+        self.parser = self.init_parser()
+
+    def init_parser(self):
+        """Populate and return the parser object."""
+        usage = "%s [options]" % (self.get_command())
+        description = "Run a resident sbtools server that keeps the plug-ins loaded and runs the commands sent by sbtools-client. With --fork, each command runs in a forked child of the server, which isolates the commands from each other."
+        parser = SBToolOptionParser(self, self.sbtools, usage, description=description)
+        parser.add_option("-s", "--socket", dest="socket", default=None,
+                          help="listen on the Unix domain socket SOCKET (default: $SBTOOLS_SOCKET or ~/.sbtools/server.sock)")
+        parser.add_option("-f", "--fork", action="store_true", dest="fork",
+                          default=False, help="run each command in a forked child of the server")
+        parser.add_option("-p", "--preload", action="append", dest="preload",
+                          default=[], metavar="MODULES",
+                          help="comma-separated modules to import before serving (may be repeated)")
+        return parser
+
+    def get_about(self):
+        """Return this tool's 'about' information."""
+        return "The Serve tool is a core component of the SBTools package."
+
+    def print_help(self):
+        """Print this tool's help information."""
+        self.parser.print_help()
+
+    def run(self):
+        """Run the tool."""
+        (self.options, self.args) = self.parser.parse_args()
+        if len(self.args) != 1:
+            self.parser.error_exit("Unexpected argument: '%s'." % (self.args[1]))
+
+        from sbserver import SBToolsServer, SBToolsServerError
+        import socket
+        import signal
+        modules = []
+        for modlist in self.options.preload:
+            modules.extend([mod.strip() for mod in modlist.split(',') if mod.strip()])
+        server = SBToolsServer(self.sbtools, self.options.socket,
+                               self.options.fork, modules)
+        server.preload()
+        try:
+            server.bind()
+        except (SBToolsServerError, OSError, socket.error), e:
+            self.parser.error_exit("Cannot start the server: %s" % (e))
+        sys.stderr.write("sbtools server listening on %s\n" % (server.path))
+        previous_handler = signal.signal(signal.SIGTERM, self.terminate)
+        try:
+            try:
+                server.serve_forever()
+            except KeyboardInterrupt:
+                pass
+        finally:
+            signal.signal(signal.SIGTERM, previous_handler)
+
+    def terminate(self, signum, frame):
+        """Stop the server (and remove its socket) on SIGTERM."""
+        raise KeyboardInterrupt
+
+class Batch(SBTool):
+    """The Batch plug-in."""
+    def __init__(self, sbtools):
+        self.sbtools = sbtools
+        self.parser = self.init_parser()
+
+    def init_parser(self):
+        """Populate and return the parser object."""
+        usage = "%s [options] FILE" % (self.get_command())
+        description = "Run the sbtools commands listed in FILE (or on standard input if FILE is '-'), one command per line, without starting sbtools for each one. The output of each command is written when it finishes, in the order of the lines."
+        parser = SBToolOptionParser(self, self.sbtools, usage, description=description)
+        parser.add_option("-x", "--stop-on-error", action="store_true", dest="stop",
+                          default=False, help="stop at the first command that fails")
+        return parser
+
+    def get_about(self):
+        """Return this tool's 'about' information."""
+        return "The Batch tool is a core component of the SBTools package."
+
+    def print_help(self):
+        """Print this tool's help information."""
+        self.parser.print_help()
+
+    def run(self):
+        """Run the tool."""
+        (self.options, self.args) = self.parser.parse_args()
+        if len(self.args) != 2:
+            self.parser.error_exit("Missing batch file argument.")
+
+        from sbbatch import run_captured, write_result
+        commands = self.read_commands(self.args[1])
+        # Every line is dispatched through this SBTools object, so the
+        # full tool list is built once for the whole batch.
+        self.sbtools.complete_tool_list()
+        failed = 0
+        for command in commands:
+            status = run_captured(self.sbtools, command)
+            write_result(command)
+            if status != 0:
+                failed += 1
+                if self.options.stop:
+                    break
+        if failed:
+            raise SBToolError("%d of %d batch commands failed." % (failed, len(commands)))
+
+    def read_commands(self, fname):
+        """Return the BatchCommand objects read from the file fname."""
+        from sbbatch import BatchError, read_batch
+        try:
+            if fname == '-':
+                return read_batch(sys.stdin)
+            f = open(fname)
+            try:
+                return read_batch(f)
+            finally:
+                f.close()
+        except IOError, e:
+            self.parser.error_exit("Cannot read the batch file: %s" % (e))
+        except BatchError, e:
+            self.parser.error_exit("Cannot read the batch file: %s" % (e))
+
+class Parallel(Batch):
+    """The Parallel plug-in."""
+    def init_parser(self):
+        """Populate and return the parser object."""
+        usage = "%s [options] FILE" % (self.get_command())
+        description = "Run the sbtools commands listed in FILE (or on standard input if FILE is '-'), one command per line, on a pool of worker processes. Each worker loads the plug-ins once when it starts. The output of each command is written when it finishes, in the order of the lines unless --unordered is given."
+        parser = SBToolOptionParser(self, self.sbtools, usage, description=description)
+        parser.add_option("-j", "--jobs", type="int", dest="jobs", default=None,
+                          help="run JOBS worker processes (default: the number of CPUs)")
+        parser.add_option("-u", "--unordered", action="store_true", dest="unordered",
+                          default=False, help="write the output of each command as soon as it finishes")
+        return parser
+
+    def get_about(self):
+        """Return this tool's 'about' information."""
+        return "The Parallel tool is a core component of the SBTools package."
+
+    def run(self):
+        """Run the tool."""
+        (self.options, self.args) = self.parser.parse_args()
+        if len(self.args) != 2:
+            self.parser.error_exit("Missing batch file argument.")
+        if self.options.jobs is not None and self.options.jobs < 1:
+            self.parser.error_exit("The number of jobs must be at least 1.")
+        try:
+            import multiprocessing
+        except ImportError:
+            self.parser.error_exit("The parallel tool requires the multiprocessing module (Python 2.6 or later).")
+        from sbbatch import init_worker, run_worker_command, write_result
+
+        commands = self.read_commands(self.args[1])
+        # The workers are given the records of the full tool list, so
+        # they do not scan the environment themselves.
+        self.sbtools.complete_tool_list()
+        record_dicts = [rec.to_dict() for rec in self.sbtools.records]
+        pool = multiprocessing.Pool(self.options.jobs, init_worker, (record_dicts,))
+        failed = 0
+        try:
+            if self.options.unordered:
+                results = pool.imap_unordered(run_worker_command, commands)
+            else:
+                results = pool.imap(run_worker_command, commands)
+            for command in results:
+                write_result(command)
+                if command.status != 0:
+                    failed += 1
+            pool.close()
+        finally:
+            pool.terminate()
+            pool.join()
+        if failed:
+            raise SBToolError("%d of %d parallel commands failed." % (failed, len(commands)))
+
+class Chain(SBTool):
+    """The Chain plug-in."""
+    def __init__(self, sbtools):
+        self.sbtools = sbtools
+        self.parser = self.init_parser()
+
+    def init_parser(self):
+        """Populate and return the parser object."""
+        from sbchain import CHAIN_SEPARATOR
+        usage = "%s SUBCOMMAND [args] %s SUBCOMMAND [args] ..." % (self.get_command(), CHAIN_SEPARATOR)
+        description = "Run several sbtools commands as a pipeline in one process. The output of each command is the input of the next. Plug-ins that support streaming pass records to each other in memory; other plug-ins pass lines of text through their standard input and output."
+        parser = SBToolOptionParser(self, self.sbtools, usage, description=description)
+        # The options after the first subcommand belong to the stages.
+        parser.disable_interspersed_args()
+        return parser
+
+    def get_about(self):
+        """Return this tool's 'about' information."""
+        return "The Chain tool is a core component of the SBTools package."
+
+    def print_help(self):
+        """Print this tool's help information."""
+        self.parser.print_help()
+
+    def run(self):
+        """Run the tool."""
+        from sbchain import split_chain, format_record, open_stage
+        # The stages have their own options, so only the options that
+        # come before the first stage belong to this tool. Parsing stops
+        # at the first stage, whose arguments and those of the later
+        # stages are left in self.args.
+        (self.options, args) = self.parser.parse_args(sys.argv[2:])
+        self.args = sys.argv[1:2] + args
+        if not args:
+            self.parser.error_exit("Missing subcommand argument.")
+
+        stages = []
+        for stageargs in split_chain(args):
+            if not stageargs:
+                self.parser.error_exit("Empty stage in the chain.")
+            sc = stageargs[0]
+            cls = self.sbtools.get_tool_by_subcommand(sc)
+            if cls is None:
+                # An unrecognized subcommand was used.
+                raise UnknownSubcommandError(sc)
+            argv = [sys.argv[0]] + stageargs
+            saved_argv = sys.argv
+            sys.argv = argv
+            try:
+                tool = cls(self.sbtools)
+            finally:
+                sys.argv = saved_argv
+            stages.append((tool, argv))
+
+        records = None
+        for (tool, argv) in stages:
+            records = open_stage(tool, argv, records)
+        for rec in records:
+            sys.stdout.write(format_record(rec))
+
+class Cache(SBTool):
+    """The Cache plug-in."""
+    def __init__(self, sbtools):
+        self.sbtools = sbtools
+        self.parser = self.init_parser()
+
+    def init_parser(self):
+        """Populate and return the parser object."""
+        usage = "%s [list | prune | clear] [options]" % (self.get_command())
+        description = "Inspect and prune the cache of results of cacheable plug-ins. 'list' (the default) shows the stored results, most recently used first; 'prune' removes the least recently used results until the cache fits its size limit; 'clear' removes every result."
+        parser = SBToolOptionParser(self, self.sbtools, usage, description=description)
+        parser.add_option("--max-size", dest="max_size", default=None, metavar="SIZE",
+                          help="size limit used by 'prune', in bytes or with a K, M, or G suffix (default: $SBTOOLS_RESULT_CACHE_SIZE or 256M)")
+        return parser
+
+    def get_about(self):
+        """Return this tool's 'about' information."""
+        return "The Cache tool is a core component of the SBTools package."
+
+    def print_help(self):
+        """Print this tool's help information."""
+        self.parser.print_help()
+
+    def run(self):
+        """Run the tool."""
+        (self.options, self.args) = self.parser.parse_args()
+        if len(self.args) > 2:
+            self.parser.error_exit("Unexpected argument: '%s'." % (self.args[2]))
+        action = 'list'
+        if len(self.args) == 2:
+            action = self.args[1]
+
+        cache = self.sbtools.result_cache
+        if action == 'list':
+            import time
+            results = cache.get_results()
+            for result in results:
+                used = time.strftime("%Y-%m-%d %H:%M", time.localtime(result.get_last_used()))
+                print "%s  %10d  %s  %s" % (used, result.size, result.tool, " ".join(result.argv))
+            print "%d results, %d bytes in %s." % (len(results), sum([result.size for result in results]), cache.cachedir)
+        elif action == 'prune':
+            from sbresultcache import parse_size
+            max_size = None
+            if self.options.max_size is not None:
+                try:
+                    max_size = parse_size(self.options.max_size)
+                except ValueError:
+                    self.parser.error_exit("Invalid size: '%s'." % (self.options.max_size))
+            print "Removed %d results." % (cache.prune(max_size))
+        elif action == 'clear':
+            print "Removed %d results." % (cache.clear())
+        else:
+            self.parser.error_exit("Unknown action: '%s'." % (action))
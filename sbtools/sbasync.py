@@ -0,0 +1,122 @@
+import os
+import sys
+import types
+import threading
+from sbtool import SBToolError
+
+# Python 2 has no async def, so asynchronous tools are written as
+# generators. A tool's run_async() generator yields the blocking work
+# it has to wait for, and the event loop in run_coroutine() does the
+# waiting:
+#
+#   def run_async(self):
+#       data = yield functools.partial(read_model, "a.xml")
+#       (b, c) = yield [functools.partial(read_model, "b.xml"),
+#                       functools.partial(query_db, "c")]
+#
+# A yielded callable is called on a worker thread and its result is
+# sent back into the generator. A yielded list (or tuple) of callables
+# is called concurrently and the list of results is sent back once all
+# of them have finished. An exception raised by a callable is raised
+# inside the generator at the yield.
+#
+# The callables of a yield are run by a pool of at most
+# DEFAULT_MAX_WORKERS worker threads (or the number set with the
+# SBTOOLS_ASYNC_WORKERS environment variable); the others wait for a
+# free worker. Callables that wait for each other must therefore not
+# outnumber the workers.
+
+DEFAULT_MAX_WORKERS = 8
+
+def get_max_workers():
+    """
+    Return the number of worker threads, which is taken from the
+    SBTOOLS_ASYNC_WORKERS environment variable if it is set to a
+    positive number and is DEFAULT_MAX_WORKERS otherwise.
+    """
+    try:
+        workers = int(os.environ.get('SBTOOLS_ASYNC_WORKERS', ''))
+    except ValueError:
+        return DEFAULT_MAX_WORKERS
+    if workers < 1:
+        return DEFAULT_MAX_WORKERS
+    return workers
+
+class AsyncCall:
+    """A callable run on a worker thread by the event loop."""
+    def __init__(self, func):
+        self.func = func
+        self.result = None
+        self.exc_info = None
+
+    def run(self):
+        try:
+            self.result = self.func()
+        except:
+            self.exc_info = sys.exc_info()
+
+def run_concurrently(funcs, max_workers=None):
+    """
+    Call the callables in funcs on at most max_workers worker threads
+    (get_max_workers() by default) and return the list of results
+    once all of them have finished. If any call raised an exception,
+    the exception of the first such call is re-raised.
+    """
+    if max_workers is None:
+        max_workers = get_max_workers()
+    calls = [AsyncCall(func) for func in funcs]
+    pending = calls[::-1]
+    lock = threading.Lock()
+    def work():
+        while True:
+            lock.acquire()
+            try:
+                if not pending:
+                    return
+                call = pending.pop()
+            finally:
+                lock.release()
+            call.run()
+    workers = []
+    for i in range(min(max(max_workers, 1), len(calls))):
+        worker = threading.Thread(target=work)
+        worker.setDaemon(True)
+        worker.start()
+        workers.append(worker)
+    for worker in workers:
+        worker.join()
+    for call in calls:
+        if call.exc_info is not None:
+            raise call.exc_info[0], call.exc_info[1], call.exc_info[2]
+    return [call.result for call in calls]
+
+def run_coroutine(coroutine):
+    """
+    Drive the generator coroutine until it is exhausted, doing the
+    work it yields as described at the top of this module. A
+    SBToolError is raised if coroutine is not a generator, as when a
+    run_async() method does not yield.
+    """
+    if not isinstance(coroutine, types.GeneratorType):
+        raise SBToolError("run_async() returned %r instead of a generator; it must yield its work." % (coroutine,))
+    value = None
+    exc_info = None
+    while True:
+        try:
+            if exc_info is not None:
+                waitable = coroutine.throw(exc_info[0], exc_info[1], exc_info[2])
+            else:
+                waitable = coroutine.send(value)
+        except StopIteration:
+            return
+        value = None
+        exc_info = None
+        try:
+            if isinstance(waitable, (list, tuple)):
+                value = run_concurrently(waitable)
+            elif callable(waitable):
+                value = run_concurrently([waitable])[0]
+            else:
+                raise TypeError("run_async() yielded %r, which is not a callable or a list of callables." % (waitable,))
+        except Exception:
+            exc_info = sys.exc_info()
@@ -0,0 +1,110 @@
+import sys
+import shlex
+import signal
+import traceback
+from StringIO import StringIO
+from sbregistry import PluginRecord
+
+class BatchError(Exception):
+    """An exception class for unreadable batch files."""
+    def __init__(self, value):
+        self.value = str(value)
+    def __str__(self):
+        return self.value
+
+class BatchCommand:
+    """
+    One command line of a batch file. The status and the captured
+    output are filled in when the command is run.
+    """
+    def __init__(self, lineno, argv):
+        self.lineno = lineno
+        self.argv = argv
+        self.status = None
+        self.stdout = ""
+        self.stderr = ""
+
+def read_batch(f, prog='sbtools'):
+    """
+    Return a BatchCommand for each line of the file object f. Each
+    line holds the arguments of one sbtools invocation, quoted as in
+    the shell, and prog is prepended to them. Blank lines and comments
+    starting with '#' are skipped. A BatchError is raised if a line
+    cannot be split.
+    """
+    commands = []
+    lineno = 0
+    for line in f:
+        lineno += 1
+        try:
+            args = shlex.split(line, True)
+        except ValueError, e:
+            raise BatchError("Line %d: %s." % (lineno, e))
+        if args:
+            commands.append(BatchCommand(lineno, [prog] + args))
+    return commands
+
+def run_captured(sbtools, command):
+    """
+    Run command with sbtools.invoke() and capture its output in the
+    command. The command gets an empty standard input. Returns the
+    exit status.
+    """
+    saved_streams = (sys.stdin, sys.stdout, sys.stderr)
+    out = StringIO()
+    err = StringIO()
+    (sys.stdin, sys.stdout, sys.stderr) = (StringIO(), out, err)
+    try:
+        try:
+            command.status = sbtools.invoke(command.argv)
+        except KeyboardInterrupt:
+            raise
+        except Exception:
+            traceback.print_exc()
+            command.status = 1
+    finally:
+        (sys.stdin, sys.stdout, sys.stderr) = saved_streams
+    command.stdout = out.getvalue()
+    command.stderr = err.getvalue()
+    return command.status
+
+def write_result(command, stdout=None, stderr=None):
+    """
+    Write the captured output of command to stdout and stderr (the
+    standard streams by default), followed by a message on stderr if
+    the command failed.
+    """
+    if stdout is None:
+        stdout = sys.stdout
+    if stderr is None:
+        stderr = sys.stderr
+    stdout.write(command.stdout)
+    stdout.flush()
+    stderr.write(command.stderr)
+    if command.status != 0:
+        stderr.write("Line %d: '%s' exited with status %d.\n"
+                     % (command.lineno, " ".join(command.argv[1:]), command.status))
+    stderr.flush()
+
+# The SBTools object of a parallel worker process.
+worker_sbtools = None
+
+def init_worker(record_dicts):
+    """
+    Initializer of the parallel worker processes. The tool list is
+    built from the plug-in records of the parent (see
+    PluginRecord.to_dict()) and every plug-in is imported, so the
+    commands run by the worker do not repeat either step. Interrupts
+    are left to the parent.
+    """
+    global worker_sbtools
+    from sbtools import SBTools
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    worker_sbtools = SBTools()
+    worker_sbtools.add_records([PluginRecord.from_dict(d) for d in record_dicts], True)
+    worker_sbtools.load_tools()
+
+def run_worker_command(command):
+    """Run command in a parallel worker and return it with its results."""
+    run_captured(worker_sbtools, command)
+    return command
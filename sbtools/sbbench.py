@@ -0,0 +1,323 @@
+import os
+import sys
+import math
+import time
+import shutil
+import tempfile
+import platform
+import subprocess
+from optparse import OptionParser
+from StringIO import StringIO
+try:
+    import json
+except ImportError:
+    import simplejson as json
+try:
+    from hashlib import md5
+except ImportError:
+    from md5 import new as md5
+from sbregistry import RegistryCache, get_cache_dir
+from sbmetadata import DistributionMetadata
+
+# The metrics measured by sbtools-bench, in report order.
+METRICS = ['startup', 'discovery', 'dispatch']
+
+def get_source_dir():
+    """Return the directory containing the sbtools package."""
+    return os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def get_commit(srcdir=None):
+    """
+    Return the git commit of the sbtools source tree, or 'unknown' if
+    the source is not in a git repository.
+    """
+    if srcdir is None:
+        srcdir = get_source_dir()
+    try:
+        proc = subprocess.Popen(['git', 'rev-parse', 'HEAD'], cwd=srcdir,
+                                stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        output = proc.communicate()[0]
+    except OSError:
+        return 'unknown'
+    if proc.returncode != 0:
+        return 'unknown'
+    return output.strip()
+
+def get_machine_fingerprint():
+    """
+    Return a short fingerprint of this machine and interpreter, so
+    that results are only compared with results taken in the same
+    setting.
+    """
+    parts = [platform.node(), platform.machine(), platform.processor(),
+             platform.system(), platform.release(), sys.version]
+    return md5("\0".join(parts)).hexdigest()[:12]
+
+def measure_startup():
+    """Return the time taken by 'sbtools --version' in a new interpreter."""
+    env = os.environ.copy()
+    env['PYTHONPATH'] = os.pathsep.join([get_source_dir()] +
+                                        [p for p in [env.get('PYTHONPATH')] if p])
+    cmd = [sys.executable, '-c',
+           "import sys; sys.argv = ['sbtools', '--version']; from sbtools.sbtools import main; main()"]
+    start = time.time()
+    proc = subprocess.Popen(cmd, env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    proc.communicate()
+    return time.time() - start
+
+def measure_discovery():
+    """
+    Return the time taken to scan the environment for plug-ins. The
+    scan uses a new, empty registry cache, so it neither reads the
+    directory index of the user's cache nor writes to it.
+    """
+    from sbtools import SBTools
+    sbtools = SBTools(DistributionMetadata())
+    cachedir = tempfile.mkdtemp()
+    sbtools.registry_cache = RegistryCache(cachedir)
+    try:
+        start = time.time()
+        sbtools.build_tool_list(lazy=True)
+        return time.time() - start
+    finally:
+        shutil.rmtree(cachedir, True)
+
+def measure_dispatch():
+    """Return the time taken to dispatch 'sbtools about' in process."""
+    from sbtools import SBTools
+    sbtools = SBTools()
+    sbtools.build_tool_list(use_cache=True, lazy=True)
+    saved_stdout = sys.stdout
+    sys.stdout = StringIO()
+    try:
+        start = time.time()
+        sbtools.invoke(['sbtools', 'about'])
+        return time.time() - start
+    finally:
+        sys.stdout = saved_stdout
+
+measures = {'startup': measure_startup,
+            'discovery': measure_discovery,
+            'dispatch': measure_dispatch}
+
+def take_samples(samples, metrics=METRICS):
+    """Return a dictionary mapping each metric to samples timings."""
+    results = {}
+    for metric in metrics:
+        results[metric] = [measures[metric]() for i in range(samples)]
+    return results
+
+def median(values):
+    """Return the median of the list values."""
+    ordered = sorted(values)
+    n = len(ordered)
+    if n % 2:
+        return ordered[n//2]
+    return (ordered[n//2 - 1] + ordered[n//2]) / 2.0
+
+def erfc(x):
+    """
+    Return the complementary error function of x, using math.erfc()
+    where it exists (Python 2.7) and erfc_approx() otherwise.
+    """
+    if hasattr(math, 'erfc'):
+        return math.erfc(x)
+    return erfc_approx(x)
+
+def erfc_approx(x):
+    """
+    Return a Chebyshev approximation of the complementary error
+    function of x, with a fractional error below 1.2e-7.
+    """
+    z = abs(x)
+    t = 1.0 / (1.0 + 0.5*z)
+    r = t * math.exp(-z*z - 1.26551223 + t*(1.00002368 + t*(0.37409196 + t*(0.09678418 +
+            t*(-0.18628806 + t*(0.27886807 + t*(-1.13520398 + t*(1.48851587 +
+            t*(-0.82215223 + t*0.17087277)))))))))
+    if x >= 0:
+        return r
+    return 2.0 - r
+
+def mann_whitney_u(current, baseline):
+    """
+    Return the Mann-Whitney U statistic of current against baseline
+    and the one-sided p-value of the hypothesis that current tends to
+    be larger (slower) than baseline. The p-value uses the normal
+    approximation with a tie correction and a continuity correction.
+    """
+    n1 = len(current)
+    n2 = len(baseline)
+    combined = [(value, 0) for value in current] + [(value, 1) for value in baseline]
+    combined.sort()
+    ranks = [0.0] * len(combined)
+    ties = 0.0
+    i = 0
+    while i < len(combined):
+        j = i
+        while j + 1 < len(combined) and combined[j + 1][0] == combined[i][0]:
+            j += 1
+        # Tied values share the average of their ranks.
+        for k in range(i, j + 1):
+            ranks[k] = (i + j) / 2.0 + 1
+        count = j - i + 1
+        ties += count**3 - count
+        i = j + 1
+
+    rank_sum = sum([ranks[k] for k in range(len(combined)) if combined[k][1] == 0])
+    u = rank_sum - n1*(n1 + 1) / 2.0
+    n = n1 + n2
+    mean = n1*n2 / 2.0
+    variance = n1*n2 / 12.0 * ((n + 1) - ties / (n*(n - 1)))
+    if variance <= 0:
+        return (u, 1.0)
+    z = (u - mean - 0.5) / math.sqrt(variance)
+    return (u, 0.5 * erfc(z / math.sqrt(2)))
+
+class BenchHistory:
+    """
+    The history of sbtools-bench runs, stored as JSON. Each run records
+    the commit and machine fingerprint it was taken on, the time, and
+    the samples of each metric.
+    """
+    def __init__(self, path=None):
+        if path is None:
+            path = os.path.join(get_cache_dir(), 'bench-history.json')
+        self.path = path
+        self.runs = []
+
+    def load(self):
+        """Read the history file, if it exists."""
+        if not os.path.exists(self.path):
+            self.runs = []
+            return
+        f = open(self.path)
+        try:
+            self.runs = json.load(f)['runs']
+        finally:
+            f.close()
+
+    def save(self):
+        """Write the history file."""
+        dirname = os.path.dirname(self.path)
+        if dirname and not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        tmpfile = "%s.%d" % (self.path, os.getpid())
+        f = open(tmpfile, 'w')
+        try:
+            json.dump({'runs': self.runs}, f, indent=1, sort_keys=True)
+        finally:
+            f.close()
+        os.rename(tmpfile, self.path)
+
+    def add(self, commit, machine, metrics):
+        """Add a run and return it."""
+        run = {'commit': commit, 'machine': machine,
+               'timestamp': time.time(), 'metrics': metrics}
+        self.runs.append(run)
+        return run
+
+    def find_baseline(self, machine, commit=None, exclude=None):
+        """
+        Return the most recent run on machine, other than exclude, that
+        was taken on commit (any commit other than that of exclude if
+        commit is None), or None if there is no such run.
+        """
+        for run in reversed(self.runs):
+            if run is exclude or run['machine'] != machine:
+                continue
+            if commit is not None:
+                if run['commit'] == commit or run['commit'].startswith(commit):
+                    return run
+            elif exclude is None or run['commit'] != exclude['commit']:
+                return run
+        return None
+
+def compare_runs(current, baseline, threshold, alpha):
+    """
+    Compare the metrics of the current run with the baseline run and
+    return a list of (metric, baseline median, current median, relative
+    change, p-value, regressed) tuples. A metric regresses when its
+    median grew by more than threshold (a fraction) and the
+    Mann-Whitney test finds it slower with a p-value below alpha.
+    """
+    comparison = []
+    for metric in METRICS:
+        if not current['metrics'].has_key(metric) or not baseline['metrics'].has_key(metric):
+            continue
+        cur = current['metrics'][metric]
+        base = baseline['metrics'][metric]
+        (curmed, basemed) = (median(cur), median(base))
+        if basemed > 0:
+            change = (curmed - basemed) / basemed
+        else:
+            change = 0.0
+        pvalue = mann_whitney_u(cur, base)[1]
+        regressed = change > threshold and pvalue < alpha
+        comparison.append((metric, basemed, curmed, change, pvalue, regressed))
+    return comparison
+
+def format_comparison(comparison):
+    """Return the comparison as a formatted table."""
+    lines = ["%-12s %14s %14s %9s %9s  %s" % ("Metric", "Baseline (ms)", "Current (ms)",
+                                             "Change", "p-value", "Status")]
+    for (metric, basemed, curmed, change, pvalue, regressed) in comparison:
+        if regressed:
+            status = "REGRESSED"
+        else:
+            status = "ok"
+        lines.append("%-12s %14.2f %14.2f %+8.1f%% %9.4f  %s" % (metric, basemed*1000, curmed*1000,
+                                                               change*100, pvalue, status))
+    return "\n".join(lines) + "\n"
+
+def main():
+    """
+    Entry point for the sbtools-bench script. Returns (as the exit
+    status) 1 if a metric regressed against the baseline and 0
+    otherwise.
+    """
+    parser = OptionParser(usage="%prog [options]",
+                          description="Measure sbtools startup, discovery, and dispatch times, store them in a history keyed by commit and machine, and compare them with a baseline run.")
+    parser.add_option("-n", "--samples", type="int", dest="samples", default=10,
+                      help="samples taken of each metric (default: %default)")
+    parser.add_option("--history", dest="history", default=None, metavar="FILE",
+                      help="history file (default: ~/.sbtools/bench-history.json)")
+    parser.add_option("--commit", dest="commit", default=None,
+                      help="commit to record the run under (default: the git HEAD of the source)")
+    parser.add_option("--baseline", dest="baseline", default=None, metavar="COMMIT",
+                      help="compare with the latest run of COMMIT (default: the latest run of another commit)")
+    parser.add_option("--threshold", type="float", dest="threshold", default=10.0, metavar="PERCENT",
+                      help="slowdown of the median, in percent, that counts as a regression (default: %default)")
+    parser.add_option("--alpha", type="float", dest="alpha", default=0.05,
+                      help="significance level of the Mann-Whitney test (default: %default)")
+    parser.add_option("--no-save", action="store_false", dest="save", default=True,
+                      help="do not add this run to the history")
+    (options, args) = parser.parse_args()
+    if args:
+        parser.error("unexpected argument: '%s'" % (args[0]))
+    if options.samples < 2:
+        parser.error("at least 2 samples are needed")
+
+    history = BenchHistory(options.history)
+    try:
+        history.load()
+    except (IOError, ValueError, KeyError), e:
+        parser.error("cannot read the history file: %s" % (e))
+    commit = options.commit or get_commit()
+    machine = get_machine_fingerprint()
+    run = history.add(commit, machine, take_samples(options.samples))
+    if options.save:
+        history.save()
+
+    baseline = history.find_baseline(machine, options.baseline, run)
+    if baseline is None:
+        print "Recorded run of %s on machine %s; no baseline to compare with." % (commit[:12], machine)
+        for metric in METRICS:
+            print "%-12s %10.2f ms (median)" % (metric, median(run['metrics'][metric])*1000)
+        sys.exit(0)
+
+    print "Comparing %s with baseline %s on machine %s." % (commit[:12], baseline['commit'][:12], machine)
+    comparison = compare_runs(run, baseline, options.threshold / 100.0, options.alpha)
+    print format_comparison(comparison),
+    if [item for item in comparison if item[5]]:
+        sys.exit(1)
+    sys.exit(0)
@@ -0,0 +1,92 @@
+import sys
+from StringIO import StringIO
+
+# Separates the tools of an 'sbtools chain' command line.
+CHAIN_SEPARATOR = '::'
+
+def split_chain(args):
+    """
+    Split the argument list args at each CHAIN_SEPARATOR and return
+    the list of argument lists, one per stage. Stages may be empty.
+    """
+    stages = [[]]
+    for arg in args:
+        if arg == CHAIN_SEPARATOR:
+            stages.append([])
+        else:
+            stages[-1].append(arg)
+    return stages
+
+def format_record(rec):
+    """
+    Return the text form of the record rec: strings are written as
+    they are and other records with str(), each ending in a newline.
+    """
+    if isinstance(rec, unicode):
+        rec = rec.encode('utf-8')
+    elif not isinstance(rec, str):
+        rec = str(rec)
+    if not rec.endswith("\n"):
+        rec += "\n"
+    return rec
+
+def with_argv(argv, records):
+    """
+    Yield the records of the iterator records with sys.argv set to
+    argv while each one is produced, so that a stage parses its own
+    command line however far it is advanced.
+    """
+    while True:
+        saved_argv = sys.argv
+        sys.argv = argv
+        try:
+            rec = records.next()
+        finally:
+            sys.argv = saved_argv
+        yield rec
+
+def run_bytes(tool, argv, records):
+    """
+    Run tool.run() as a stage of a chain and yield the lines it writes
+    to sys.stdout. The records of the previous stage are given to the
+    tool as lines on sys.stdin; if records is None, the tool is the
+    first stage and reads the standard input of the chain.
+    """
+    saved = (sys.argv, sys.stdin, sys.stdout)
+    if records is not None:
+        sys.stdin = StringIO("".join([format_record(rec) for rec in records]))
+    out = StringIO()
+    sys.stdout = out
+    sys.argv = argv
+    try:
+        tool.run()
+    finally:
+        (sys.argv, sys.stdin, sys.stdout) = saved
+    for line in StringIO(out.getvalue()):
+        yield line
+
+def open_stage(tool, argv, records):
+    """
+    Return an iterator over the records produced by tool when it is
+    run with the command line argv on the records of the previous
+    stage (None for the first stage).
+
+    Tools that implement run_stream() exchange records with their
+    neighbours in memory. Other tools are run with run() and exchange
+    lines of text through their standard streams instead.
+    """
+    saved_argv = sys.argv
+    sys.argv = argv
+    try:
+        try:
+            if records is None:
+                stream = tool.run_stream(iter(sys.stdin))
+            else:
+                stream = tool.run_stream(records)
+        except NotImplementedError:
+            stream = None
+    finally:
+        sys.argv = saved_argv
+    if stream is None:
+        return run_bytes(tool, argv, records)
+    return with_argv(argv, iter(stream))
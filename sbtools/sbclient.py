@@ -0,0 +1,143 @@
+import os
+import sys
+import socket
+
+# The client is started for every sbtools call it forwards, so this
+# module must not import anything beyond socket and os (and sys).
+
+# Frame types sent by the client.
+FRAME_CWD = 'c'
+FRAME_ARG = 'a'
+FRAME_ENV = 'v'
+FRAME_STDIN = 'i'
+FRAME_END = 'z'
+
+# Frame types sent by the server.
+FRAME_STDOUT = 'o'
+FRAME_STDERR = 'e'
+FRAME_EXIT = 'x'
+
+def get_socket_path():
+    """
+    Return the path of the sbtools server socket. The path is taken
+    from the SBTOOLS_SOCKET environment variable if it is set, and is
+    server.sock in the SBTools cache directory otherwise.
+    """
+    path = os.environ.get('SBTOOLS_SOCKET')
+    if path:
+        return path
+    cachedir = os.environ.get('SBTOOLS_CACHE_DIR')
+    if not cachedir:
+        cachedir = os.path.join(os.path.expanduser('~'), '.sbtools')
+    return os.path.join(cachedir, 'server.sock')
+
+def write_frame(f, kind, data=""):
+    """
+    Write a frame of type kind carrying the string data to the file
+    object f. A frame is the type character, the length of the data
+    in decimal, a colon, and the data.
+    """
+    f.write("%s%d:%s" % (kind, len(data), data))
+
+def read_frame(f):
+    """
+    Read a frame from the file object f and return (kind, data), or
+    (None, None) at the end of the stream.
+    """
+    kind = f.read(1)
+    if not kind:
+        return (None, None)
+    digits = ""
+    while True:
+        c = f.read(1)
+        if not c:
+            raise EOFError("Truncated frame.")
+        if c == ':':
+            break
+        digits += c
+    size = int(digits)
+    data = f.read(size)
+    if len(data) != size:
+        raise EOFError("Truncated frame.")
+    return (kind, data)
+
+def connect(path=None):
+    """
+    Return a socket connected to the sbtools server. A socket.error is
+    raised if no server is listening at path.
+    """
+    if path is None:
+        path = get_socket_path()
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+    except socket.error:
+        sock.close()
+        raise
+    return sock
+
+def send_request(sock, argv, cwd, environ, stdin=""):
+    """Send one command line and its context to the server."""
+    f = sock.makefile('wb')
+    try:
+        write_frame(f, FRAME_CWD, cwd)
+        for arg in argv:
+            write_frame(f, FRAME_ARG, arg)
+        for (key, value) in environ.items():
+            write_frame(f, FRAME_ENV, "%s=%s" % (key, value))
+        if stdin:
+            write_frame(f, FRAME_STDIN, stdin)
+        write_frame(f, FRAME_END)
+    finally:
+        f.close()
+
+def receive_response(sock, stdout, stderr):
+    """
+    Copy the output frames sent by the server to stdout and stderr as
+    they arrive and return the exit status of the command.
+    """
+    f = sock.makefile('rb')
+    try:
+        while True:
+            (kind, data) = read_frame(f)
+            if kind is None:
+                raise EOFError("The server closed the connection.")
+            elif kind == FRAME_STDOUT:
+                stdout.write(data)
+                stdout.flush()
+            elif kind == FRAME_STDERR:
+                stderr.write(data)
+                stderr.flush()
+            elif kind == FRAME_EXIT:
+                return int(data)
+    finally:
+        f.close()
+
+def main():
+    """
+    Entry point for the sbtools-client script.
+
+    The command line, working directory, environment, and (unless it
+    is a terminal) standard input are forwarded to the server started
+    by 'sbtools serve'. If no server is running, the command is run in
+    this process instead.
+    """
+    try:
+        sock = connect()
+    except socket.error:
+        from sbtools.sbtools import main as sbtools_main
+        sbtools_main()
+        return
+
+    stdin = ""
+    if not os.isatty(sys.stdin.fileno()):
+        stdin = sys.stdin.read()
+    argv = ['sbtools'] + sys.argv[1:]
+    try:
+        send_request(sock, argv, os.getcwd(), os.environ, stdin)
+        status = receive_response(sock, sys.stdout, sys.stderr)
+    except (socket.error, EOFError), e:
+        sys.stderr.write("sbtools-client: lost connection to the server: %s\n" % (e))
+        status = 1
+    sock.close()
+    sys.exit(status)
@@ -0,0 +1,115 @@
+import os
+import sys
+
+# The plug-in search configuration. By default, plug-ins are searched
+# for in every distribution on sys.path. Deployments whose plug-ins are
+# installed in a few directories can list them in the SBTOOLS_PATH
+# environment variable (separated by os.pathsep) or in the
+# configuration file ($SBTOOLS_CONFIG or ~/.sbtools/sbtools.cfg):
+#
+#   [discovery]
+#   plugin_path = /opt/sbtools/plugins
+#                 /srv/lab/plugins
+#   site_packages = no
+#
+# The directories are searched after sys.path, as sys.path entries are:
+# the eggs, egg-info directories, and dist-info directories in them
+# provide plug-ins named after their entry points. SBTOOLS_PATH, when
+# set, replaces plugin_path. With site_packages off (or the
+# SBTOOLS_NO_SITE_PACKAGES environment variable set), sys.path is only
+# searched for the builtin plug-ins of the SBTools distribution, so the
+# other distributions installed there are not scanned at all.
+
+CONFIG_SECTION = 'discovery'
+
+def get_config_file():
+    """
+    Return the path of the configuration file, which is taken from the
+    SBTOOLS_CONFIG environment variable if it is set and is
+    ~/.sbtools/sbtools.cfg otherwise.
+    """
+    path = os.environ.get('SBTOOLS_CONFIG')
+    if not path:
+        path = os.path.join(os.path.expanduser('~'), '.sbtools', 'sbtools.cfg')
+    return path
+
+def get_framework_entry():
+    """Return the path entry from which the sbtools package is imported."""
+    return os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def split_path(value):
+    """
+    Return the absolute directories in the os.pathsep or newline
+    separated list value, without empty items or duplicates.
+    """
+    dirs = []
+    for item in value.replace(os.pathsep, "\n").splitlines():
+        item = item.strip()
+        if not item:
+            continue
+        item = os.path.abspath(os.path.expanduser(item))
+        if item not in dirs:
+            dirs.append(item)
+    return dirs
+
+class DiscoveryConfig:
+    """
+    The plug-in search configuration: the plug-in directories searched
+    after sys.path and whether the distributions on sys.path (other
+    than SBTools itself) are searched.
+    """
+    def __init__(self, plugin_dirs=None, site_packages=True):
+        self.plugin_dirs = list(plugin_dirs or [])
+        self.site_packages = site_packages
+
+    def get_search_path(self):
+        """
+        Return the path entries in which plug-ins are searched for:
+        sys.path (or, if site_packages is False, only the entry of the
+        sbtools package) followed by the plug-in directories. These are
+        the entries covered by the registry cache fingerprint.
+        """
+        if self.site_packages:
+            entries = list(sys.path)
+        else:
+            entries = [get_framework_entry()]
+        return entries + [entry for entry in self.plugin_dirs if entry not in entries]
+
+    def get_location(self):
+        """
+        Return the plug-in directories as a discovery location (a tuple
+        of path entries searched like sys.path), or None if there are
+        none.
+        """
+        if not self.plugin_dirs:
+            return None
+        return tuple(self.plugin_dirs)
+
+def read_config(path=None, out=None):
+    """
+    Return the DiscoveryConfig read from the configuration file path
+    (see get_config_file()) and the environment. A missing file is not
+    an error; a file that cannot be read is reported on out
+    (sys.stderr by default) and ignored.
+    """
+    if path is None:
+        path = get_config_file()
+    config = DiscoveryConfig()
+    if os.path.isfile(path):
+        from ConfigParser import RawConfigParser, Error as ConfigParserError
+        parser = RawConfigParser()
+        try:
+            parser.read([path])
+            if parser.has_option(CONFIG_SECTION, 'plugin_path'):
+                config.plugin_dirs = split_path(parser.get(CONFIG_SECTION, 'plugin_path'))
+            if parser.has_option(CONFIG_SECTION, 'site_packages'):
+                config.site_packages = parser.getboolean(CONFIG_SECTION, 'site_packages')
+        except (ConfigParserError, ValueError), e:
+            (out or sys.stderr).write("WARNING: cannot read %s: %s\n" % (path, str(e).strip()))
+            config = DiscoveryConfig()
+
+    if os.environ.has_key('SBTOOLS_PATH'):
+        config.plugin_dirs = split_path(os.environ['SBTOOLS_PATH'])
+    if os.environ.get('SBTOOLS_NO_SITE_PACKAGES'):
+        config.site_packages = False
+    return config
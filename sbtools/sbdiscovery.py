@@ -0,0 +1,387 @@
+import os
+import sys
+from sbtool import index_plugin
+from sbregistry import PluginRecord, ToolHandle, LoadFailure, classify_load_error
+from sbregistry import get_distribution_fingerprint
+from sbprofile import NullTimer, sample_load_state
+from sbstatic import METADATA_FILE, parse_metadata
+from sbscan import DirectoryIndex, scan_distributions, select_distributions, label_distributions
+from sbimportlib import get_metadata_module, get_search_entries, find_distributions
+from sbconfig import get_framework_entry
+
+ENTRY_POINT_GROUP = 'SBTools.plugins'
+
+class DiscoveryReporter:
+    """
+    Writes the progress messages printed by 'sbtools --verbose-load'.
+    Nothing is written unless verbose is True.
+    """
+    def __init__(self, verbose=False, out=None):
+        self.verbose = verbose
+        self.out = out
+
+    def write(self, msg):
+        """Write msg if reporting is enabled."""
+        if self.verbose:
+            (self.out or sys.stdout).write(msg)
+
+    def end_distribution(self):
+        """End the line of messages written for a distribution."""
+        self.write("\n")
+
+class PluginCandidate:
+    """
+    A SBTools.plugins entry point moving through the discovery
+    pipeline. The name and subcommands are filled in when the entry
+    point name is validated, and cls and record when the plug-in is
+    loaded.
+    """
+    def __init__(self, dist, epldata, isbuiltin, toolname=None):
+        self.dist = dist
+        self.epldata = epldata
+        self.isbuiltin = isbuiltin
+        self.toolname = toolname
+        self.name = None
+        self.subcommands = None
+        self.cls = None
+        self.record = None
+
+    def get_entry_point(self):
+        """Return the pkg_resources.EntryPoint of this candidate."""
+        return self.dist.get_entry_info(ENTRY_POINT_GROUP, self.epldata)
+
+def locate_distributions(metadata, locations, builtin_project, builtin_only=False, reporter=None, timer=None):
+    """
+    Yield (dist, isbuiltin, toolname) tuples for the distributions
+    found in locations, in order.
+
+    The locations list may contain None, which stands for the
+    environment built from sys.path, tuples of path entries that are
+    searched like sys.path (such as the configured plug-in
+    directories, see sbconfig), and supplementary plug-in directories.
+    Each location is scanned once through metadata. Plug-ins found in
+    supplementary directories are named after their distribution, so
+    toolname is the project name for those and None otherwise. If
+    builtin_only is True, only the distribution named builtin_project
+    is used from the sys.path environment; it is never used from the
+    other locations.
+    """
+    if reporter is None:
+        reporter = DiscoveryReporter()
+    if timer is None:
+        timer = NullTimer()
+    for location in locations:
+        token = timer.start("environment scan")
+        pkg_env = metadata.get_environment(location)
+        timer.stop(token)
+        for name in pkg_env:
+            reporter.write("Found '%s' package..." % (name))
+            dist = pkg_env[name][0]
+            if location is None:
+                if name == builtin_project:
+                    yield (dist, True, None)
+                elif not builtin_only:
+                    yield (dist, False, None)
+            elif isinstance(location, tuple):
+                if name != builtin_project:
+                    yield (dist, False, None)
+            else:
+                yield (dist, False, dist.project_name)
+
+def read_entry_points(dists, reporter=None):
+    """
+    Yield a PluginCandidate for each SBTools.plugins entry point of
+    the distributions produced by locate_distributions().
+    """
+    if reporter is None:
+        reporter = DiscoveryReporter()
+    for (dist, isbuiltin, toolname) in dists:
+        for epldata in dist.get_entry_map(ENTRY_POINT_GROUP):
+            yield PluginCandidate(dist, epldata, isbuiltin, toolname)
+        reporter.end_distribution()
+
+def validate_entry_points(candidates, reporter=None):
+    """
+    Fill in the tool name and subcommands of each candidate and yield
+    the candidates whose entry point names provide both.
+    """
+    if reporter is None:
+        reporter = DiscoveryReporter()
+    for candidate in candidates:
+        pdatasplit = candidate.epldata.split()
+        if len(pdatasplit) == 0:
+            # Then no plug-in name (or subcommands) was provided.
+            reporter.write("Un-named plug-in...cannot load...")
+            continue
+        elif len(pdatasplit) == 1:
+            # Then no plug-in subcommands were provided.
+            reporter.write("'%s' plug-in...no subcommands...cannot load..." % (pdatasplit[0]))
+            continue
+        reporter.write("'%s' plug-in..." % (pdatasplit[0]))
+        candidate.name = candidate.toolname or pdatasplit[0]
+        candidate.subcommands = pdatasplit[1:]
+        yield candidate
+
+def load_plugins(candidates, lazy=False, reporter=None, timer=None, load_report=None, failures=None):
+    """
+    Load each candidate and yield the ones that loaded successfully.
+
+    If lazy is True, nothing is imported; each candidate gets a
+    ToolHandle that loads the plug-in when it is used. Otherwise, the
+    distribution is activated and the entry point is loaded, and the
+    candidates that fail to load are reported and dropped. The cost of
+    loading each candidate is added to load_report, if given.
+
+    If failures is a dictionary of LoadFailure objects (see
+    RegistryCache.load_failures()), candidates recorded in it as
+    failing are reported and dropped without being loaded, as long as
+    their distribution is unchanged. The dictionary is updated with
+    the outcome of each load. If lazy is True, failures may instead be
+    a FailureLog, which is given to the ToolHandles.
+    """
+    if reporter is None:
+        reporter = DiscoveryReporter()
+    if timer is None:
+        timer = NullTimer()
+    for candidate in candidates:
+        entry_point = candidate.get_entry_point()
+        candidate.record = make_record(candidate.dist, entry_point, candidate.name,
+                                       candidate.isbuiltin, candidate.subcommands,
+                                       read_static_metadata(candidate.dist, entry_point.name.split()[0]))
+        if lazy:
+            candidate.cls = ToolHandle(candidate.record, candidate.dist, entry_point, failures)
+            yield candidate
+            continue
+
+        fingerprint = None
+        if failures is not None:
+            fingerprint = get_distribution_fingerprint(candidate.dist)
+            key = (candidate.dist.location, candidate.epldata)
+            failure = failures.get(key)
+            if failure is not None and failure.fingerprint == fingerprint:
+                reporter.write("%s (cached)..." % (failure.get_error()))
+                continue
+
+        token = timer.start("entry point loading (%s)" % (candidate.dist.project_name))
+        before = sample_load_state()
+        activated = None
+        error_class = None
+        try:
+            candidate.dist.activate()
+            activated = sample_load_state()
+            cls = entry_point.load()
+        except Exception, e:
+            error_class = classify_load_error(e)
+            if error_class is None:
+                raise
+            message = str(e)
+        timer.stop(token)
+        error = None
+        if error_class is not None:
+            failure = LoadFailure(candidate.dist.project_name, candidate.dist.location,
+                                  candidate.epldata, error_class, message, fingerprint)
+            error = failure.get_error()
+            if failures is not None:
+                failures[key] = failure
+        elif failures is not None and failures.has_key(key):
+            del failures[key]
+        if load_report is not None:
+            load_report.add(candidate.name, candidate.dist.project_name,
+                            before, activated, sample_load_state(), error)
+        if error is not None:
+            reporter.write("%s..." % (error))
+            continue
+        reporter.write("loaded...")
+        index_plugin(cls, candidate.record)
+        candidate.cls = cls
+        yield candidate
+
+class DiscoveryBackend:
+    """
+    Parent class of the discovery backends, which find the
+    distributions that may provide plug-ins for the discovery
+    pipeline.
+
+    The distributions a backend yields provide the part of the
+    pkg_resources.Distribution interface that the pipeline uses:
+    project_name, version, location, get_entry_map(),
+    get_entry_info(), has_metadata(), get_metadata(), activate(), and
+    requires(); their entry points provide name, module_name, attrs,
+    extras, and load(). Since every backend feeds the same pipeline,
+    plug-ins are registered, and their conflicts resolved, the same
+    way whichever backend found them.
+    """
+    name = None
+    # What the backend needs, for the warning given when it was asked
+    # for but is not available.
+    requirement = None
+
+    def is_available(self):
+        """Return True if the backend can be used in this interpreter."""
+        return True
+
+    def locate(self, locations, builtin_project, builtin_only=False, reporter=None, timer=None):
+        """
+        Yield (dist, isbuiltin, toolname) tuples for the distributions
+        found in locations, as locate_distributions() does.
+        """
+        raise NotImplementedError
+
+class EnvironmentBackend(DiscoveryBackend):
+    """Finds distributions with pkg_resources environments."""
+    name = 'pkg_resources'
+
+    def __init__(self, metadata):
+        self.metadata = metadata
+
+    def locate(self, locations, builtin_project, builtin_only=False, reporter=None, timer=None):
+        return locate_distributions(self.metadata, locations, builtin_project,
+                                    builtin_only, reporter, timer)
+
+class ScanBackend(DiscoveryBackend):
+    """
+    Finds distributions with the entry point scanner of sbscan. If a
+    sbscan.DirectoryIndex is given, directories are only read again
+    when they change.
+    """
+    name = 'scan'
+
+    def __init__(self, index=None):
+        self.index = index
+
+    def locate(self, locations, builtin_project, builtin_only=False, reporter=None, timer=None):
+        if timer is None:
+            timer = NullTimer()
+        token = timer.start("entry point scan")
+        dists = list(scan_distributions(locations, ENTRY_POINT_GROUP, builtin_project,
+                                        builtin_only, reporter, self.index))
+        timer.stop(token)
+        return dists
+
+class ImportlibMetadataBackend(DiscoveryBackend):
+    """
+    Finds distributions with importlib.metadata (or the
+    importlib_metadata backport), keeping the highest version of each
+    project as the other backends do. If builtin_only is True, only
+    the builtin project is looked for on sys.path, and only in the
+    path entry the framework is imported from (see
+    sbconfig.get_framework_entry()), so the other distributions
+    installed there are not read.
+
+    Python 2 has no importlib.metadata, so there the backend is only
+    available if the importlib_metadata backport is installed.
+    """
+    name = 'importlib'
+    requirement = "importlib.metadata (Python 3.8) or the importlib_metadata package"
+
+    def __init__(self):
+        self.module = None
+
+    def get_module(self):
+        """Return the importlib.metadata module, or None."""
+        if self.module is None:
+            self.module = get_metadata_module()
+        return self.module
+
+    def is_available(self):
+        return self.get_module() is not None
+
+    def locate(self, locations, builtin_project, builtin_only=False, reporter=None, timer=None):
+        if timer is None:
+            timer = NullTimer()
+        token = timer.start("entry point scan")
+        found = []
+        for location in locations:
+            project = None
+            entries = get_search_entries(location)
+            if location is None and builtin_only:
+                project = builtin_project
+                entries = [get_framework_entry()]
+            dists = find_distributions(self.get_module(), entries, ENTRY_POINT_GROUP, project)
+            found.extend(label_distributions(location, select_distributions(dists),
+                                             builtin_project, builtin_only, reporter))
+        timer.stop(token)
+        return found
+
+def get_discovery_backend(metadata, name=None, cache=None, out=None):
+    """
+    Return the backend used for lazy discovery: the backend named
+    name, or by the SBTOOLS_DISCOVERY environment variable, if it is
+    available, and otherwise the importlib.metadata backend where it
+    is available and the entry point scanner elsewhere. The
+    pkg_resources backend scans through metadata. If the RegistryCache
+    cache is given, the entry point scanner keeps its per-directory
+    index in it.
+
+    A warning is written to out (sys.stderr by default) if the named
+    backend is unknown or not available.
+    """
+    if name is None:
+        name = os.environ.get('SBTOOLS_DISCOVERY')
+    index = None
+    if cache is not None:
+        index = DirectoryIndex(cache)
+    backends = [ImportlibMetadataBackend(), ScanBackend(index), EnvironmentBackend(metadata)]
+    warning = None
+    for backend in backends:
+        if backend.name == name:
+            if backend.is_available():
+                return backend
+            warning = "the '%s' discovery backend needs %s" % (name, backend.requirement)
+    if name and warning is None:
+        warning = "unknown discovery backend '%s'" % (name)
+    for backend in backends:
+        if backend.is_available():
+            if warning is not None:
+                (out or sys.stderr).write("WARNING: %s; using '%s'.\n" % (warning, backend.name))
+            return backend
+
+def discover_plugins(metadata, locations, builtin_project, builtin_only=False, lazy=False, reporter=None, timer=None, load_report=None, failures=None, backend=None):
+    """
+    Run the discovery pipeline over locations and yield the loaded
+    PluginCandidate objects in discovery order. The time spent
+    scanning and loading is recorded with timer, and the cost of
+    loading each plug-in with load_report, if given. Known load
+    failures are skipped and new ones recorded in failures, if given
+    (see load_plugins()).
+
+    The distributions are found by the DiscoveryBackend backend, or
+    with pkg_resources environments built through metadata if backend
+    is None.
+    """
+    if backend is None:
+        backend = EnvironmentBackend(metadata)
+    dists = backend.locate(locations, builtin_project, builtin_only, reporter, timer)
+    candidates = read_entry_points(dists, reporter)
+    candidates = validate_entry_points(candidates, reporter)
+    return load_plugins(candidates, lazy, reporter, timer, load_report, failures)
+
+def read_static_metadata(egg, toolname):
+    """
+    Return the static help and about metadata of the tool toolname
+    provided by the egg distribution, or None if there is none.
+    """
+    if not egg.has_metadata(METADATA_FILE):
+        return None
+    return parse_metadata(egg.get_metadata(METADATA_FILE)).get(toolname)
+
+def make_record(egg, entry_point, name, isbuiltin, subcommands, static=None):
+    """
+    Return a PluginRecord describing the plug-in defined by
+    entry_point of the egg distribution, with the static metadata
+    static.
+
+    Independently installed plug-ins record the location of the egg
+    and the requirements of the entry point, so the plug-in can be
+    imported from the registry cache and its requirements checked
+    when it is used.
+    """
+    paths = []
+    requires = []
+    if not isbuiltin:
+        paths.append(egg.location)
+        requires = [str(req) for req in egg.requires(entry_point.extras)]
+    return PluginRecord(name, subcommands, entry_point.module_name,
+                        entry_point.attrs, isbuiltin, egg.location,
+                        egg.version, paths, entry_point.name, requires, static,
+                        egg.project_name, getattr(egg, 'egg_info', None))
@@ -0,0 +1,102 @@
+import os
+import sys
+from sbscan import ScannedDistribution, EGG_NAME, get_python_version, safe_name, safe_version
+
+# Plug-in discovery through importlib.metadata (Python 3.8 and later)
+# or its importlib_metadata backport, which read the entry points of
+# installed distributions without importing pkg_resources. Python 2
+# has no importlib.metadata, so there this backend is only available
+# with the backport installed; without it, SBTOOLS_DISCOVERY=importlib
+# falls back to the entry point scanner with a warning (see
+# sbdiscovery.get_discovery_backend()).
+
+def get_metadata_module():
+    """
+    Return the importlib.metadata module, or the importlib_metadata
+    backport, or None if neither is available.
+    """
+    try:
+        from importlib import metadata
+    except ImportError:
+        try:
+            import importlib_metadata as metadata
+        except ImportError:
+            return None
+    return metadata
+
+class ImportlibDistribution(ScannedDistribution):
+    """
+    A ScannedDistribution for a distribution found through
+    importlib.metadata, whose metadata files are read through it.
+
+    Requirements are resolved with pkg_resources when an entry point
+    is loaded, like those of the distributions found by the scanner.
+    """
+    def __init__(self, dist, module, project_name, version, location, entry_points):
+        ScannedDistribution.__init__(self, project_name, version, location, None, entry_points)
+        self.dist = dist
+        self.module = module
+
+    def has_metadata(self, name):
+        """Return True if the metadata file name exists."""
+        return self.dist.read_text(name) is not None
+
+    def get_metadata(self, name):
+        """Return the contents of the metadata file name."""
+        return self.dist.read_text(name)
+
+def get_search_entries(location):
+    """
+    Return the path entries searched for location: the entries of
+    sys.path, without duplicates, if location is None, and otherwise
+    the directory location (or each directory in the tuple location)
+    followed by the eggs in it that are built for this version of
+    Python, since importlib.metadata only finds eggs that are path
+    entries themselves.
+    """
+    entries = []
+    if location is None:
+        for entry in sys.path:
+            if entry not in entries:
+                entries.append(entry)
+        return entries
+    if not isinstance(location, tuple):
+        location = (location,)
+    for directory in location:
+        if directory in entries:
+            continue
+        entries.append(directory)
+        try:
+            names = os.listdir(directory)
+        except OSError:
+            continue
+        names.sort()
+        for name in names:
+            if not name.lower().endswith('.egg'):
+                continue
+            match = EGG_NAME(name[:-len('.egg')])
+            if match and match.group('pyver') in (None, get_python_version()):
+                entries.append(os.path.join(directory, name))
+    return entries
+
+def find_distributions(module, entries, group, project=None):
+    """
+    Yield an ImportlibDistribution for each distribution on the path
+    entries that defines entry points of group, using the
+    importlib.metadata module module. If project is given, only the
+    distributions of that project are read.
+    """
+    if project is None:
+        dists = module.distributions(path=entries)
+    else:
+        dists = module.distributions(name=project, path=entries)
+    for dist in dists:
+        entry_points = [(ep.name, ep.value) for ep in dist.entry_points if ep.group == group]
+        if not entry_points:
+            continue
+        name = dist.metadata['Name']
+        if not name:
+            continue
+        location = str(dist.locate_file('')).rstrip('/' + os.sep) or os.curdir
+        yield ImportlibDistribution(dist, module, safe_name(name), safe_version(dist.version or ''),
+                                    location, {group: entry_points})
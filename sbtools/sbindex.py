@@ -0,0 +1,86 @@
+import os
+from sbregistry import PluginRecord
+
+# The generated dispatch table module, which is imported from the
+# per-user cache directory instead of scanning the environment while
+# it is current.
+DISPATCH_MODULE = 'sbdispatch'
+
+def get_dispatch_table_file(cachedir):
+    """
+    Return the path of the generated dispatch table module in the
+    cache directory cachedir (see sbregistry.get_cache_dir()).
+    """
+    return os.path.join(cachedir, DISPATCH_MODULE + '.py')
+
+def write_dispatch_table(path, searchpath, fingerprint, records):
+    """
+    Write a Python module to path that contains the plug-in records,
+    the search path they were discovered on, and the fingerprint of
+    that search path, and byte-compile it. The directory of path is
+    created if it does not exist.
+    """
+    lines = ["# Generated by 'sbtools rebuild-index'; do not edit.",
+             "FINGERPRINT = %r" % (fingerprint),
+             "SEARCHPATH = %r" % (list(searchpath)),
+             "RECORDS = ["]
+    for rec in records:
+        lines.append("    %r," % (rec.to_dict()))
+    lines.append("]")
+
+    dirname = os.path.dirname(path)
+    if dirname and not os.path.isdir(dirname):
+        os.makedirs(dirname)
+    f = open(path, 'w')
+    try:
+        f.write("\n".join(lines) + "\n")
+    finally:
+        f.close()
+    import py_compile
+    py_compile.compile(path, doraise=True)
+
+def remove_dispatch_table(path):
+    """
+    Remove the dispatch table module at path and its byte-compiled
+    files. Returns True if a table was removed.
+    """
+    removed = False
+    for fname in (path, path + 'c', path + 'o'):
+        if os.path.exists(fname):
+            os.remove(fname)
+            removed = True
+    return removed
+
+def read_dispatch_table(module, searchpath, fingerprint):
+    """
+    Return the PluginRecord objects of the dispatch table module if
+    it was generated for searchpath and fingerprint, and None if it is
+    stale.
+    """
+    try:
+        if module.SEARCHPATH != list(searchpath) or module.FINGERPRINT != fingerprint:
+            return None
+        return [PluginRecord.from_dict(d) for d in module.RECORDS]
+    except (AttributeError, KeyError, TypeError):
+        return None
+
+def load_dispatch_table(cachedir, searchpath, fingerprint):
+    """
+    Import the generated dispatch table from the cache directory
+    cachedir and return its records, or None if there is no table or
+    it is stale. Only cachedir is searched for the module.
+    """
+    import imp
+    try:
+        (f, path, description) = imp.find_module(DISPATCH_MODULE, [cachedir])
+    except ImportError:
+        return None
+    try:
+        try:
+            module = imp.load_module(DISPATCH_MODULE, f, path, description)
+        except (ImportError, SyntaxError):
+            return None
+    finally:
+        if f is not None:
+            f.close()
+    return read_dispatch_table(module, searchpath, fingerprint)
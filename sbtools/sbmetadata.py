@@ -0,0 +1,108 @@
+import sys
+
+class DistributionMetadata:
+    """
+    A cache of the distributions that can be found on sys.path and in
+    supplementary plug-in locations.
+
+    Each location is scanned once and the resulting environments are
+    reused by SBTools, its tools, and their parsers. Path entries that
+    are added to sys.path later (for example, when eggs are activated)
+    are scanned incrementally the first time a lookup misses. Call
+    invalidate() after the contents of a location change.
+    """
+    def __init__(self):
+        self.environment = None
+        self.scanned = []
+        self.supp_environments = {} # location -> pkg_resources.Environment
+
+    def get_environment(self, location=None):
+        """
+        Return the pkg_resources.Environment for location (a directory
+        or a tuple of path entries), or for sys.path if location is
+        None.
+        """
+        import pkg_resources
+        if location is not None:
+            if not self.supp_environments.has_key(location):
+                if isinstance(location, tuple):
+                    search_path = list(location)
+                else:
+                    search_path = [location]
+                self.supp_environments[location] = pkg_resources.Environment(search_path)
+            return self.supp_environments[location]
+
+        if self.environment is None:
+            self.scanned = list(sys.path)
+            self.environment = pkg_resources.Environment(self.scanned)
+        return self.environment
+
+    def update_environment(self):
+        """
+        Scan the sys.path entries that were added since the environment
+        was built. Returns True if any new entries were scanned.
+        """
+        env = self.get_environment()
+        newentries = [entry for entry in sys.path if entry not in self.scanned]
+        if not newentries:
+            return False
+        self.scanned.extend(newentries)
+        env.scan(newentries)
+        return True
+
+    def get_distribution(self, project):
+        """
+        Return the preferred distribution of project, or None if the
+        project cannot be found.
+        """
+        dists = self.get_environment()[project]
+        if not dists and self.update_environment():
+            dists = self.get_environment()[project]
+        if not dists:
+            for env in self.supp_environments.values():
+                if env[project]:
+                    return env[project][0]
+            return None
+        return dists[0]
+
+    def get_version(self, project):
+        """
+        Return the version string of project. An IndexError is raised
+        if the project cannot be found.
+        """
+        dist = self.get_distribution(project)
+        if dist is None:
+            raise IndexError("Distribution '%s' not found." % (project))
+        return dist.version
+
+    def get_location(self, project):
+        """
+        Return the location of project. An IndexError is raised if the
+        project cannot be found.
+        """
+        dist = self.get_distribution(project)
+        if dist is None:
+            raise IndexError("Distribution '%s' not found." % (project))
+        return dist.location
+
+    def invalidate(self, location=None):
+        """
+        Forget the cached environment for location, or all cached
+        environments if location is None.
+        """
+        if location is None:
+            self.environment = None
+            self.scanned = []
+            self.supp_environments = {}
+        elif self.supp_environments.has_key(location):
+            del self.supp_environments[location]
+
+# The metadata cache shared by all SBTools objects in this process.
+shared_metadata = None
+
+def get_shared_metadata():
+    """Return the process-wide DistributionMetadata object."""
+    global shared_metadata
+    if shared_metadata is None:
+        shared_metadata = DistributionMetadata()
+    return shared_metadata
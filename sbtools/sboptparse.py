@@ -1,6 +1,5 @@
 from optparse import OptionParser
 import textwrap
-import pkg_resources
 from sbtool import SBToolError
 
 class SBToolsOptionParser(OptionParser):
@@ -8,31 +7,52 @@ class SBToolsOptionParser(OptionParser):
     This class overloads the OptionParser class to provide desired
     modified functionality for SBTools class.
     """
-    def __init__(self, sbtools, usage, version):
+    def __init__(self, sbtools, usage, version=None):
         self.sbtools = sbtools
-        OptionParser.__init__(self, usage=usage, version=version)
+        # Without a version, the version of the SBTools package is
+        # looked up the first time it is needed (see get_version()).
+        self.version_known = version is not None
+        OptionParser.__init__(self, usage=usage, version=version or "%prog")
+
+    def get_version(self):
+        """
+        Get the version string for this parser.
+        """
+        if not self.version_known:
+            self.version = "%%prog %s" % (self.sbtools.get_version())
+            self.version_known = True
+        return OptionParser.get_version(self)
+
+    # Lines of the help header, which are filled once per program name.
+    header_lines = ["Type '%prog help <subcommand>' for help on a specific subcommand.",
+                    "Type '%prog --version' to see the program version.",
+                    "Type '%prog --verbose-load' to see the packages and plug-ins detected, and if plug-ins are successfully loaded.",
+                    "Type '%prog --load-report' to see how long each plug-in takes to load.",
+                    "Type '%prog --timings <subcommand>' or '%prog --profile[=FILE] <subcommand>' to see where the time of a run is spent.",
+                    "Type '%prog --startup-report <subcommand>' to see how long sbtools takes to start."]
+    header_cache = {} # prog name -> filled header
+
+    def get_help_header(self):
+        """
+        Return the fixed part of the help string that follows the
+        usage line.
+        """
+        prog = self.get_prog_name()
+        if not self.header_cache.has_key(prog):
+            lines = [textwrap.fill(self.expand_prog_name(line), 78)
+                     for line in self.header_lines]
+            self.header_cache[prog] = "\n".join(lines + ["",
+                textwrap.fill("Subcommands consist of built-in subcommands and subcommands provided by installed plug-ins.", 78),
+                "", textwrap.fill("Set SBTOOLS_DISCOVERY to 'scan', 'importlib', or 'pkg_resources' to choose how plug-ins are found. The 'importlib' backend needs importlib.metadata (Python 3.8) or the importlib_metadata package, and is not available on Python 2 without it.", 78),
+                "", ""])
+        return self.header_cache[prog]
 
     def get_help(self):
         """
         Get help string for this parser.
         """
-        helpstr = ""
-        helpstr += self.get_usage()
-        helpstr += "\n"
-        helpstr += textwrap.fill(self.expand_prog_name("Type '%prog help <subcommand>' for help on a specific subcommand."), 78)
-        helpstr += "\n"
-        helpstr += textwrap.fill(self.expand_prog_name("Type '%prog --version' to see the program version."), 78)
-        helpstr += "\n"
-        helpstr += textwrap.fill(self.expand_prog_name("Type '%prog --verbose-load' to see the packages and plug-ins detected, and if plug-ins are successfully loaded."), 78)
-        helpstr += "\n\n"
-
-        helpstr += textwrap.fill("Subcommands consist of built-in subcommands and subcommands provided by installed plug-ins.", 78)
-        helpstr += "\n\n"
-
-        helpstr += "Available subcommands:\n"
-        helpstr += self.sbtools.get_subcommands()
-
-        return helpstr
+        return "".join([self.get_usage(), "\n", self.get_help_header(),
+                        "Available subcommands:\n", self.sbtools.get_subcommands()])
 
     def print_help(self):
         """
@@ -70,7 +90,6 @@ class SBToolOptionParser(OptionParser):
         self.tool = tool
         self.sbtools = sbtools
         if version is None:
-            pkg_env = pkg_resources.Environment()
             version = "%s %s" % (self.tool.get_name(), self.tool.get_version())
 
         OptionParser.__init__(self, usage=usage, version=version)
@@ -0,0 +1,226 @@
+import os
+import sys
+import time
+
+# The global options handled by main() before the SBTools object is
+# created, since they cover its construction as well.
+PROFILE_OPTION = '--profile'
+TIMINGS_OPTION = '--timings'
+STARTUP_REPORT_OPTION = '--startup-report'
+DEFAULT_PROFILE_FILE = 'sbtools.pstats'
+
+def get_cpu_time():
+    """Return the user and system CPU time used by this process."""
+    times = os.times()
+    return times[0] + times[1]
+
+def get_process_start_time():
+    """
+    Return the time at which this process was started, or None if it
+    cannot be determined (it is read from /proc on Linux).
+    """
+    try:
+        f = open('/proc/self/stat')
+        try:
+            stat = f.read()
+        finally:
+            f.close()
+        f = open('/proc/uptime')
+        try:
+            uptime = float(f.read().split()[0])
+        finally:
+            f.close()
+        # The command name in parentheses may contain spaces, so the
+        # fields are counted from after it.
+        fields = stat[stat.rindex(')')+2:].split()
+        started = float(fields[19]) / os.sysconf('SC_CLK_TCK')
+    except (IOError, OSError, ValueError, IndexError, AttributeError):
+        return None
+    return time.time() - (uptime - started)
+
+def get_memory_usage():
+    """
+    Return the resident memory of this process in bytes, or None if it
+    cannot be determined. The current size is read from /proc on
+    Linux; elsewhere the peak size reported by getrusage() is used.
+    """
+    try:
+        f = open('/proc/self/statm')
+        try:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+        finally:
+            f.close()
+    except (IOError, OSError, ValueError, IndexError, AttributeError):
+        pass
+    try:
+        import resource
+        # ru_maxrss is in kilobytes on Linux but in bytes on Mac OS X.
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        if sys.platform == 'darwin':
+            return maxrss
+        return maxrss * 1024
+    except (ImportError, AttributeError):
+        return None
+
+def sample_load_state():
+    """
+    Return the wall-clock time, the number of imported modules, and
+    the memory usage, for measuring the cost of loading a plug-in.
+    """
+    return (time.time(), len(sys.modules), get_memory_usage())
+
+def pop_global_options(argv):
+    """
+    Remove the --profile[=FILE], --timings, and --startup-report[=N]
+    options that come before the subcommand from the argument list
+    argv and return the profile file (None if profiling was not
+    requested), whether timings were requested, and the number of warm
+    runs of the startup report (None if it was not requested, 0 for
+    the default).
+    """
+    profile_file = None
+    timings = False
+    startup_runs = None
+    i = 1
+    while i < len(argv) and argv[i].startswith("-"):
+        arg = argv[i]
+        if arg == PROFILE_OPTION:
+            profile_file = DEFAULT_PROFILE_FILE
+        elif arg.startswith(PROFILE_OPTION + "="):
+            profile_file = arg[len(PROFILE_OPTION)+1:] or DEFAULT_PROFILE_FILE
+        elif arg == TIMINGS_OPTION:
+            timings = True
+        elif arg == STARTUP_REPORT_OPTION:
+            startup_runs = 0
+        elif arg.startswith(STARTUP_REPORT_OPTION + "="):
+            try:
+                startup_runs = max(int(arg[len(STARTUP_REPORT_OPTION)+1:]), 0)
+            except ValueError:
+                startup_runs = 0
+        else:
+            i += 1
+            continue
+        del argv[i]
+    return (profile_file, timings, startup_runs)
+
+def run_profiled(func, profile_file):
+    """
+    Call func under cProfile and write the statistics to profile_file
+    (in the format read by the pstats module), even if func raises an
+    exception. Returns the result of func.
+    """
+    import cProfile
+    profiler = cProfile.Profile()
+    try:
+        return profiler.runcall(func)
+    finally:
+        profiler.dump_stats(profile_file)
+        sys.stderr.write("Wrote profile to %s.\n" % (profile_file))
+
+class PhaseTimer:
+    """
+    Measures the wall-clock and CPU time spent in each phase of an
+    sbtools run for the --timings report. A phase that is timed more
+    than once accumulates its times.
+    """
+    def __init__(self):
+        self.phases = [] # [name, wall, cpu, count]
+        self.phasemap = {} # name -> entry in phases
+
+    def start(self, name):
+        """Start timing the phase name and return a token for stop()."""
+        return (name, time.time(), get_cpu_time())
+
+    def stop(self, token):
+        """Stop timing the phase started with token."""
+        (name, wall, cpu) = token
+        self.add(name, time.time() - wall, get_cpu_time() - cpu)
+
+    def add(self, name, wall, cpu):
+        """Add wall and CPU seconds to the phase name."""
+        if not self.phasemap.has_key(name):
+            entry = [name, 0.0, 0.0, 0]
+            self.phases.append(entry)
+            self.phasemap[name] = entry
+        entry = self.phasemap[name]
+        entry[1] += wall
+        entry[2] += cpu
+        entry[3] += 1
+
+    def add_startup(self):
+        """
+        Add the interpreter startup phase, from the start of the
+        process until now, if the start time is available.
+        """
+        started = get_process_start_time()
+        if started is not None:
+            self.add("interpreter startup", max(time.time() - started, 0.0), get_cpu_time())
+
+    def get_report(self):
+        """Return the timings as a formatted table."""
+        lines = ["%-40s %10s %10s %6s" % ("Phase", "Wall (ms)", "CPU (ms)", "Calls")]
+        for (name, wall, cpu, count) in self.phases:
+            lines.append("%-40s %10.1f %10.1f %6d" % (name, wall*1000, cpu*1000, count))
+        return "\n".join(lines) + "\n"
+
+    def report(self, out=None):
+        """Write the timings report to out (sys.stderr by default)."""
+        (out or sys.stderr).write(self.get_report())
+
+class NullTimer:
+    """A PhaseTimer that does nothing, used when timings are off."""
+    def start(self, name):
+        return None
+
+    def stop(self, token):
+        pass
+
+    def add(self, name, wall, cpu):
+        pass
+
+    def add_startup(self):
+        pass
+
+    def report(self, out=None):
+        pass
+
+class LoadReport:
+    """
+    The cost of loading each plug-in, for 'sbtools --load-report': the
+    time to activate its distribution, the time to import it, and the
+    modules and memory added by both steps.
+    """
+    def __init__(self):
+        self.entries = [] # [name, project, activate, import, modules, memory, error]
+
+    def add(self, name, project, before, activated, after, error=None):
+        """
+        Add the plug-in name of the distribution project, given the
+        sample_load_state() results taken before loading started,
+        after the distribution was activated (None if activation
+        failed), and after loading ended.
+        """
+        if activated is None:
+            activated = after
+        memory = None
+        if before[2] is not None and after[2] is not None:
+            memory = after[2] - before[2]
+        self.entries.append([name, project, activated[0] - before[0],
+                             after[0] - activated[0], after[1] - before[1],
+                             memory, error])
+
+    def get_report(self):
+        """Return the report as a table, slowest plug-in first."""
+        entries = self.entries[:]
+        entries.sort(key=lambda entry: entry[2] + entry[3], reverse=True)
+        lines = ["%-30s %13s %11s %8s %11s  %s" % ("Plug-in (distribution)", "Activate (ms)",
+                                                 "Import (ms)", "Modules", "Memory (KB)", "Status")]
+        for (name, project, activate, imp, modules, memory, error) in entries:
+            if memory is None:
+                memstr = "?"
+            else:
+                memstr = "%d" % (memory / 1024)
+            lines.append("%-30s %13.1f %11.1f %8d %11s  %s" % ("%s (%s)" % (name, project),
+                                                             activate*1000, imp*1000, modules,
+                                                             memstr, error or "loaded"))
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,589 @@
+import os
+import sys
+try:
+    from hashlib import md5
+except ImportError:
+    from md5 import new as md5
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+from sbtool import PluginLoadError, index_plugin
+
+def get_cache_dir():
+    """
+    Return the directory in which SBTools stores its caches. The
+    directory is taken from the SBTOOLS_CACHE_DIR environment variable
+    if it is set, and is ~/.sbtools otherwise.
+    """
+    cachedir = os.environ.get('SBTOOLS_CACHE_DIR')
+    if not cachedir:
+        cachedir = os.path.join(os.path.expanduser('~'), '.sbtools')
+    return cachedir
+
+class PluginRecord:
+    """
+    A description of a registered plug-in. Records hold everything
+    needed to register the plug-in again without scanning the
+    environment: the tool name, its subcommands, the entry point
+    target, whether the tool is builtin, the location and version of
+    the distribution providing it, the path entries needed to import
+    it, the requirements to check before importing it, the static
+    help and about metadata of the tool (see the sbstatic module), if
+    its distribution provides it, and the project name and metadata
+    directory of the distribution, from which its fingerprint is
+    taken (see get_distribution_fingerprint()).
+    """
+    def __init__(self, name, subcommands, module_name, attrs, isbuiltin,
+                 location, version, paths=[], epldata=None, requires=[],
+                 static=None, project=None, egg_info=None):
+        self.name = name
+        self.subcommands = list(subcommands)
+        self.epldata = epldata
+        self.module_name = module_name
+        self.attrs = tuple(attrs)
+        self.isbuiltin = isbuiltin
+        self.location = location
+        self.version = version
+        self.paths = list(paths)
+        self.requires = list(requires)
+        self.static = static
+        self.project = project
+        self.egg_info = egg_info
+
+    def get_epldata(self):
+        """
+        Return the left-hand side of the entry point that defines this
+        plug-in.
+        """
+        if self.epldata is not None:
+            return self.epldata
+        return " ".join([self.name] + self.subcommands)
+
+    def get_target(self):
+        """
+        Return the right-hand side of the entry point that defines this
+        plug-in (e.g., 'sbtools.builtins:Help').
+        """
+        return "%s:%s" % (self.module_name, ".".join(self.attrs))
+
+    def get_fingerprint(self):
+        """
+        Return the fingerprint of the distribution providing the
+        plug-in, as get_distribution_fingerprint() does for the
+        distribution itself.
+        """
+        return fingerprint_distribution(self.project, self.version, self.location, self.egg_info)
+
+    def load(self):
+        """
+        Import and return the plug-in class. The path entries recorded
+        for the plug-in are added to sys.path first, and the recorded
+        requirements, if any, are resolved and activated. The
+        exceptions raised by pkg_resources.require() propagate.
+        pkg_resources is only imported here, for the plug-ins that are
+        loaded.
+
+        The class is added to the plug-in index.
+        """
+        for path in self.paths:
+            if path not in sys.path:
+                sys.path.append(path)
+        if self.requires:
+            import pkg_resources
+            for path in self.paths:
+                if path not in pkg_resources.working_set.entries:
+                    pkg_resources.working_set.add_entry(path)
+            pkg_resources.require(*self.requires)
+        obj = __import__(self.module_name, {}, {}, ['__name__'])
+        for attr in self.attrs:
+            try:
+                obj = getattr(obj, attr)
+            except AttributeError:
+                raise ImportError("%r has no %r attribute" % (obj, attr))
+        index_plugin(obj, self)
+        return obj
+
+    def to_dict(self):
+        """Return the record as a dictionary suitable for storing."""
+        return {'name': self.name,
+                'subcommands': self.subcommands,
+                'module_name': self.module_name,
+                'attrs': self.attrs,
+                'isbuiltin': self.isbuiltin,
+                'location': self.location,
+                'version': self.version,
+                'paths': self.paths,
+                'epldata': self.epldata,
+                'requires': self.requires,
+                'static': self.static,
+                'project': self.project,
+                'egg_info': self.egg_info}
+
+    def from_dict(cls, data):
+        """Create a record from a dictionary made by to_dict()."""
+        return cls(data['name'], data['subcommands'], data['module_name'],
+                   data['attrs'], data['isbuiltin'], data['location'],
+                   data['version'], data['paths'], data['epldata'],
+                   data['requires'], data.get('static'), data.get('project'),
+                   data.get('egg_info'))
+    from_dict = classmethod(from_dict)
+
+class ToolHandle:
+    """
+    A lightweight stand-in for a plug-in class that is stored in the
+    subcommand and name maps when plug-ins are registered lazily.
+
+    The plug-in is only imported when the handle is loaded, which
+    happens the first time the handle is called to create a tool. A
+    handle created during discovery loads through the entry point of
+    the distribution (activating it and resolving its requirements);
+    a handle restored from the registry cache loads through its
+    PluginRecord.
+
+    If the handle is given a FailureLog, a plug-in recorded in it as
+    failing is not imported again while its distribution is
+    unchanged, and new failures are added to it.
+    """
+    def __init__(self, record, egg=None, entry_point=None, failures=None):
+        self.record = record
+        self.egg = egg
+        self.entry_point = entry_point
+        self.failures = failures
+        self.name = record.name
+        self.subcommands = record.subcommands
+        self.isbuiltin = record.isbuiltin
+        self.cls = None
+
+    def __repr__(self):
+        return "<ToolHandle %s = %s>" % (self.record.get_epldata(),
+                                         self.record.get_target())
+
+    def __call__(self, sbtools):
+        """Load the plug-in class and return a new tool object."""
+        return self.load()(sbtools)
+
+    def is_loaded(self):
+        """Returns True if the plug-in class has been imported."""
+        return self.cls is not None
+
+    def load(self):
+        """
+        Import and return the plug-in class. A PluginLoadError is
+        raised if the plug-in cannot be loaded.
+        """
+        if self.cls is not None:
+            return self.cls
+
+        key = (self.record.location, self.record.get_epldata())
+        fingerprint = None
+        if self.failures is not None:
+            fingerprint = self.record.get_fingerprint()
+            failure = self.failures.lookup(key, fingerprint)
+            if failure is not None:
+                raise PluginLoadError("Cannot load the %s plug-in (%s)." % (self.name, failure.get_error()))
+
+        try:
+            if self.entry_point is not None:
+                self.egg.activate()
+                cls = self.entry_point.load()
+                index_plugin(cls, self.record)
+            else:
+                cls = self.record.load()
+        except Exception, e:
+            error_class = classify_load_error(e)
+            if error_class is None:
+                raise
+            failure = LoadFailure(self.record.project, self.record.location, key[1],
+                                  error_class, str(e), fingerprint)
+            if self.failures is not None:
+                self.failures.add(failure)
+            raise PluginLoadError("Cannot load the %s plug-in (%s)." % (self.name, failure.get_error()))
+        if self.failures is not None:
+            self.failures.discard(key)
+        self.cls = cls
+        return cls
+
+class LoadFailure:
+    """
+    A plug-in that failed to load: the distribution and entry point
+    defining it, the class and message of the error, and a fingerprint
+    of the distribution metadata (see get_distribution_fingerprint()),
+    so the failure is only trusted while the distribution is
+    unchanged.
+    """
+    def __init__(self, project, location, epldata, error_class, message, fingerprint):
+        self.project = project
+        self.location = location
+        self.epldata = epldata
+        self.error_class = error_class
+        self.message = message
+        self.fingerprint = fingerprint
+
+    def get_key(self):
+        """Return the key identifying the plug-in that failed."""
+        return (self.location, self.epldata)
+
+    def get_error(self):
+        """
+        Return the description of the error, as reported by
+        'sbtools --verbose-load'.
+        """
+        return describe_load_error(self.error_class, self.message)
+
+    def to_dict(self):
+        """Return the failure as a dictionary suitable for storing."""
+        return {'project': self.project,
+                'location': self.location,
+                'epldata': self.epldata,
+                'error_class': self.error_class,
+                'message': self.message,
+                'fingerprint': self.fingerprint}
+
+    def from_dict(cls, data):
+        """Create a failure from a dictionary made by to_dict()."""
+        return cls(data['project'], data['location'], data['epldata'],
+                   data['error_class'], data['message'], data['fingerprint'])
+    from_dict = classmethod(from_dict)
+
+class FailureLog:
+    """
+    The load failures of the plug-ins found on a search path, shared
+    by the ToolHandles registered from it. The failures are read from
+    the RegistryCache (see RegistryCache.load_failures()) the first
+    time a handle is loaded and are written back whenever they change.
+    The fingerprint of the search path is taken then as well, if it
+    is not given.
+    """
+    def __init__(self, cache, locations, fingerprint=None):
+        self.cache = cache
+        self.locations = list(locations)
+        self.fingerprint = fingerprint
+        self.failures = None # key -> LoadFailure, once read
+
+    def get_failures(self):
+        """Return the dictionary of failures, reading it if needed."""
+        if self.failures is None:
+            if self.fingerprint is None:
+                self.fingerprint = self.cache.get_fingerprint(self.locations)
+            self.failures = self.cache.load_failures(self.locations, self.fingerprint)
+        return self.failures
+
+    def lookup(self, key, fingerprint):
+        """
+        Return the LoadFailure recorded for the plug-in key (see
+        LoadFailure.get_key()) if its distribution fingerprint is
+        fingerprint, and None otherwise.
+        """
+        failure = self.get_failures().get(key)
+        if failure is not None and failure.fingerprint == fingerprint:
+            return failure
+        return None
+
+    def add(self, failure):
+        """Record the LoadFailure failure and store the failures."""
+        self.get_failures()[failure.get_key()] = failure
+        self.cache.store_failures(self.locations, self.fingerprint, self.failures)
+
+    def discard(self, key):
+        """
+        Forget the failure of the plug-in key, if any, and store the
+        failures.
+        """
+        if self.get_failures().has_key(key):
+            del self.failures[key]
+            self.cache.store_failures(self.locations, self.fingerprint, self.failures)
+
+def classify_load_error(e):
+    """
+    Return the class of plug-in load error that the exception e
+    belongs to ('VersionConflict', 'DistributionNotFound',
+    'ResolutionError', or 'ImportError'), or None if e is not a load
+    error.
+
+    pkg_resources is not imported here: its exceptions can only have
+    been raised if it was imported already.
+    """
+    if isinstance(e, ImportError):
+        return 'ImportError'
+    pkg_resources = sys.modules.get('pkg_resources')
+    if pkg_resources is not None:
+        for error_class in (pkg_resources.VersionConflict,
+                            pkg_resources.DistributionNotFound,
+                            pkg_resources.ResolutionError):
+            if isinstance(e, error_class):
+                return error_class.__name__
+    return None
+
+# The reported description of each class of load error.
+load_error_descriptions = {'VersionConflict': "version conflict",
+                           'DistributionNotFound': "missing dependency",
+                           'ResolutionError': "cannot resolve requirements",
+                           'ImportError': "cannot import"}
+
+def describe_load_error(error_class, message):
+    """
+    Return the description of a load error of class error_class (see
+    classify_load_error()) with message, as reported to the user.
+    """
+    return "%s: %s" % (load_error_descriptions.get(error_class, error_class), message)
+
+def get_distribution_fingerprint(egg):
+    """
+    Return a fingerprint of the egg distribution: its name, version,
+    and location, and the modification time and size of the location
+    and of the metadata directory.
+    """
+    return fingerprint_distribution(egg.project_name, egg.version, egg.location,
+                                    getattr(egg, 'egg_info', None))
+
+def fingerprint_distribution(project, version, location, egg_info):
+    """
+    Return the fingerprint of the distribution of project with version
+    at location whose metadata directory is egg_info (None if it is
+    not known), see get_distribution_fingerprint().
+    """
+    parts = [project, version, location]
+    for path in (location, egg_info):
+        try:
+            st = os.stat(path)
+            parts.append((st.st_mtime, st.st_size))
+        except (OSError, TypeError):
+            parts.append(None)
+    return md5(repr(parts)).hexdigest()
+
+class RegistryCache:
+    """
+    A persistent, on-disk cache of the plug-in registry.
+
+    Each cache file is tied to a context (the path entries searched
+    and whether only builtin plug-ins are loaded) and stores the
+    records of the plug-ins loaded in that context together with a
+    fingerprint of the path entries. A cached registry is only used
+    while the fingerprint matches, so the cache is rebuilt when
+    distributions are installed, removed, or modified.
+    """
+    metadata_suffixes = ('.egg', '.egg-info', '.dist-info', '.egg-link', '.pth')
+
+    def __init__(self, cachedir=None):
+        if cachedir is None:
+            cachedir = get_cache_dir()
+        self.cachedir = cachedir
+
+    def is_enabled(self):
+        """
+        Return False if caching has been disabled with the
+        SBTOOLS_NO_CACHE environment variable.
+        """
+        return not os.environ.get('SBTOOLS_NO_CACHE')
+
+    def get_cache_file(self, locations, builtin_only):
+        """
+        Return the path of the cache file for the context defined by
+        locations and builtin_only.
+        """
+        context = repr((sys.version, tuple(locations), bool(builtin_only)))
+        return os.path.join(self.cachedir,
+                            "registry-%s.cache" % (md5(context).hexdigest()))
+
+    def get_fingerprint(self, locations):
+        """
+        Return a fingerprint of the path entries in locations.
+
+        The fingerprint covers the modification time and size of every
+        entry and, for directories, of the distribution metadata files
+        and directories it contains (eggs, egg-info and dist-info
+        directories, egg-links, and .pth files), including their
+        entry_points.txt files.
+        """
+        fp = md5()
+        for loc in locations:
+            # An empty entry stands for the current directory.
+            path = loc or os.curdir
+            fp.update("%s\0%s\n" % (loc, self._stat(path)))
+            if not os.path.isdir(path):
+                continue
+            try:
+                names = os.listdir(path)
+            except OSError:
+                continue
+            names.sort()
+            for name in names:
+                if not name.lower().endswith(self.metadata_suffixes):
+                    continue
+                path = os.path.join(loc or os.curdir, name)
+                fp.update("%s\0%s\n" % (name, self._stat(path)))
+                for epfile in (os.path.join(path, 'entry_points.txt'),
+                               os.path.join(path, 'EGG-INFO', 'entry_points.txt')):
+                    if os.path.exists(epfile):
+                        fp.update("%s\0%s\n" % (epfile, self._stat(epfile)))
+        return fp.hexdigest()
+
+    def _stat(self, path):
+        """Return the modification time and size of path, if it exists."""
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        return (st.st_mtime, st.st_size)
+
+    def load(self, locations, builtin_only, fingerprint):
+        """
+        Return the list of PluginRecord objects cached for the context
+        or None if there is no cached registry matching fingerprint.
+        """
+        data = self._read_data(self.get_cache_file(locations, builtin_only), fingerprint)
+        if data is None:
+            return None
+        try:
+            return [PluginRecord.from_dict(d) for d in data['records']]
+        except (KeyError, TypeError):
+            return None
+
+    def store(self, locations, builtin_only, fingerprint, records):
+        """
+        Store the records for the context. Failing to write the cache
+        is not an error; the registry is simply rebuilt next time.
+        """
+        self._write_data(self.get_cache_file(locations, builtin_only),
+                         {'fingerprint': fingerprint,
+                          'records': [rec.to_dict() for rec in records]})
+
+    def get_listing_file(self, locations):
+        """
+        Return the path of the file holding the rendered subcommand
+        listing for the plug-ins found on locations.
+        """
+        context = repr((sys.version, tuple(locations)))
+        return os.path.join(self.cachedir,
+                            "listing-%s.cache" % (md5(context).hexdigest()))
+
+    def load_listing(self, locations, fingerprint):
+        """
+        Return the subcommand listing stored for locations, or None if
+        there is none matching fingerprint.
+        """
+        data = self._read_data(self.get_listing_file(locations), fingerprint)
+        if data is None:
+            return None
+        return data.get('listing')
+
+    def store_listing(self, locations, fingerprint, listing):
+        """
+        Store the subcommand listing for locations. As with store(),
+        failing to write the file is not an error.
+        """
+        self._write_data(self.get_listing_file(locations),
+                         {'fingerprint': fingerprint, 'listing': listing})
+
+    def get_failure_file(self, locations):
+        """
+        Return the path of the file holding the plug-in load failures
+        for the plug-ins found on locations.
+        """
+        context = repr((sys.version, tuple(locations)))
+        return os.path.join(self.cachedir,
+                            "failures-%s.cache" % (md5(context).hexdigest()))
+
+    def load_failures(self, locations, fingerprint):
+        """
+        Return a dictionary mapping the keys of the plug-ins that
+        failed to load from locations (see LoadFailure.get_key()) to
+        their LoadFailure objects. The dictionary is empty if no
+        failures were stored with fingerprint.
+        """
+        data = self._read_data(self.get_failure_file(locations), fingerprint)
+        if data is None:
+            return {}
+        try:
+            failures = [LoadFailure.from_dict(d) for d in data['failures']]
+        except (KeyError, TypeError):
+            return {}
+        return dict([(failure.get_key(), failure) for failure in failures])
+
+    def store_failures(self, locations, fingerprint, failures):
+        """
+        Store the LoadFailure objects in the dictionary failures for
+        locations. As with store(), failing to write the file is not
+        an error.
+        """
+        self._write_data(self.get_failure_file(locations),
+                         {'fingerprint': fingerprint,
+                          'failures': [failure.to_dict() for failure in failures.values()]})
+
+    def get_directory_file(self, entry, group):
+        """
+        Return the path of the file holding the scan of the directory
+        entry for distributions defining entry points of group.
+        """
+        context = repr((sys.version, entry, group))
+        return os.path.join(self.cachedir,
+                            "directory-%s.cache" % (md5(context).hexdigest()))
+
+    def load_directory(self, entry, group, fingerprint):
+        """
+        Return the list of distribution dictionaries stored for the
+        directory entry (see sbscan.DirectoryIndex), or None if there
+        is none matching fingerprint.
+        """
+        data = self._read_data(self.get_directory_file(entry, group), fingerprint)
+        if data is None:
+            return None
+        return data.get('dists')
+
+    def store_directory(self, entry, group, fingerprint, dists):
+        """
+        Store the distribution dictionaries dists for the directory
+        entry. As with store(), failing to write the file is not an
+        error.
+        """
+        self._write_data(self.get_directory_file(entry, group),
+                         {'fingerprint': fingerprint, 'dists': dists})
+
+    def _read_data(self, path, fingerprint):
+        """
+        Return the dictionary stored in the file path, or None if it
+        cannot be read or was not stored with fingerprint.
+        """
+        try:
+            f = open(path, 'rb')
+            try:
+                data = pickle.load(f)
+            finally:
+                f.close()
+        except (IOError, OSError, EOFError, pickle.UnpicklingError):
+            return None
+        try:
+            if data['fingerprint'] != fingerprint:
+                return None
+        except (KeyError, TypeError):
+            return None
+        return data
+
+    def _write_data(self, path, data):
+        """
+        Store the dictionary data in the file path, replacing it
+        atomically. Errors are ignored.
+        """
+        tmpfile = "%s.%d" % (path, os.getpid())
+        try:
+            if not os.path.isdir(self.cachedir):
+                os.makedirs(self.cachedir)
+            f = open(tmpfile, 'wb')
+            try:
+                pickle.dump(data, f, pickle.HIGHEST_PROTOCOL)
+            finally:
+                f.close()
+            os.rename(tmpfile, path)
+        except (IOError, OSError):
+            try:
+                os.remove(tmpfile)
+            except OSError:
+                pass
+
+    def clear(self, locations, builtin_only):
+        """Remove the cached registry for the context, if any."""
+        try:
+            os.remove(self.get_cache_file(locations, builtin_only))
+        except OSError:
+            pass
@@ -0,0 +1,349 @@
+import os
+import sys
+import stat
+import time
+try:
+    from hashlib import md5
+except ImportError:
+    from md5 import new as md5
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+from sbregistry import get_cache_dir
+
+# The default limit on the total size of the result cache, in bytes.
+DEFAULT_MAX_SIZE = 256*1024*1024
+
+def parse_size(sizestr):
+    """
+    Return the number of bytes in sizestr, which is a whole number
+    optionally followed by K, M, or G. A ValueError is raised if
+    sizestr is not a valid size.
+    """
+    units = {'K': 1024, 'M': 1024**2, 'G': 1024**3}
+    sizestr = sizestr.strip().upper()
+    factor = 1
+    if sizestr and units.has_key(sizestr[-1]):
+        factor = units[sizestr[-1]]
+        sizestr = sizestr[:-1]
+    size = int(sizestr) * factor
+    if size < 0:
+        raise ValueError("Negative size.")
+    return size
+
+def hash_file(path):
+    """Return the MD5 hex digest of the contents of the file at path."""
+    digest = md5()
+    f = open(path, 'rb')
+    try:
+        while True:
+            data = f.read(65536)
+            if not data:
+                break
+            digest.update(data)
+    finally:
+        f.close()
+    return digest.hexdigest()
+
+def get_stdin_digest(stdin):
+    """
+    Return the string that stands for the standard input stream stdin
+    in a cache key: 'tty' for a terminal, whose input is not read, and
+    the MD5 hex digest of the remaining input for a regular file or an
+    in-memory stream (such as the input of a request to the sbtools
+    server), which is left unread. None is returned for input that
+    cannot be read without consuming it, such as a pipe, so results
+    are not cached for it.
+    """
+    if hasattr(stdin, 'getvalue'):
+        return md5(stdin.getvalue()[stdin.tell():]).hexdigest()
+    try:
+        fd = stdin.fileno()
+        if os.isatty(fd):
+            return 'tty'
+        if not stat.S_ISREG(os.fstat(fd).st_mode):
+            return None
+        position = os.lseek(fd, 0, 1)
+        digest = md5()
+        try:
+            while True:
+                data = os.read(fd, 65536)
+                if not data:
+                    break
+                digest.update(data)
+        finally:
+            os.lseek(fd, position, 0)
+        return digest.hexdigest()
+    except (AttributeError, ValueError, IOError, OSError):
+        return None
+
+class TeeWriter:
+    """
+    A file-like object that writes everything to the file object f
+    and also keeps a copy of it.
+    """
+    def __init__(self, f):
+        self.f = f
+        self.data = []
+        self.softspace = 0
+
+    def write(self, data):
+        self.f.write(data)
+        if isinstance(data, unicode):
+            data = data.encode('utf-8')
+        self.data.append(data)
+
+    def writelines(self, lines):
+        for line in lines:
+            self.write(line)
+
+    def flush(self):
+        self.f.flush()
+
+    def isatty(self):
+        return False
+
+    def getvalue(self):
+        """Return everything written so far."""
+        return "".join(self.data)
+
+class CachedResult:
+    """
+    A stored run of a cacheable tool: its standard output and the
+    output files it wrote, kept in the directory path.
+    """
+    def __init__(self, key, path, data):
+        self.key = key
+        self.path = path
+        self.tool = data['tool']
+        self.argv = data['argv']
+        self.stdout = data['stdout']
+        self.files = data['files'] # [(output path, stored name)]
+        self.size = data['size']
+        self.created = data['created']
+
+    def get_last_used(self):
+        """Return the time the result was last stored or replayed."""
+        try:
+            return os.stat(os.path.join(self.path, 'result')).st_mtime
+        except OSError:
+            return 0
+
+    def replay(self, stdout=None):
+        """
+        Write the stored output to stdout (sys.stdout by default) and
+        restore the output files.
+        """
+        import shutil
+        if stdout is None:
+            stdout = sys.stdout
+        for (fname, stored) in self.files:
+            dirname = os.path.dirname(fname)
+            if dirname and not os.path.isdir(dirname):
+                os.makedirs(dirname)
+            shutil.copyfile(os.path.join(self.path, stored), fname)
+        stdout.write(self.stdout)
+
+class ResultCache:
+    """
+    A persistent, content-addressed cache of the results of cacheable
+    tools.
+
+    A result is keyed by the tool name and version, the current
+    directory, the command line, and the contents of the input files
+    named on the command line, so it is replayed only while all of them
+    are unchanged. The total size of the cache on disk is kept under
+    max_size by evicting the least recently used results.
+    """
+    def __init__(self, cachedir=None, max_size=None):
+        if cachedir is None:
+            cachedir = os.path.join(get_cache_dir(), 'results')
+        if max_size is None:
+            max_size = DEFAULT_MAX_SIZE
+            if os.environ.get('SBTOOLS_RESULT_CACHE_SIZE'):
+                try:
+                    max_size = parse_size(os.environ['SBTOOLS_RESULT_CACHE_SIZE'])
+                except ValueError:
+                    pass
+        self.cachedir = cachedir
+        self.max_size = max_size
+
+    def is_enabled(self):
+        """
+        Return False if result caching has been disabled with the
+        SBTOOLS_NO_RESULT_CACHE environment variable.
+        """
+        return not os.environ.get('SBTOOLS_NO_RESULT_CACHE')
+
+    def get_key(self, name, version, args, output_files=[], stdin_digest='tty'):
+        """
+        Return the cache key of running the tool name at version with
+        the arguments args (the command line without the program name
+        and the subcommand) in the current directory, which relative
+        file names in args refer to, and with the standard input
+        described by stdin_digest (see get_stdin_digest()).
+
+        Every argument, or value of a --option=value argument, that
+        names an existing file is keyed by the contents of the file as
+        well. The output files of the tool are keyed by name only,
+        since they are left over from earlier runs.
+        """
+        outputs = [os.path.abspath(fname) for fname in output_files]
+        key = md5()
+        key.update("%s\0%s\n" % (name, version))
+        key.update("%s\n" % (os.getcwd()))
+        key.update("%s\n" % (stdin_digest))
+        for arg in args:
+            key.update("%s\n" % (arg))
+            for value in (arg, arg.split('=', 1)[-1]):
+                if os.path.isfile(value) and os.path.abspath(value) not in outputs:
+                    key.update("%s\0%s\n" % (value, hash_file(value)))
+        return key.hexdigest()
+
+    def get_result_dir(self, key):
+        """Return the directory holding the result stored for key."""
+        return os.path.join(self.cachedir, key)
+
+    def read_result(self, path, key):
+        """Return the CachedResult stored in path, or None."""
+        try:
+            f = open(os.path.join(path, 'result'), 'rb')
+            try:
+                return CachedResult(key, path, pickle.load(f))
+            finally:
+                f.close()
+        except (IOError, OSError, EOFError, pickle.UnpicklingError, KeyError, TypeError):
+            return None
+
+    def lookup(self, key):
+        """
+        Return the CachedResult for key, or None if nothing is stored.
+        The result is marked as used.
+        """
+        path = self.get_result_dir(key)
+        result = self.read_result(path, key)
+        if result is not None:
+            try:
+                os.utime(os.path.join(path, 'result'), None)
+            except OSError:
+                pass
+        return result
+
+    def store(self, key, tool, argv, stdout, output_files=[]):
+        """
+        Store the output of a successful run for key and evict old
+        results if the cache grew too large. Output files that do not
+        exist are skipped. Failing to write the cache is not an error.
+        """
+        import shutil
+        path = self.get_result_dir(key)
+        tmpdir = "%s.%d.tmp" % (path, os.getpid())
+        try:
+            if os.path.isdir(path):
+                return
+            os.makedirs(tmpdir)
+            files = []
+            size = len(stdout)
+            for fname in output_files:
+                if not os.path.isfile(fname):
+                    continue
+                stored = "file%d" % (len(files))
+                shutil.copyfile(fname, os.path.join(tmpdir, stored))
+                size += os.path.getsize(fname)
+                files.append((fname, stored))
+            data = {'tool': tool, 'argv': list(argv), 'stdout': stdout,
+                    'files': files, 'size': size, 'created': time.time()}
+            f = open(os.path.join(tmpdir, 'result'), 'wb')
+            try:
+                pickle.dump(data, f, pickle.HIGHEST_PROTOCOL)
+            finally:
+                f.close()
+            os.rename(tmpdir, path)
+        except (IOError, OSError):
+            shutil.rmtree(tmpdir, True)
+            return
+        self.prune()
+
+    def get_results(self):
+        """
+        Return the stored CachedResult objects, most recently used
+        first.
+        """
+        try:
+            names = os.listdir(self.cachedir)
+        except OSError:
+            return []
+        results = []
+        for name in names:
+            if name.endswith('.tmp'):
+                continue
+            result = self.read_result(os.path.join(self.cachedir, name), name)
+            if result is not None:
+                results.append((result.get_last_used(), result))
+        results.sort(reverse=True)
+        return [result for (last_used, result) in results]
+
+    def get_size(self):
+        """Return the total size of the stored results."""
+        return sum([result.size for result in self.get_results()])
+
+    def get_entries(self):
+        """
+        Return the (last used, size on disk, directory) of every stored
+        result, most recently used first. Only the file system is
+        consulted, so no result is read.
+        """
+        try:
+            names = os.listdir(self.cachedir)
+        except OSError:
+            return []
+        entries = []
+        for name in names:
+            if name.endswith('.tmp'):
+                continue
+            path = os.path.join(self.cachedir, name)
+            try:
+                last_used = os.stat(os.path.join(path, 'result')).st_mtime
+                size = sum([os.path.getsize(os.path.join(path, fname))
+                            for fname in os.listdir(path)])
+            except OSError:
+                continue
+            entries.append((last_used, size, path))
+        entries.sort(reverse=True)
+        return entries
+
+    def remove(self, result):
+        """Remove the stored result."""
+        import shutil
+        shutil.rmtree(result.path, True)
+
+    def prune(self, max_size=None):
+        """
+        Remove the least recently used results until the total size of
+        the cache on disk is at most max_size (self.max_size by
+        default). Returns the number of results removed.
+
+        Sizes and last use times are taken from the file system (see
+        get_entries()), so pruning after every store() does not read
+        the stored results.
+        """
+        import shutil
+        if max_size is None:
+            max_size = self.max_size
+        entries = self.get_entries()
+        total = sum([size for (last_used, size, path) in entries])
+        removed = 0
+        while entries and total > max_size:
+            (last_used, size, path) = entries.pop()
+            shutil.rmtree(path, True)
+            total -= size
+            removed += 1
+        return removed
+
+    def clear(self):
+        """Remove every stored result. Returns the number removed."""
+        results = self.get_results()
+        for result in results:
+            self.remove(result)
+        return len(results)
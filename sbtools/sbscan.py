@@ -0,0 +1,454 @@
+import os
+import re
+import sys
+
+# A lightweight replacement for pkg_resources.Environment when looking
+# for plug-ins. Building an Environment parses and indexes every
+# distribution on the search path, while plug-in discovery only needs
+# the few that define SBTools.plugins entry points. The scanner lists
+# each path entry and reads nothing but the entry_points.txt file of
+# the egg-info and dist-info directories, unzipped eggs, and zipped
+# eggs (without extracting them) it finds there, and only keeps the
+# distributions with an [SBTools.plugins] section.
+
+ENTRY_POINTS_FILE = 'entry_points.txt'
+
+# The name, version, and Python version of an egg or egg-info file
+# name, as in pkg_resources.
+EGG_NAME = re.compile(r"(?P<name>[^-]+)(-(?P<version>[^-]+)(-py(?P<pyver>[^-]+)(-(?P<plat>.+))?)?)?$",
+                      re.IGNORECASE).match
+
+VERSION_COMPONENT = re.compile(r'(\d+|[a-z]+|\.|-)')
+VERSION_REPLACEMENTS = {'pre': 'c', 'preview': 'c', '-': 'final-', 'rc': 'c', 'dev': '@'}
+
+def safe_name(name):
+    """Return name with runs of unsafe characters replaced by '-'."""
+    return re.sub('[^A-Za-z0-9.]+', '-', name)
+
+def safe_version(version):
+    """Return version with spaces and unsafe characters replaced."""
+    return re.sub('[^A-Za-z0-9.]+', '-', version.replace(' ', '.'))
+
+def parse_version(version):
+    """
+    Return a key that orders version strings the way the setuptools
+    releases contemporary with SBTools do: numeric components compare
+    numerically, and pre-release tags (such as 'a1' or 'dev') sort
+    before the final release.
+    """
+    parts = []
+    for part in VERSION_COMPONENT.split(version.lower()):
+        part = VERSION_REPLACEMENTS.get(part, part)
+        if not part or part == '.':
+            continue
+        if part[:1] in '0123456789':
+            part = part.zfill(8)
+        else:
+            part = '*' + part
+            if part < '*final':
+                # Remove '-' before a pre-release tag.
+                while parts and parts[-1] == '*final-':
+                    parts.pop()
+            # Remove trailing zeros before any tag.
+            while parts and parts[-1] == '00000000':
+                parts.pop()
+        parts.append(part)
+    while parts and parts[-1] == '00000000':
+        parts.pop()
+    parts.append('*final')
+    return tuple(parts)
+
+def get_python_version():
+    """Return the 'X.Y' version of this interpreter."""
+    return "%d.%d" % sys.version_info[:2]
+
+def parse_entry_points(text, group):
+    """
+    Return the (name, value) pairs of the entry points of group in
+    the entry_points.txt text, in order.
+    """
+    entries = []
+    section = None
+    for line in text.splitlines():
+        line = line.strip()
+        if not line or line.startswith(('#', ';')):
+            continue
+        if line.startswith('['):
+            section = line.strip('[]').strip()
+        elif section == group and '=' in line:
+            (name, value) = line.split('=', 1)
+            entries.append((name.strip(), value.strip()))
+    return entries
+
+class ScannedEntryPoint:
+    """
+    An entry point read by the scanner, with the attributes of a
+    pkg_resources.EntryPoint that plug-in discovery uses.
+    """
+    def __init__(self, name, value, dist):
+        self.name = name
+        self.dist = dist
+        self.extras = ()
+        if '[' in value:
+            (value, extras) = value.split('[', 1)
+            self.extras = tuple([extra.strip() for extra in extras.rstrip(']').split(',') if extra.strip()])
+        (module_name, sep, attrs) = value.strip().partition(':')
+        self.module_name = module_name.strip()
+        self.attrs = tuple([attr for attr in attrs.strip().split('.') if attr])
+        if not self.module_name:
+            raise ValueError("Invalid entry point '%s = %s'." % (name, value))
+
+    def __str__(self):
+        return "%s = %s:%s" % (self.name, self.module_name, ".".join(self.attrs))
+
+    def load(self):
+        """
+        Check the requirements of the entry point and import and return
+        its target. The exceptions raised by pkg_resources.require()
+        and an ImportError if the target cannot be imported propagate.
+        """
+        self.dist.check_requirements(self.extras)
+        obj = __import__(self.module_name, {}, {}, ['__name__'])
+        for attr in self.attrs:
+            try:
+                obj = getattr(obj, attr)
+            except AttributeError:
+                raise ImportError("%r has no %r attribute" % (obj, attr))
+        return obj
+
+class ScannedDistribution:
+    """
+    A distribution found by the scanner, with the attributes and
+    methods of a pkg_resources.Distribution that plug-in discovery
+    uses. The location is the path entry that makes the distribution
+    importable and egg_info is its metadata directory (or, for zipped
+    eggs, the egg file and the metadata directory inside it).
+
+    Requirements are only checked, with pkg_resources, when an entry
+    point of a distribution that is not builtin is loaded.
+    """
+    def __init__(self, project_name, version, location, egg_info, entry_points,
+                 zipped=False, isbuiltin=False):
+        self.project_name = project_name
+        self.key = project_name.lower()
+        self.version = version
+        self.location = location
+        self.egg_info = egg_info
+        self.zipped = zipped
+        self.isbuiltin = isbuiltin
+        self.entry_points = entry_points # {group: [(name, value)]}
+
+    def __repr__(self):
+        return "%s %s (%s)" % (self.project_name, self.version, self.location)
+
+    def to_dict(self):
+        """Return the distribution as a dictionary for DirectoryIndex."""
+        return {'project_name': self.project_name, 'version': self.version,
+                'location': self.location, 'egg_info': self.egg_info,
+                'entry_points': self.entry_points, 'zipped': self.zipped}
+
+    def from_dict(cls, data):
+        """Return the distribution described by the dictionary data."""
+        return cls(data['project_name'], data['version'], data['location'],
+                   data['egg_info'], data['entry_points'], data['zipped'])
+    from_dict = classmethod(from_dict)
+
+    def get_entry_map(self, group):
+        """Return a dictionary mapping names to entry points of group."""
+        entry_map = {}
+        for (name, value) in self.entry_points.get(group, []):
+            try:
+                entry_map[name] = ScannedEntryPoint(name, value, self)
+            except ValueError:
+                continue
+        return entry_map
+
+    def get_entry_info(self, group, name):
+        """Return the entry point name of group, or None."""
+        return self.get_entry_map(group).get(name)
+
+    def has_metadata(self, name):
+        """Return True if the metadata file name exists."""
+        if self.zipped:
+            import zipfile
+            try:
+                archive = zipfile.ZipFile(self.location)
+                try:
+                    archive.getinfo("EGG-INFO/%s" % (name))
+                finally:
+                    archive.close()
+            except (IOError, KeyError, zipfile.BadZipfile):
+                return False
+            return True
+        return os.path.isfile(os.path.join(self.egg_info, name))
+
+    def get_metadata(self, name):
+        """Return the contents of the metadata file name."""
+        return read_metadata(self.location, self.egg_info, name, self.zipped)
+
+    def activate(self):
+        """Add the location of the distribution to sys.path."""
+        if self.location not in sys.path:
+            sys.path.append(self.location)
+
+    def get_requirement(self, extras=()):
+        """Return the requirement string that selects this distribution."""
+        if extras:
+            return "%s[%s]==%s" % (self.project_name, ",".join(extras), self.version)
+        return "%s==%s" % (self.project_name, self.version)
+
+    def requires(self, extras=()):
+        """
+        Return the requirements to check before loading an entry point
+        with extras: the distribution itself, which pkg_resources
+        resolves together with its dependencies. Builtin distributions
+        have none.
+        """
+        if self.isbuiltin:
+            return []
+        return [self.get_requirement(extras)]
+
+    def check_requirements(self, extras=()):
+        """
+        Resolve and activate the requirements of the distribution with
+        pkg_resources. The exceptions raised by pkg_resources.require()
+        propagate.
+        """
+        requires = self.requires(extras)
+        if not requires:
+            return
+        import pkg_resources
+        if self.location not in pkg_resources.working_set.entries:
+            pkg_resources.working_set.add_entry(self.location)
+        pkg_resources.require(*requires)
+
+def read_metadata(location, egg_info, name, zipped=False):
+    """
+    Return the contents of the metadata file name of the distribution
+    at location with metadata directory egg_info, or None if it does
+    not exist.
+    """
+    if zipped:
+        import zipfile
+        try:
+            archive = zipfile.ZipFile(location)
+            try:
+                return archive.read("EGG-INFO/%s" % (name))
+            finally:
+                archive.close()
+        except (IOError, KeyError, zipfile.BadZipfile):
+            return None
+    try:
+        f = open(os.path.join(egg_info, name))
+        try:
+            return f.read()
+        finally:
+            f.close()
+    except (IOError, OSError):
+        return None
+
+def read_version(location, egg_info, zipped=False):
+    """
+    Return the version in the PKG-INFO (or METADATA) file of a
+    distribution whose name does not include it, or None.
+    """
+    for name in ('PKG-INFO', 'METADATA'):
+        data = read_metadata(location, egg_info, name, zipped)
+        if data is None:
+            continue
+        for line in data.splitlines():
+            if line.startswith('Version:'):
+                return safe_version(line[len('Version:'):].strip())
+            if not line.strip():
+                break
+    return None
+
+def get_project_key(name):
+    """
+    Return the lowercase project name of the egg, egg-info, or
+    dist-info file name name, or None if it names no distribution.
+    """
+    (basename, ext) = os.path.splitext(name)
+    if ext.lower() not in ('.egg', '.egg-info', '.dist-info'):
+        return None
+    match = EGG_NAME(basename)
+    if not match:
+        return None
+    return safe_name(match.group('name')).lower()
+
+def scan_path_entry(entry, group, project=None):
+    """
+    Yield a ScannedDistribution for each distribution in the path
+    entry entry (a directory or a zipped egg) whose entry_points.txt
+    file defines entry points of group, in directory order. If project
+    is given, only the distributions of the project with that
+    lowercase name are read.
+    """
+    path = entry or os.curdir
+    if os.path.isfile(path):
+        name = os.path.basename(path)
+        if name.lower().endswith('.egg') and project in (None, get_project_key(name)):
+            dist = scan_distribution(entry, path, name, group)
+            if dist is not None:
+                yield dist
+        return
+    try:
+        names = os.listdir(path)
+    except OSError:
+        return
+    names.sort()
+    for name in names:
+        key = get_project_key(name)
+        if key is None or project not in (None, key):
+            continue
+        dist = scan_distribution(entry, os.path.join(path, name), name, group)
+        if dist is not None:
+            yield dist
+
+def scan_distribution(entry, path, name, group):
+    """
+    Return a ScannedDistribution for the egg, egg-info, or dist-info
+    at path (named name, in the path entry entry), or None if it does
+    not define entry points of group or is built for another version
+    of Python.
+    """
+    lower = name.lower()
+    zipped = False
+    if lower.endswith('.dist-info'):
+        (basename, location, egg_info) = (name[:-len('.dist-info')], entry, path)
+    elif lower.endswith('.egg-info'):
+        (basename, location, egg_info) = (name[:-len('.egg-info')], entry, path)
+    else:
+        (basename, location, egg_info) = (name[:-len('.egg')], path, os.path.join(path, 'EGG-INFO'))
+        zipped = os.path.isfile(path)
+    if not zipped and not os.path.isdir(egg_info):
+        return None
+    match = EGG_NAME(basename)
+    if not match:
+        return None
+    pyver = match.group('pyver')
+    if pyver and pyver != get_python_version():
+        return None
+
+    text = read_metadata(location, egg_info, ENTRY_POINTS_FILE, zipped)
+    if not text or ("[%s]" % (group)) not in text:
+        return None
+    entry_points = parse_entry_points(text, group)
+    if not entry_points:
+        return None
+
+    version = match.group('version')
+    if version:
+        version = safe_version(version)
+    else:
+        version = read_version(location, egg_info, zipped)
+    return ScannedDistribution(safe_name(match.group('name')), version, location or os.curdir,
+                               egg_info, {group: entry_points}, zipped)
+
+def select_distributions(dists):
+    """
+    Return the highest version of each project among the
+    distributions dists, in the order the projects were first found.
+    """
+    best = {} # key -> distribution
+    order = []
+    for dist in dists:
+        if not best.has_key(dist.key):
+            best[dist.key] = dist
+            order.append(dist.key)
+        elif parse_version(dist.version or '') > parse_version(best[dist.key].version or ''):
+            best[dist.key] = dist
+    return [best[key] for key in order]
+
+def label_distributions(location, dists, builtin_project, builtin_only=False, reporter=None):
+    """
+    Yield (dist, isbuiltin, toolname) tuples for the distributions
+    dists found in location (None for sys.path), as
+    sbdiscovery.locate_distributions() does. The builtin project is
+    recognized by its lowercase key.
+    """
+    builtin_key = builtin_project.lower()
+    for dist in dists:
+        if reporter is not None:
+            reporter.write("Found '%s' package..." % (dist.key))
+        if location is None:
+            if dist.key == builtin_key:
+                dist.isbuiltin = True
+                yield (dist, True, None)
+            elif not builtin_only:
+                yield (dist, False, None)
+        elif isinstance(location, tuple):
+            # The builtin project is only taken from sys.path.
+            if dist.key != builtin_key:
+                yield (dist, False, None)
+        else:
+            yield (dist, False, dist.project_name)
+
+def scan_distributions(locations, group, builtin_project, builtin_only=False, reporter=None, index=None):
+    """
+    Yield (dist, isbuiltin, toolname) tuples for the distributions in
+    locations that define entry points of group, like
+    sbdiscovery.locate_distributions() but without building a
+    pkg_resources.Environment.
+
+    None in locations stands for sys.path and a tuple for path entries
+    searched like sys.path. As with an Environment, only the highest
+    version of each project found in a location is used.
+    Distributions are yielded in path order. If builtin_only is True,
+    only the distributions of the builtin project are read from
+    sys.path.
+
+    Directories are scanned through the DirectoryIndex index, if
+    given, so that unchanged directories are not read again.
+    """
+    for location in locations:
+        project = None
+        if location is None:
+            entries = sys.path
+            if builtin_only:
+                project = builtin_project.lower()
+        elif isinstance(location, tuple):
+            entries = location
+        else:
+            entries = [location]
+        dists = []
+        seen = {}
+        for entry in entries:
+            if seen.has_key(entry):
+                continue
+            seen[entry] = True
+            if index is not None and project is None:
+                dists.extend(index.scan(entry, group))
+            else:
+                dists.extend(scan_path_entry(entry, group, project))
+        for item in label_distributions(location, select_distributions(dists),
+                                        builtin_project, builtin_only, reporter):
+            yield item
+
+class DirectoryIndex:
+    """
+    A per-directory index of the distributions found by the scanner,
+    kept in a sbregistry.RegistryCache. The scan of a directory is
+    stored with a fingerprint of the directory and reused until the
+    directory changes, so when a distribution is installed or removed
+    only its directory is read again. Entries that are eggs or are not
+    absolute paths are always scanned.
+    """
+    def __init__(self, cache):
+        self.cache = cache
+
+    def scan(self, entry, group):
+        """Return the distributions scan_path_entry() finds in entry."""
+        if (not entry or not os.path.isabs(entry) or entry.lower().endswith('.egg') or
+            not os.path.isdir(entry)):
+            return list(scan_path_entry(entry, group))
+        fingerprint = self.cache.get_fingerprint([entry])
+        data = self.cache.load_directory(entry, group, fingerprint)
+        if data is not None:
+            try:
+                return [ScannedDistribution.from_dict(d) for d in data]
+            except (KeyError, TypeError):
+                pass
+        dists = list(scan_path_entry(entry, group))
+        self.cache.store_directory(entry, group, fingerprint, [dist.to_dict() for dist in dists])
+        return dists
@@ -0,0 +1,319 @@
+import os
+import sys
+import errno
+import socket
+import struct
+import traceback
+from StringIO import StringIO
+from sbclient import get_socket_path, read_frame, write_frame
+from sbclient import FRAME_CWD, FRAME_ARG, FRAME_ENV, FRAME_STDIN, FRAME_END
+from sbclient import FRAME_STDOUT, FRAME_STDERR, FRAME_EXIT
+
+# The socket option that returns the credentials of the peer of a Unix
+# domain socket, which the socket module of Python 2 does not define.
+SO_PEERCRED = getattr(socket, 'SO_PEERCRED', None)
+if SO_PEERCRED is None and sys.platform.startswith('linux'):
+    SO_PEERCRED = 17
+
+def get_peer_uid(conn):
+    """
+    Return the user ID of the process at the other end of the Unix
+    domain socket conn, or None if the platform cannot tell.
+    """
+    if SO_PEERCRED is None:
+        return None
+    size = struct.calcsize('3i')
+    try:
+        (pid, uid, gid) = struct.unpack('3i', conn.getsockopt(socket.SOL_SOCKET, SO_PEERCRED, size))
+    except (socket.error, struct.error):
+        return None
+    return uid
+
+class SBToolsServerError(Exception):
+    """An exception class for errors starting the sbtools server."""
+    def __init__(self, value):
+        self.value = str(value)
+    def __str__(self):
+        return self.value
+
+class FrameWriter:
+    """
+    A file-like object that sends everything written to it to the
+    client as frames of one type.
+    """
+    def __init__(self, f, kind):
+        self.f = f
+        self.kind = kind
+        self.softspace = 0
+
+    def write(self, data):
+        if isinstance(data, unicode):
+            data = data.encode('utf-8')
+        if data:
+            write_frame(self.f, self.kind, data)
+            self.f.flush()
+
+    def writelines(self, lines):
+        for line in lines:
+            self.write(line)
+
+    def flush(self):
+        self.f.flush()
+
+    def isatty(self):
+        return False
+
+class Request:
+    """A command line received from a client, with its context."""
+    def __init__(self):
+        self.cwd = None
+        self.argv = []
+        self.environ = {}
+        self.stdin = ""
+
+def read_request(f):
+    """
+    Read the frames of one request from the file object f and return
+    a Request, or None if the client sent nothing.
+    """
+    request = Request()
+    stdin = []
+    while True:
+        (kind, data) = read_frame(f)
+        if kind is None:
+            return None
+        elif kind == FRAME_CWD:
+            request.cwd = data
+        elif kind == FRAME_ARG:
+            request.argv.append(data)
+        elif kind == FRAME_ENV:
+            (key, value) = data.split('=', 1)
+            request.environ[key] = value
+        elif kind == FRAME_STDIN:
+            stdin.append(data)
+        elif kind == FRAME_END:
+            request.stdin = "".join(stdin)
+            return request
+
+class SBToolsServer:
+    """
+    Serves sbtools command lines sent by sbtools-client over a Unix
+    domain socket, using one resident SBTools object whose tool list
+    is built and whose plug-ins are imported once.
+
+    By default, requests are handled one at a time in the server
+    process, since each request temporarily takes over the working
+    directory, environment, sys.argv, and the standard streams of the
+    process. If forking is True, the server forks a child for each
+    request instead, so every request starts from the warm,
+    copy-on-write image of the server and its changes to global state
+    die with the child. Finished children are collected by a SIGCHLD
+    handler, so they do not linger as zombies while the server is
+    idle.
+
+    The server runs its requests with the privileges of its user, so
+    the socket is only accessible to that user, and connections from
+    processes of other users are closed without being served where
+    the platform reports the user of the peer (see get_peer_uid()).
+    """
+    def __init__(self, sbtools, path=None, forking=False, preload_modules=[]):
+        self.sbtools = sbtools
+        if path is None:
+            path = get_socket_path()
+        self.path = path
+        self.forking = forking
+        self.preload_modules = list(preload_modules)
+        self.children = []
+        self.sock = None
+
+    def preload(self):
+        """
+        Build the full tool list, import every plug-in, and import the
+        modules in preload_modules. Plug-ins that fail to load are left
+        to report the failure when they are dispatched, and modules that
+        cannot be imported are reported on sys.stderr.
+        """
+        self.sbtools.complete_tool_list()
+        self.sbtools.load_tools()
+        for modname in self.preload_modules:
+            try:
+                __import__(modname)
+            except ImportError, e:
+                sys.stderr.write("Cannot preload module '%s': %s\n" % (modname, e))
+
+    def bind(self):
+        """
+        Create the listening socket. A SBToolsServerError is raised if
+        another server is already listening at the socket path. The
+        socket is only readable and writable by the user of the server,
+        and its directory is created accessible to that user only.
+        """
+        if os.path.exists(self.path):
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                try:
+                    probe.connect(self.path)
+                except socket.error:
+                    # A stale socket left by a server that died.
+                    os.remove(self.path)
+                else:
+                    raise SBToolsServerError("An sbtools server is already running at %s." % (self.path))
+            finally:
+                probe.close()
+        sockdir = os.path.dirname(self.path)
+        if sockdir and not os.path.isdir(sockdir):
+            os.makedirs(sockdir, 0700)
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        # The umask keeps the socket private between bind() and chmod().
+        umask = os.umask(0177)
+        try:
+            self.sock.bind(self.path)
+        finally:
+            os.umask(umask)
+        os.chmod(self.path, 0600)
+        self.sock.listen(5)
+
+    def close(self):
+        """Close the listening socket and remove the socket file."""
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+
+    def serve_forever(self):
+        """Accept and handle connections until interrupted."""
+        if self.forking:
+            import signal
+            previous_handler = signal.signal(signal.SIGCHLD, self.handle_sigchld)
+        try:
+            while True:
+                try:
+                    (conn, addr) = self.sock.accept()
+                except socket.error, e:
+                    # SIGCHLD interrupts accept().
+                    if e.args[0] == errno.EINTR:
+                        continue
+                    raise
+                if not self.is_peer_allowed(conn):
+                    conn.close()
+                    continue
+                if self.forking:
+                    self.fork_connection(conn)
+                    continue
+                try:
+                    self.handle_connection(conn)
+                finally:
+                    conn.close()
+        finally:
+            if self.forking:
+                signal.signal(signal.SIGCHLD, previous_handler)
+            self.close()
+
+    def is_peer_allowed(self, conn):
+        """
+        Return False if conn comes from a process of another user than
+        the server's, and True otherwise.
+        """
+        uid = get_peer_uid(conn)
+        return uid is None or uid == os.getuid()
+
+    def handle_sigchld(self, signum, frame):
+        """The SIGCHLD handler of a forking server."""
+        self.reap_children()
+
+    def fork_connection(self, conn):
+        """
+        Handle conn in a child process. The child never returns; the
+        parent closes its copy of conn, collects finished children, and
+        returns the pid of the child.
+        """
+        pid = os.fork()
+        if pid == 0:
+            status = 1
+            try:
+                try:
+                    # The tools may wait for their own child processes.
+                    import signal
+                    signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+                    if self.sock is not None:
+                        self.sock.close()
+                    self.handle_connection(conn)
+                    conn.close()
+                    status = 0
+                except:
+                    traceback.print_exc()
+            finally:
+                os._exit(status)
+        conn.close()
+        self.children.append(pid)
+        self.reap_children()
+        return pid
+
+    def reap_children(self):
+        """
+        Collect the exit status of finished child processes. This may
+        run in the SIGCHLD handler while the list of children is being
+        changed, so a child may already have been removed.
+        """
+        for pid in self.children[:]:
+            try:
+                (wpid, status) = os.waitpid(pid, os.WNOHANG)
+            except OSError:
+                wpid = pid
+            if wpid == pid and pid in self.children:
+                self.children.remove(pid)
+
+    def handle_connection(self, conn):
+        """Read a request from conn, run it, and send the results."""
+        rfile = conn.makefile('rb')
+        wfile = conn.makefile('wb')
+        try:
+            try:
+                request = read_request(rfile)
+            except (EOFError, ValueError, socket.error):
+                return
+            if request is None:
+                return
+            try:
+                status = self.run_request(request, wfile)
+                write_frame(wfile, FRAME_EXIT, str(status))
+                wfile.flush()
+            except socket.error:
+                # The client went away.
+                pass
+        finally:
+            rfile.close()
+            wfile.close()
+
+    def run_request(self, request, wfile):
+        """
+        Run the command line of request with its working directory,
+        environment, and standard input, sending its output to wfile.
+        Returns the exit status.
+        """
+        saved_cwd = os.getcwd()
+        saved_environ = os.environ.copy()
+        saved_streams = (sys.stdin, sys.stdout, sys.stderr)
+        sys.stdin = StringIO(request.stdin)
+        sys.stdout = FrameWriter(wfile, FRAME_STDOUT)
+        sys.stderr = FrameWriter(wfile, FRAME_STDERR)
+        try:
+            try:
+                if request.cwd is not None:
+                    os.chdir(request.cwd)
+                os.environ.clear()
+                os.environ.update(request.environ)
+                return self.sbtools.invoke(request.argv)
+            except (KeyboardInterrupt, socket.error):
+                raise
+            except Exception:
+                traceback.print_exc()
+                return 1
+        finally:
+            (sys.stdin, sys.stdout, sys.stderr) = saved_streams
+            os.environ.clear()
+            os.environ.update(saved_environ)
+            os.chdir(saved_cwd)
@@ -0,0 +1,249 @@
+import os
+import sys
+import time
+
+# 'sbtools --startup-report <subcommand> [args]' runs the command in new
+# interpreters and reports where their time goes before and while the
+# subcommand runs: starting the interpreter, importing each framework
+# module, discovering the plug-ins, and dispatching the subcommand. The
+# first run is reported apart from the warm runs that follow it, since
+# it may read files that are not in the page cache, compile modules,
+# and fill the registry cache.
+
+# The environment variable naming the file each child writes its
+# measurements to.
+RESULT_FILE_VARIABLE = 'SBTOOLS_STARTUP_RESULT'
+DEFAULT_WARM_RUNS = 5
+
+# The program run by each child interpreter. It times every import
+# with an __import__ hook, so it must not import anything from the
+# framework before the hook is installed. An import is charged with the
+# modules it added to sys.modules; the time of nested imports that
+# added modules is subtracted from its own time.
+CHILD_PROGRAM = r'''
+import sys
+import time
+started = time.time()
+import __builtin__
+
+imports = [] # [modules, inclusive, self, stage]
+stack = [[[], 0.0]] # [modules, nested time] of each import in progress
+known = dict.fromkeys(sys.modules.keys())
+stage = ['import']
+real_import = __builtin__.__import__
+
+def collect(modules):
+    if len(sys.modules) != len(known):
+        for name in sys.modules.keys():
+            if not known.has_key(name):
+                known[name] = None
+                if sys.modules[name] is not None:
+                    modules.append(name)
+
+def timed_import(*args, **kwargs):
+    # Modules added since the enclosing import started are its own.
+    collect(stack[-1][0])
+    frame = [[], 0.0]
+    stack.append(frame)
+    start = time.time()
+    try:
+        return real_import(*args, **kwargs)
+    finally:
+        elapsed = time.time() - start
+        collect(frame[0])
+        stack.pop()
+        if frame[0] or frame[1]:
+            stack[-1][1] += elapsed
+            if frame[0]:
+                imports.append([frame[0], elapsed, elapsed - frame[1], stage[0]])
+
+initial = dict.fromkeys(sys.modules.keys())
+__builtin__.__import__ = timed_import
+sys.argv[0] = 'sbtools'
+start = time.time()
+from sbtools.sbtools import SBTools, get_exit_status
+from sbtools.sbprofile import PhaseTimer
+imported = time.time()
+stage[0] = 'run'
+timer = PhaseTimer()
+try:
+    status = SBTools(timer=timer).run()
+except SystemExit, e:
+    status = get_exit_status(e)
+finished = time.time()
+__builtin__.__import__ = real_import
+sys.stdout.flush()
+
+modules = [name for (name, module) in sys.modules.items()
+           if module is not None and not initial.has_key(name)]
+result = {'started': started, 'imports': imports, 'import time': imported - start,
+          'run time': finished - imported, 'phases': timer.phases,
+          'modules': modules, 'status': status}
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+f = open(__import__('os').environ['%s'], 'wb')
+try:
+    pickle.dump(result, f, 2)
+finally:
+    f.close()
+''' % (RESULT_FILE_VARIABLE)
+
+# The phases of the --timings report that belong to plug-in discovery;
+# the other phases belong to dispatch.
+DISCOVERY_PHASES = ["registry cache lookup", "environment scan", "entry point scan",
+                    "entry point loading", "add_tool"]
+
+class StartupReportError(Exception):
+    """An exception class for runs that cannot be measured."""
+    def __init__(self, value):
+        self.value = str(value)
+    def __str__(self):
+        return self.value
+
+def get_source_dir():
+    """Return the directory containing the sbtools package."""
+    return os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def run_child(args, env=None):
+    """
+    Run 'sbtools args' in a new interpreter, with the environment env
+    (os.environ by default), and return its measurements as a
+    dictionary. A StartupReportError is raised if the child did not
+    write them.
+    """
+    import subprocess
+    import tempfile
+    try:
+        import cPickle as pickle
+    except ImportError:
+        import pickle
+    if env is None:
+        env = os.environ
+    env = env.copy()
+    env['PYTHONPATH'] = os.pathsep.join([get_source_dir()] +
+                                        [p for p in [env.get('PYTHONPATH')] if p])
+    (fd, path) = tempfile.mkstemp(suffix='.startup')
+    os.close(fd)
+    env[RESULT_FILE_VARIABLE] = path
+    try:
+        cmd = [sys.executable, '-c', CHILD_PROGRAM] + list(args)
+        spawned = time.time()
+        proc = subprocess.Popen(cmd, env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        errors = proc.communicate()[1]
+        f = open(path, 'rb')
+        try:
+            data = f.read()
+        finally:
+            f.close()
+    finally:
+        os.remove(path)
+    if not data:
+        raise StartupReportError("'sbtools %s' failed: %s" % (" ".join(args), errors.strip()))
+    result = pickle.loads(data)
+    result['interpreter start'] = result['started'] - spawned
+    return result
+
+def is_framework_module(name):
+    """Return True if the module name belongs to the sbtools package."""
+    return name == 'sbtools' or name.startswith('sbtools.')
+
+def get_rows(result):
+    """
+    Return the (label, seconds) rows of the report of one run, in
+    report order. Labels of details are indented.
+    """
+    imports = {'import': [], 'run': []} # stage -> rows
+    others = {'import': [0, 0.0], 'run': [0, 0.0]} # stage -> [modules, seconds]
+    for (modules, inclusive, own, stage) in result['imports']:
+        framework = [name for name in modules if is_framework_module(name)]
+        if framework:
+            imports[stage].append(("  %s" % (", ".join(sorted(framework))), own))
+        else:
+            others[stage][0] += len(modules)
+            others[stage][1] += own
+    for stage in ('import', 'run'):
+        imports[stage].append(("  other modules (%d)" % (others[stage][0]), others[stage][1]))
+
+    rows = [("interpreter start", result['interpreter start']),
+            ("framework imports", result['import time'])]
+    rows.extend(imports['import'])
+
+    discovery = []
+    dispatch = []
+    for (name, wall, cpu, count) in result['phases']:
+        if [phase for phase in DISCOVERY_PHASES if name.startswith(phase)]:
+            discovery.append(("  " + name, wall))
+        else:
+            dispatch.append(("  " + name, wall))
+    timed = sum([wall for (name, wall) in discovery + dispatch])
+    rows.append(("discovery", sum([wall for (name, wall) in discovery])))
+    rows.extend(discovery)
+    rows.append(("dispatch", sum([wall for (name, wall) in dispatch])))
+    rows.extend(dispatch)
+    rows.append(("other", max(result['run time'] - timed, 0.0)))
+    rows.append(("lazy imports (in the above)", sum([own for (label, own) in imports['run']])))
+    rows.extend(imports['run'])
+    rows.append(("total", result['interpreter start'] + result['import time'] + result['run time']))
+    return rows
+
+def median(values):
+    """Return the median of the list values."""
+    ordered = sorted(values)
+    n = len(ordered)
+    if n % 2:
+        return ordered[n//2]
+    return (ordered[n//2 - 1] + ordered[n//2]) / 2.0
+
+def format_report(first, warm):
+    """
+    Return the report of the first run and the warm runs (a list) as a
+    table of the time of the first run and the median time of the
+    warm runs. Rows that only appear in some runs (such as the lazy
+    imports of a run that scanned the environment) are reported where
+    they appear.
+    """
+    labels = []
+    times = {} # label -> ([first], [warm])
+    for (index, result) in enumerate([first] + warm):
+        for (label, seconds) in get_rows(result):
+            if not times.has_key(label):
+                labels.append(label)
+                times[label] = ([], [])
+            times[label][index > 0].append(seconds)
+    lines = ["%-50s %11s %11s" % ("Phase", "First (ms)", "Warm (ms)")]
+    for label in labels:
+        values = []
+        for samples in times[label]:
+            if samples:
+                values.append("%11.1f" % (median(samples)*1000))
+            else:
+                values.append("%11s" % ("-"))
+        lines.append("%-50s %s %s" % (label, values[0], values[1]))
+    lines.append("")
+    lines.append("Modules imported by a warm run: %d (%d in the sbtools package)." %
+                 (len(warm[-1]['modules']),
+                  len([name for name in warm[-1]['modules'] if is_framework_module(name)])))
+    lines.append("Lazy imports are made while the tool list is built or the subcommand is")
+    lines.append("dispatched, so their times are included in those of the phases above.")
+    return "\n".join(lines) + "\n"
+
+def report_startup(args, warm_runs=DEFAULT_WARM_RUNS, out=None):
+    """
+    Run 'sbtools args' once and then warm_runs more times and write
+    the startup report to out (sys.stdout by default). Returns 0, or 1
+    if the command could not be measured.
+    """
+    if out is None:
+        out = sys.stdout
+    try:
+        first = run_child(args)
+        warm = [run_child(args) for i in range(max(warm_runs, 1))]
+    except StartupReportError, e:
+        sys.stderr.write("%s\n" % (e))
+        return 1
+    out.write("Startup of 'sbtools %s' (1 first run, %d warm runs):\n\n" %
+              (" ".join(args), len(warm)))
+    out.write(format_report(first, warm))
+    return 0
@@ -0,0 +1,147 @@
+# Plug-in distributions can describe their tools statically, so that
+# 'sbtools help <subcommand>' and 'sbtools about <subcommand>' are
+# answered without importing the plug-in. The description is given to
+# setup() with the sbtools_metadata keyword, which maps tool names (as
+# in the SBTools.plugins entry points) to dictionaries of fields:
+#
+#   sbtools_metadata = {
+#       'Blank': {'usage': "blank [options]",
+#                 'description': "Do nothing.",
+#                 'options': [("-o FILE, --output=FILE", "write to FILE"),
+#                             ("-q, --quiet", "print nothing")],
+#                 'about': "The Blank tool.\nCopyright ..."}}
+#
+# The egg_info command writes it to the METADATA_FILE file of the
+# distribution metadata as one INI section per tool. Options taking a
+# value name it after the flags (e.g., "-o FILE"); the --version and
+# -h, --help options are added to the help of every tool.
+
+METADATA_FILE = 'sbtools_metadata.txt'
+METADATA_FIELDS = ['usage', 'description', 'options', 'about']
+
+def check_metadata(dist, attr, value):
+    """
+    Verify the sbtools_metadata setup() keyword. A DistutilsSetupError
+    is raised if value is not a valid static metadata dictionary.
+    """
+    from distutils.errors import DistutilsSetupError
+    try:
+        for (name, fields) in value.items():
+            for (field, fieldvalue) in fields.items():
+                if field not in METADATA_FIELDS:
+                    raise ValueError("unknown field '%s'" % (field))
+                if field == 'options':
+                    for (flags, help) in fieldvalue:
+                        parse_option_flags(flags)
+                elif not isinstance(fieldvalue, basestring):
+                    raise ValueError("'%s' is not a string" % (field))
+    except (AttributeError, TypeError, ValueError), e:
+        raise DistutilsSetupError("%r must map tool names to dictionaries of %s (%s)"
+                                  % (attr, ", ".join(METADATA_FIELDS), e))
+
+def format_metadata(metadata):
+    """
+    Return the static metadata dictionary metadata in the format of
+    the METADATA_FILE file.
+    """
+    lines = []
+    names = metadata.keys()
+    names.sort()
+    for name in names:
+        fields = metadata[name]
+        lines.append("[%s]" % (name))
+        for field in METADATA_FIELDS:
+            if not fields.has_key(field):
+                continue
+            if field == 'options':
+                values = ["%s: %s" % (flags, help) for (flags, help) in fields[field]]
+            else:
+                # Blank lines would end the value, so they are written
+                # as a single '.'.
+                values = [line.strip() or "." for line in fields[field].splitlines()]
+            lines.append("%s = %s" % (field, "\n\t".join([""] + values).lstrip()))
+        lines.append("")
+    return "\n".join(lines)
+
+def write_metadata(cmd, basename, filename):
+    """
+    The egg_info writer of the METADATA_FILE file, which is written if
+    the sbtools_metadata setup() keyword was given and removed
+    otherwise.
+    """
+    metadata = getattr(cmd.distribution, 'sbtools_metadata', None)
+    data = None
+    if metadata:
+        data = format_metadata(metadata)
+    cmd.write_or_delete_file("SBTools metadata", filename, data)
+
+def parse_metadata(text):
+    """
+    Return the static metadata in the METADATA_FILE text as a
+    dictionary mapping tool names to dictionaries of fields, or an
+    empty dictionary if the text cannot be parsed.
+    """
+    from ConfigParser import RawConfigParser, Error as ConfigParserError
+    from StringIO import StringIO
+    parser = RawConfigParser()
+    try:
+        parser.readfp(StringIO(text))
+    except ConfigParserError:
+        return {}
+    metadata = {}
+    for name in parser.sections():
+        fields = {}
+        for field in METADATA_FIELDS:
+            if not parser.has_option(name, field):
+                continue
+            lines = parser.get(name, field).splitlines()
+            if field == 'options':
+                options = []
+                for line in lines:
+                    (flags, sep, help) = line.partition(":")
+                    if flags.strip():
+                        options.append((flags.strip(), help.strip()))
+                fields[field] = options
+            else:
+                fields[field] = "\n".join([line != "." and line or "" for line in lines])
+        metadata[name] = fields
+    return metadata
+
+def parse_option_flags(flags):
+    """
+    Return the option strings and the metavar (None if the option
+    takes no value) described by flags, such as "-o FILE, --output=FILE".
+    A ValueError is raised if flags names no option.
+    """
+    opts = []
+    metavar = None
+    for flag in flags.split(","):
+        flag = flag.strip().replace("=", " ")
+        parts = flag.split()
+        if not parts or not parts[0].startswith("-"):
+            raise ValueError("invalid option flags '%s'" % (flags))
+        opts.append(parts[0])
+        if len(parts) > 1:
+            metavar = parts[1]
+    return (opts, metavar)
+
+def format_help(fields, name, version, full_command_str):
+    """
+    Return the help text of the tool name at version described by the
+    static metadata fields, formatted as the tool's SBToolOptionParser
+    would format it.
+    """
+    from optparse import OptionParser
+    parser = OptionParser(usage=fields.get('usage'), version="%s %s" % (name, version))
+    if fields.has_key('description'):
+        parser.set_description("%s: %s" % (full_command_str, fields['description']))
+    for (flags, help) in fields.get('options', []):
+        try:
+            (opts, metavar) = parse_option_flags(flags)
+        except ValueError:
+            continue
+        if metavar is None:
+            parser.add_option(action="store_true", help=help, *opts)
+        else:
+            parser.add_option(metavar=metavar, help=help, *opts)
+    return parser.format_help()
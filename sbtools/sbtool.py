@@ -1,5 +1,3 @@
-import pkg_resources
-
 class SBToolError(Exception):
     """An exception class for unsuccessful tool runs."""
     def __init__(self, value, prewrapped=False):
@@ -21,6 +19,39 @@ class EntryPointError(SBToolError):
         self.value = str(value)
         self.wrapped = False
 
+class PluginLoadError(SBToolError):
+    """
+    An exception class raised when a plug-in that was registered
+    without being imported fails to load when it is dispatched.
+    """
+    def __init__(self, value):
+        self.value = str(value)
+        self.wrapped = False
+
+# Maps plug-in classes to the PluginRecord objects describing their
+# entry points. Plug-in discovery fills the index so that tools can
+# find their entry point data without scanning the environment.
+plugin_index = {}
+
+def index_plugin(cls, record):
+    """Record that the plug-in class cls is described by record."""
+    plugin_index[cls] = record
+
+def find_plugin_record(cls):
+    """
+    Return the PluginRecord of the plug-in class cls or of its nearest
+    indexed base class, or None if neither has been indexed.
+    """
+    try:
+        return plugin_index[cls]
+    except KeyError:
+        pass
+    import inspect
+    for base in inspect.getmro(cls)[1:]:
+        if plugin_index.has_key(base):
+            return plugin_index[base]
+    return None
+
 class SBTool:
     """
     Parent class for all tools developed to run with sbtools.
@@ -85,9 +116,11 @@ class SBTool:
         Return the contents of the left-hand side of the entry point
         for this plug-in.
 
-        This works by checking all SBTools.plugins entry points and
-        returning the name of the one whose entrypoint the same as
-        this object's class.
+        The entry point data is looked up in the plug-in index, which
+        is filled when plug-ins are discovered. For plug-ins that were
+        not discovered by SBTools, this works by checking all
+        SBTools.plugins entry points and returning the name of the one
+        whose entrypoint the same as this object's class.
         """
         # Try returning the epldata that was already found. If this
         # throws an AttributeError, then the epldata has not yet been
@@ -97,9 +130,15 @@ class SBTool:
         except AttributeError:
             pass
 
+        record = find_plugin_record(self.__class__)
+        if record is not None:
+            self.epldata = record.get_epldata()
+            return self.epldata
+
         entrypoint = 'SBTools.plugins'
-        pkg_env = pkg_resources.Environment()
-        egg = pkg_env[self.__module__.split('.')[0]][0]
+        egg = self.sbtools.metadata.get_distribution(self.__module__.split('.')[0])
+        if egg is None:
+            raise EntryPointError("This object does not have a corresponding entry point.")
         for pdata in egg.get_entry_map(entrypoint):
             entry_point = egg.get_entry_info(entrypoint, pdata)
             cls = entry_point.load()
@@ -117,8 +156,11 @@ class SBTool:
         Return the version string of this package, as defined in the
         setup.py file.
         """
-        pkg_env = pkg_resources.Environment()
-        return pkg_env[self.__module__.split('.')[0]][0].version
+        record = find_plugin_record(self.__class__)
+        if record is not None:
+            return record.version
+
+        return self.sbtools.metadata.get_version(self.__module__.split('.')[0])
 
     def print_help(self):
         """
@@ -136,3 +178,63 @@ class SBTool:
         overloaded and run the tool when called.
         """
         raise NotImplementedError
+
+    def is_cacheable(self):
+        """
+        In a derived-class implementation, this method returns True if
+        the results of the tool depend only on its command line, the
+        contents of the input files named on it, and its standard
+        input. The standard output and output files of cacheable tools
+        are stored, and replayed instead of running the tool when it
+        is run again with the same command line and inputs. Results
+        are not cached when the standard input is a pipe.
+
+        Tools whose results depend on anything else, such as
+        environment variables, the time, the network, or files not
+        named on the command line, must not be cacheable, since the
+        cache would replay stale results.
+
+        If this method is not overloaded, the tool is not cacheable.
+        """
+        return False
+
+    def get_output_files(self, args):
+        """
+        In a derived-class implementation of a cacheable tool, this
+        method returns the list of files written by the tool when it
+        is run with the command-line arguments args (sys.argv without
+        the program name), so they can be stored with its output.
+
+        If this method is not overloaded, the tool writes no files.
+        """
+        return []
+
+    def run_async(self):
+        """
+        In a derived-class implementation, this method is a generator
+        that runs the tool in place of run(). Instead of blocking, it
+        yields callables (or lists of callables to run concurrently)
+        that the framework calls on worker threads, and it receives
+        their results at the yield (see the sbasync module).
+
+        If this method is not overloaded, then the tool is run with
+        run().
+        """
+        raise NotImplementedError
+
+    def run_stream(self, records):
+        """
+        In a derived-class implementation, this method runs the tool as
+        a stage of 'sbtools chain'. The records parameter is an
+        iterator over the records produced by the previous stage (the
+        lines of standard input for the first stage), and the method
+        returns an iterator, usually a generator, over the records
+        passed to the next stage. Records may be any Python objects;
+        the output of the last stage is written one record per line.
+
+        If this method is not overloaded, then the tool is run in a
+        chain with run(), reading the previous stage's records as
+        lines on standard input and passing the lines it prints to the
+        next stage.
+        """
+        raise NotImplementedError
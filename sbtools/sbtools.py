@@ -1,7 +1,13 @@
 from sboptparse import SBToolsOptionParser
-from sbtool import SBToolError
+from sbtool import SBToolError, PluginLoadError, find_plugin_record
+from sbregistry import RegistryCache, ToolHandle, FailureLog, classify_load_error
+from sbindex import load_dispatch_table
+from sbmetadata import get_shared_metadata
+from sbconfig import read_config
+from sbresultcache import ResultCache, TeeWriter, get_stdin_digest
+from sbprofile import NullTimer, PhaseTimer, LoadReport, pop_global_options, run_profiled
+from sbprofile import PROFILE_OPTION, TIMINGS_OPTION, STARTUP_REPORT_OPTION
 import textwrap
-import pkg_resources
 import os
 import sys
 
@@ -48,22 +54,47 @@ class SBTools:
     call the appropriate plug-in to do the actual work when the script
     is run.
     """
-    def __init__(self):
+    def __init__(self, metadata=None, timer=None, config=None):
+        if metadata is None:
+            metadata = get_shared_metadata()
+        if timer is None:
+            timer = NullTimer()
+        if config is None:
+            config = read_config()
+        self.metadata = metadata
+        self.timer = timer
+        self.config = config
+        token = self.timer.start("parser construction")
         self.parser = self.init_parser()
+        self.timer.stop(token)
         self.tcmdlist = []
         self.cmdmap = {} # subcommand -> [plug-in module, builtin?]
         self.namemap = {} # toolname -> [plug-in module, builtin?]
+        self.registry_cache = RegistryCache()
+        self.result_cache = ResultCache()
+        self.partial_tool_list = False
+        self.records = []
+        self.failure_log = None # given to the ToolHandles, see FailureLog
+        self.fingerprint = None # of the search path, when the tool list describes it
+        self.subcommand_listing = None
 
     def init_parser(self):
         """Populate and return the parser object."""
-        pkg_env = pkg_resources.Environment()
-        versionstr = "%%prog %s" % (pkg_env[self.__module__.split('.')[0]][0].version)
         parser = SBToolsOptionParser(sbtools=self,
-                                     usage="%prog <subcommand> [options] [args]",
-                                     version=versionstr)
+                                     usage="%prog <subcommand> [options] [args]")
 
         parser.add_option("--verbose-load", action="callback", callback=self.verbose_load,
                           help="report actions and results when loading plug-ins")
+        parser.add_option("--load-report", action="callback", callback=self.load_report,
+                          help="report the time, modules, and memory it takes to load each plug-in")
+        # These options are removed from the command line by main()
+        # before it is parsed; they are here for the help text.
+        parser.add_option(PROFILE_OPTION, metavar="FILE",
+                          help="profile the run with cProfile and write the statistics to FILE (default: sbtools.pstats)")
+        parser.add_option(TIMINGS_OPTION, action="store_true",
+                          help="report the time spent in each phase of the run")
+        parser.add_option(STARTUP_REPORT_OPTION, metavar="N",
+                          help="run the subcommand in new interpreters (once, then N more times) and report the time spent starting the interpreter, importing the framework, discovering plug-ins, and dispatching")
 
         return parser
 
@@ -76,7 +107,24 @@ class SBTools:
         self.tcmdlist = []
         self.cmdmap = {}
         self.namemap = {}
-        self.build_tool_list(verbose_load=True)
+        self.partial_tool_list = False
+        self.build_tool_list(verbose_load=True, use_failure_cache=True)
+        self.parser.exit()
+
+    def load_report(self, option, opt, value, parser):
+        """
+        Callback function for the '--load-report' option. This method
+        resets member variables, loads every plug-in with
+        build_tool_list(), and prints the cost of loading each one,
+        slowest first.
+        """
+        self.tcmdlist = []
+        self.cmdmap = {}
+        self.namemap = {}
+        self.partial_tool_list = False
+        report = LoadReport()
+        self.build_tool_list(load_report=report)
+        print report.get_report(),
         self.parser.exit()
 
     def parse_options(self):
@@ -121,12 +169,13 @@ class SBTools:
             raise NameConflictWarning(msg)
 
         # Everything checks out; add the tool.
+        self.subcommand_listing = None
         self.tcmdlist.append(subcommands)
         self.namemap[name] = [cls, isbuiltin]
         for sc in subcommands:
             self.cmdmap[sc] = [cls, isbuiltin]
 
-    def build_tool_list(self, builtin_only=False, supp_plugin_locations=[], verbose_load=False):
+    def build_tool_list(self, builtin_only=False, supp_plugin_locations=[], verbose_load=False, use_cache=False, lazy=False, load_report=None, use_failure_cache=False):
         """
         Construct the list of available tools.
 
@@ -142,134 +191,229 @@ class SBTools:
         directories in which to search for independently installed
         plug-ins. This was designed primarily for use by the unit
         tests to create a controlled environment.
-        """
-        entrypoint = 'SBTools.plugins'
 
-        # Get plugins.
-        pkg_env = pkg_resources.Environment()
-        for name in pkg_env:
-            if verbose_load:
-                sys.stdout.write("Found '%s' package..." % (name))
-            # Determine if the plug-in is builtin.
-            if name == self.__module__.split('.')[0]:
-                isbuiltin = True
-            else:
-                isbuiltin = False
-                if builtin_only:
-                    # Skipped non-core packages (mostly for testing).
-                    continue
-            egg = pkg_env[name][0]
-            egg.activate()
-            for pdata in egg.get_entry_map(entrypoint):
-                pdatasplit = pdata.split()
-                if len(pdatasplit) == 0:
-                    # Then no plug-in name (or subcommands) was
-                    # provided.
-                    if verbose_load:
-                        sys.stdout.write("Un-named plug-in...cannot load...")
-                    continue
-                elif len(pdatasplit) == 1:
-                    # Then no plug-in subcommands were provided.
-                    if verbose_load:
-                        sys.stdout.write("'%s' plug-in...no subcommands...cannot load..." % (pdatasplit[0]))
-                    continue
-                plugname = pdatasplit[0]
-                subcommands = pdatasplit[1:]
-                if verbose_load:
-                    sys.stdout.write("'%s' plug-in..." % (plugname))
-
-                entry_point = egg.get_entry_info(entrypoint, pdata)
+        Unless builtin_only is True, plug-ins are also searched for in
+        the plug-in directories of the configuration (see sbconfig),
+        and only the builtin plug-ins are taken from sys.path if the
+        configuration excludes site-packages.
+
+        If use_cache is True, the tool list is restored from the
+        generated dispatch table or the registry cache when either is
+        still current, and the registry cache is refreshed after the
+        environment is scanned otherwise.
+
+        If lazy is True, plug-ins are registered with ToolHandle
+        objects built from their entry point names and are not
+        imported until they are used. Load failures are then reported
+        when the plug-in is dispatched instead of here. The plug-ins
+        are then found with the backend chosen by
+        get_discovery_backend(), which uses importlib.metadata where
+        it is available and the entry point scanner of the sbscan
+        module elsewhere, rather than with pkg_resources.
+
+        If a LoadReport is given as load_report, the cost of loading
+        each plug-in is added to it. Plug-ins are only loaded here when
+        lazy is False and the tool list is not restored from a cache.
+
+        If use_cache or use_failure_cache is True, plug-ins that failed
+        to load before are skipped (and reported as failing) without
+        being loaded again, until their distribution or the
+        environment changes, and new failures are stored with the
+        registry cache. If lazy is True, this happens when the
+        plug-ins are loaded, through the FailureLog given to their
+        ToolHandles.
+        """
+        # The fingerprint must be taken before any egg is activated,
+        # since activating eggs modifies sys.path.
+        searchpath = self.get_search_path(builtin_only) + list(supp_plugin_locations)
+        use_cache = use_cache and self.registry_cache.is_enabled()
+        use_failure_cache = ((use_cache or use_failure_cache) and
+                             self.registry_cache.is_enabled())
+        self.fingerprint = None
+        self.failure_log = None
+        if use_cache or use_failure_cache:
+            token = self.timer.start("registry cache lookup")
+            fingerprint = self.registry_cache.get_fingerprint(searchpath)
+            records = None
+            if use_cache:
+                if not builtin_only and not supp_plugin_locations:
+                    self.fingerprint = fingerprint
+                records = self.load_cached_records(searchpath, builtin_only, fingerprint)
+            self.timer.stop(token)
+            if lazy:
+                self.failure_log = FailureLog(self.registry_cache, searchpath, fingerprint)
+            if records is not None:
                 try:
-                    cls = entry_point.load()
-                except pkg_resources.VersionConflict, e:
-                    if verbose_load:
-                        sys.stdout.write("version conflict: %s..." % (e))
-                    continue
-                except pkg_resources.DistributionNotFound, e:
-                    if verbose_load:
-                        sys.stdout.write("missing dependency: %s..." % (e))
-                    continue
-                except ImportError, e:
-                    if verbose_load:
-                        sys.stdout.write("cannot import: %s..." % (e))
-                    continue
+                    self.add_records(records, lazy)
+                except Exception, e:
+                    if classify_load_error(e) is None:
+                        raise
+                    # The cached registry is out of date in a way the
+                    # fingerprint did not catch; rescan.
+                    self.tcmdlist = []
+                    self.cmdmap = {}
+                    self.namemap = {}
                 else:
-                    if verbose_load:
-                        sys.stdout.write("loaded...")
-
-                # Populate the subcommand list and the plugin map.
+                    self.tcmdlist.sort()
+                    self.records = records
+                    return
+        records = []
+        failures = self.failure_log
+        if use_failure_cache and not lazy:
+            failures = self.registry_cache.load_failures(searchpath, fingerprint)
+            known_failures = failures.copy()
+
+        # Get plugins from the default environment followed by the
+        # supp locations (this is mostly to control the tests). The
+        # discovery modules are only imported when the tool list is
+        # not restored from a cache.
+        from sbdiscovery import DiscoveryReporter, discover_plugins, get_discovery_backend
+        locations = [None]
+        discover_builtin_only = builtin_only
+        if not builtin_only:
+            if self.config.get_location() is not None:
+                locations.append(self.config.get_location())
+            discover_builtin_only = not self.config.site_packages
+        locations.extend(supp_plugin_locations)
+        reporter = DiscoveryReporter(verbose_load)
+        backend = None
+        if lazy:
+            # The scanner's directory index is kept with the registry
+            # cache only when the cache is in use.
+            cache = None
+            if use_cache:
+                cache = self.registry_cache
+            backend = get_discovery_backend(self.metadata, cache=cache)
+        for candidate in discover_plugins(self.metadata, locations,
+                                          self.__module__.split('.')[0],
+                                          discover_builtin_only, lazy, reporter, self.timer,
+                                          load_report, failures, backend):
+            # Populate the subcommand list and the plugin map.
+            token = self.timer.start("add_tool")
+            try:
                 try:
-                    self.add_tool(cls, plugname, isbuiltin, subcommands)
-                except SubcommandConflictWarning, msg:
-                    print msg
-                except NameConflictWarning, msg:
-                    print msg
-
-            if verbose_load:
-                print
-
-        # Get plugins installed in the supp locations (this is mostly
-        # to control the tests).
-        for supp_loc in supp_plugin_locations:
-            pkg_resources.working_set.add_entry(supp_loc)
-            pkg_env = pkg_resources.Environment([supp_loc])
-            for name in pkg_env:
-                if verbose_load:
-                    sys.stdout.write("Found '%s' package..." % (name))
-                egg = pkg_env[name][0]
-                eggname = str(egg).split()[0]
-                egg.activate()
-                for pdata in egg.get_entry_map(entrypoint):
-                    pdatasplit = pdata.split()
-                    if len(pdatasplit) == 0:
-                        # Then no plug-in name (or subcommands) was
-                        # provided.
-                        if verbose_load:
-                            sys.stdout.write("Un-named plug-in...cannot load...")
-                        continue
-                    elif len(pdatasplit) == 1:
-                        # Then no plug-in subcommands were provided.
-                        if verbose_load:
-                            sys.stdout.write("'%s' plug-in...no subcommands...cannot load..." % (pdatasplit[0]))
-                        continue
-                    plugname = pdatasplit[0]
-                    subcommands = pdatasplit[1:]
-                    if verbose_load:
-                        sys.stdout.write("'%s' plug-in..." % (plugname))
-                    entry_point = egg.get_entry_info(entrypoint, pdata)
-
-                    try:
-                        cls = entry_point.load()
-                    except pkg_resources.VersionConflict, e:
-                        if verbose_load:
-                            sys.stdout.write("version conflict: %s..." % (e))
-                        continue
-                    except pkg_resources.DistributionNotFound, e:
-                        if verbose_load:
-                            sys.stdout.write("missing dependency: %s..." % (e))
-                        continue
-                    except ImportError, e:
-                        if verbose_load:
-                            sys.stdout.write("cannot import: %s..." % (e))
-                        continue
-                    else:
-                        if verbose_load:
-                            sys.stdout.write("loaded...")
-
-                    # Populate the subcommand list and the plugin map.
-                    try:
-                        self.add_tool(cls, eggname, False, subcommands)
-                    except SubcommandConflictWarning, msg:
-                        print msg
-                    except NameConflictWarning, msg:
-                        print msg
-
-                if verbose_load:
-                    print
+                    self.add_tool(candidate.cls, candidate.name, candidate.isbuiltin,
+                                  candidate.subcommands)
+                finally:
+                    self.timer.stop(token)
+            except SubcommandConflictWarning, msg:
+                print msg
+            except NameConflictWarning, msg:
+                print msg
+            else:
+                records.append(candidate.record)
 
         # Sort the subcommand list so that 'sbtools help' displays the
         # available subcommands in alphabetical order.
         self.tcmdlist.sort()
+        self.records = records
+
+        if use_cache:
+            self.registry_cache.store(searchpath, builtin_only, fingerprint, records)
+        if use_failure_cache and not lazy and failures != known_failures:
+            self.registry_cache.store_failures(searchpath, fingerprint, failures)
+
+    def load_cached_records(self, searchpath, builtin_only, fingerprint):
+        """
+        Return the plug-in records for the search path from the
+        generated dispatch table or, failing that, from the registry
+        cache. None is returned if neither is current.
+
+        The dispatch table only describes the default environment, so
+        it is not used when builtin_only is True or when supplementary
+        plug-in locations are searched.
+        """
+        records = None
+        if not builtin_only and searchpath == self.get_search_path():
+            records = load_dispatch_table(self.registry_cache.cachedir, searchpath, fingerprint)
+        if records is None:
+            records = self.registry_cache.load(searchpath, builtin_only, fingerprint)
+        return records
+
+    def add_records(self, records, lazy=False):
+        """
+        Add the plug-ins described by the PluginRecord objects in
+        records to the tool list.
+
+        If lazy is True, the plug-ins are registered with ToolHandle
+        objects, which are given the FailureLog of the tool list, and
+        are not imported. Otherwise, the plug-ins are imported and an
+        ImportError is raised if any plug-in can no longer be imported.
+        """
+        for rec in records:
+            if lazy:
+                cls = ToolHandle(rec, failures=self.failure_log)
+            else:
+                cls = rec.load()
+            token = self.timer.start("add_tool")
+            self.add_tool(cls, rec.name, rec.isbuiltin, rec.subcommands)
+            self.timer.stop(token)
+
+    def build_partial_tool_list(self, sc):
+        """
+        Register only the tool that provides subcommand sc, using the
+        dispatch table or the registry cache. Returns True if the tool
+        was registered and False if neither is current or contains sc,
+        in which case nothing is registered.
+
+        The tool is registered lazily, so nothing is imported until it
+        is dispatched. Methods that need the other tools call
+        complete_tool_list() first.
+        """
+        if not self.registry_cache.is_enabled():
+            return False
+        searchpath = self.get_search_path()
+        token = self.timer.start("registry cache lookup")
+        fingerprint = self.registry_cache.get_fingerprint(searchpath)
+        records = self.load_cached_records(searchpath, False, fingerprint)
+        self.timer.stop(token)
+        if records is None:
+            return False
+        for rec in records:
+            if sc in rec.subcommands:
+                self.failure_log = FailureLog(self.registry_cache, searchpath, fingerprint)
+                self.add_records([rec], True)
+                self.partial_tool_list = True
+                self.fingerprint = fingerprint
+                return True
+        return False
+
+    def complete_tool_list(self):
+        """
+        Build the full tool list if only part of it was built by
+        build_partial_tool_list().
+        """
+        if self.partial_tool_list:
+            self.tcmdlist = []
+            self.cmdmap = {}
+            self.namemap = {}
+            self.partial_tool_list = False
+            self.build_tool_list(use_cache=True, lazy=True)
+
+    def load_tools(self):
+        """
+        Import every plug-in that was registered lazily. Plug-ins that
+        fail to load are left registered, so the failure is reported
+        when they are dispatched. Plug-ins recorded as failing in the
+        FailureLog of the tool list are not imported again (see
+        ToolHandle.load()).
+        """
+        for (cls, isbuiltin) in self.namemap.values():
+            if isinstance(cls, ToolHandle):
+                try:
+                    cls.load()
+                except PluginLoadError:
+                    pass
+
+    def get_search_path(self, builtin_only=False):
+        """
+        Return the path entries searched for plug-ins, other than the
+        supplementary plug-in locations: sys.path if builtin_only is
+        True, and the search path of the configuration otherwise.
+        """
+        if builtin_only:
+            return list(sys.path)
+        return self.config.get_search_path()
 
     def get_full_command(self, tool, lpad=""):
         """
@@ -281,24 +425,53 @@ class SBTools:
         lpad is "", then this method returns 'mytool (my, myt)'.
         """
         if len(tool) > 1:
-            tsubstr = tool[1]
-            for tsub in tool[2:]:
-                tsubstr += ", %s" % (tsub)
-            tstr = "%s (%s)" % (tool[0], tsubstr)
-        else:
-            tstr = tool[0]
-        return "%s%s" % (lpad, tstr)
+            return "%s%s (%s)" % (lpad, tool[0], ", ".join(tool[1:]))
+        return "%s%s" % (lpad, tool[0])
 
     def get_subcommands(self):
         """
         Return a formatted string that lists the subcommands available
         for the user to use.
+
+        The listing of the tools found on the search path is stored
+        with the registry cache. While only part of the tool list is built (see
+        build_partial_tool_list()), the stored listing is returned if
+        the installed plug-ins have not changed, so the rest of the
+        tool list is not built.
         """
+        if self.subcommand_listing is not None:
+            return self.subcommand_listing
+        if self.partial_tool_list and self.fingerprint is not None:
+            listing = self.registry_cache.load_listing(self.get_search_path(), self.fingerprint)
+            if listing is not None:
+                self.subcommand_listing = listing
+                return listing
+
+        self.complete_tool_list()
         lpad = " "*3
-        tliststr = ""
-        for tool in self.tcmdlist:
-            tliststr += "%s\n" % (self.get_full_command(tool, lpad))
-        return tliststr
+        listing = "".join(["%s\n" % (self.get_full_command(tool, lpad))
+                           for tool in self.tcmdlist])
+        if self.fingerprint is not None:
+            self.registry_cache.store_listing(self.get_search_path(), self.fingerprint, listing)
+        self.subcommand_listing = listing
+        return listing
+
+    def get_version(self):
+        """
+        Return the version of the SBTools package, from the record of
+        a builtin tool if one is registered and from the distribution
+        metadata otherwise.
+        """
+        for (cls, isbuiltin) in self.cmdmap.values():
+            if not isbuiltin:
+                continue
+            if isinstance(cls, ToolHandle):
+                record = cls.record
+            else:
+                record = find_plugin_record(cls)
+            if record is not None and record.version:
+                return record.version
+        return self.metadata.get_version(self.__module__.split('.')[0])
 
     def get_about(self):
         """
@@ -308,10 +481,12 @@ class SBTools:
 
     def has_tool_by_name(self, tname):
         """Returns True if a tool with name tname is installed."""
+        self.complete_tool_list()
         return self.namemap.has_key(tname)
 
     def has_tool_by_subcommand(self, sc):
         """Returns True if a tool with subcommand sc is installed."""
+        self.complete_tool_list()
         return self.cmdmap.has_key(sc)
 
     def get_tool_by_name(self, tname):
@@ -354,19 +529,83 @@ class SBTools:
         else:
             return None
 
+    def get_record_by_subcommand(self, sc):
+        """
+        Returns the PluginRecord of the tool with subcommand sc, or
+        None if no such tool exists or the tool has no record.
+        """
+        cls = self.get_tool_by_subcommand(sc)
+        if cls is None:
+            return None
+        if isinstance(cls, ToolHandle):
+            return cls.record
+        return find_plugin_record(cls)
+
+    def get_static_help_by_subcommand(self, sc):
+        """
+        Returns the help text of the tool with subcommand sc built from
+        the static metadata of its distribution, or None if there is
+        no such metadata. The tool is not imported.
+        """
+        record = self.get_record_by_subcommand(sc)
+        if record is None or not record.static or not record.static.get('usage'):
+            return None
+        from sbstatic import format_help
+        return format_help(record.static, record.get_epldata().split()[0],
+                           record.version, self.get_full_command(record.subcommands))
+
+    def get_static_about_by_subcommand(self, sc):
+        """
+        Returns the 'about' information of the tool with subcommand sc
+        from the static metadata of its distribution, or None if there
+        is no such metadata. The tool is not imported.
+        """
+        record = self.get_record_by_subcommand(sc)
+        if record is None or not record.static:
+            return None
+        return record.static.get('about')
+
     def get_toolname_list(self):
         """Return a list containing the toolnames."""
+        self.complete_tool_list()
         return self.namemap.keys()
 
     def get_tool_subcommand_list(self):
         """Return a list containing the tool subcommands."""
+        self.complete_tool_list()
         return self.cmdmap.keys()
 
     def run(self):
-        """Run the SBTools framework."""
-        self.build_tool_list()
+        """
+        Run the SBTools framework. Returns the exit status of the
+        subcommand (see dispatch()).
+        """
+        # Fast path: when a subcommand is given, register only the
+        # tool that provides it if the registry cache allows it.
+        sc = None
+        for arg in sys.argv[1:]:
+            if not arg.startswith(("--", "-")):
+                sc = arg
+                break
+        if sc is None or not self.build_partial_tool_list(sc):
+            self.build_tool_list(use_cache=True, lazy=True)
+        return self.dispatch()
+
+    def dispatch(self):
+        """
+        Parse the command line in sys.argv and run the requested
+        subcommand using the tools that are already registered.
+
+        Returns 0 if the tool ran and 1 if it reported an error. As in
+        the rest of the framework, some paths end the run by calling
+        self.parser.exit(), which raises SystemExit.
+        """
+        token = self.timer.start("option parsing")
         try:
-            self.parse_options()
+            try:
+                self.parse_options()
+            finally:
+                self.timer.stop(token)
         except UnknownSubcommandError, msg:
             print self.parser.get_unknown_argument_error(str(msg))
             self.parser.exit()
@@ -374,13 +613,29 @@ class SBTools:
             print self.parser.get_help()
             self.parser.exit()
 
-        # Run subcommand.
+        # Run subcommand. Plug-ins registered lazily are imported
+        # here, so load failures are reported here as well.
         cls = self.cmdmap[self.args[0]][0]
-        tool = cls(self)
         try:
-            tool.run()
+            if isinstance(cls, ToolHandle) and not cls.is_loaded():
+                token = self.timer.start("plug-in import (%s)" % (cls.name))
+                try:
+                    cls.load()
+                finally:
+                    self.timer.stop(token)
+            token = self.timer.start("tool construction")
+            try:
+                tool = cls(self)
+            finally:
+                self.timer.stop(token)
+            token = self.timer.start("tool run")
+            try:
+                self.run_tool(tool)
+            finally:
+                self.timer.stop(token)
         except NotImplementedError:
             print textwrap.fill("WARNING: '%s' subcommand does not implement run() method; not running tool." % (self.args[0]), 78)
+            return 1
         except UnknownSubcommandError, msg:
             print self.parser.get_unknown_argument_error(str(msg))
             self.parser.exit()
@@ -389,8 +644,134 @@ class SBTools:
                 print msg
             else:
                 print textwrap.fill("%s" % (str(msg)), 78)
+            return 1
+        return 0
+
+    def run_tool(self, tool):
+        """
+        Run tool, or replay its stored results if the tool is cacheable
+        and was already run with the same command line and inputs.
+        Results are stored only when the tool finishes successfully.
+        """
+        key = self.get_result_key(tool)
+        if key is None:
+            self.call_tool(tool)
+            return
+
+        result = self.result_cache.lookup(key)
+        if result is not None:
+            result.replay()
+            return
+        saved_stdout = sys.stdout
+        tee = TeeWriter(saved_stdout)
+        sys.stdout = tee
+        try:
+            self.call_tool(tool)
+        finally:
+            sys.stdout = saved_stdout
+        self.result_cache.store(key, tool.get_name(), sys.argv[1:], tee.getvalue(),
+                                tool.get_output_files(sys.argv[1:]))
+
+    def get_result_key(self, tool):
+        """
+        Return the result cache key of running tool with the command
+        line in sys.argv and the input in sys.stdin, or None if its
+        results are not cached. Results are not cached when the input
+        cannot be keyed, as for a pipe.
+        """
+        if not self.result_cache.is_enabled() or not tool.is_cacheable():
+            return None
+        try:
+            name = tool.get_name()
+            version = tool.get_version()
+        except (SBToolError, IndexError):
+            return None
+        # The subcommand is replaced by the tool name, so the aliases
+        # of a tool share its results.
+        args = sys.argv[2:]
+        stdin_digest = get_stdin_digest(sys.stdin)
+        if stdin_digest is None:
+            return None
+        try:
+            return self.result_cache.get_key(name, version, args,
+                                             tool.get_output_files(sys.argv[1:]),
+                                             stdin_digest)
+        except (IOError, OSError):
+            return None
+
+    def call_tool(self, tool):
+        """
+        Run tool. Tools that implement run_async() are driven on the
+        event loop of the sbasync module, which raises a SBToolError if
+        run_async() returns anything but a generator; other tools are
+        run with run().
+        """
+        try:
+            coroutine = tool.run_async()
+        except NotImplementedError:
+            tool.run()
+        else:
+            from sbasync import run_coroutine
+            run_coroutine(coroutine)
+
+    def invoke(self, argv):
+        """
+        Run the command line argv (including the program name) in this
+        process and return its exit status. The SystemExit raised by
+        self.parser.exit(), sys.exit(), and similar calls is turned
+        into the exit status instead of ending the process.
+        """
+        saved_argv = sys.argv
+        sys.argv = list(argv)
+        try:
+            try:
+                return self.dispatch()
+            except SystemExit, e:
+                return get_exit_status(e)
+        finally:
+            sys.argv = saved_argv
+
+def get_exit_status(e):
+    """
+    Return the process exit status that the SystemExit exception e
+    would produce. As with sys.exit(), a message is written to
+    sys.stderr when the exit code is not an integer.
+    """
+    if e.code is None:
+        return 0
+    elif isinstance(e.code, int):
+        return e.code
+    sys.stderr.write("%s\n" % (e.code))
+    return 1
 
 def main():
-    """Entry point for the sbtools script."""
-    sbtools = SBTools()
-    sbtools.run()
+    """
+    Entry point for the sbtools script.
+
+    The --profile and --timings options are handled here, since they
+    cover the construction of the SBTools object as well as the run.
+    So is --startup-report, which measures the run in new interpreters
+    instead.
+    """
+    (profile_file, timings, startup_runs) = pop_global_options(sys.argv)
+    if startup_runs is not None:
+        from sbstartup import report_startup, DEFAULT_WARM_RUNS
+        sys.exit(report_startup(sys.argv[1:], startup_runs or DEFAULT_WARM_RUNS))
+    if timings:
+        timer = PhaseTimer()
+    else:
+        timer = NullTimer()
+    timer.add_startup()
+
+    def run():
+        sbtools = SBTools(timer=timer)
+        return sbtools.run()
+
+    try:
+        if profile_file is not None:
+            status = run_profiled(run, profile_file)
+        else:
+            status = run()
+    finally:
+        timer.report()
+    sys.exit(status)
@@ -16,10 +16,20 @@ tools written in Python.
       packages=find_packages(exclude=['tests']),
       install_requires=[],
       entry_points = {
-        'console_scripts': ['sbtools = sbtools.sbtools:main'],
+        'console_scripts': ['sbtools = sbtools.sbtools:main',
+                            'sbtools-client = sbtools.sbclient:main',
+                            'sbtools-bench = sbtools.sbbench:main'],
         'SBTools.plugins': ['About about = sbtools.builtins:About',
+                            'Batch batch = sbtools.builtins:Batch',
+                            'Cache cache = sbtools.builtins:Cache',
+                            'Chain chain = sbtools.builtins:Chain',
                             'File file = sbtools.builtins:File',
-                            'Help help h ? = sbtools.builtins:Help'],
+                            'Help help h ? = sbtools.builtins:Help',
+                            'Parallel parallel = sbtools.builtins:Parallel',
+                            'RebuildIndex rebuild-index = sbtools.builtins:RebuildIndex',
+                            'Serve serve = sbtools.builtins:Serve'],
+        'distutils.setup_keywords': ['sbtools_metadata = sbtools.sbstatic:check_metadata'],
+        'egg_info.writers': ['sbtools_metadata.txt = sbtools.sbstatic:write_metadata'],
       },
       test_suite = "tests.tests.SBToolsTestSuite"
 )
@@ -0,0 +1,299 @@
+"""
+Benchmarks for the SBTools framework.
+
+Synthetic plug-in distributions are generated in a temporary
+directory for each environment size, and the framework operations
+whose cost grows with the number of installed plug-ins are timed:
+building the tool list (lazily, and eagerly with every plug-in
+imported), parsing the command line, rendering the help, looking up a
+tool by subcommand, and running 'sbtools <subcommand>' end to end.
+Each tool list is built with an empty registry cache in a temporary
+directory, so the user's cache is neither used nor written. The
+results are written as JSON.
+
+Usage: python -m tests.benchmarks [--sizes 10,100,1000,10000]
+           [--repeat N] [--output FILE]
+"""
+import os
+import sys
+import time
+import shutil
+import tempfile
+import platform
+import subprocess
+from optparse import OptionParser
+try:
+    import json
+except ImportError:
+    import simplejson as json
+from sbtools.sbtools import SBTools
+from sbtools.sbmetadata import DistributionMetadata
+from sbtools.sbregistry import RegistryCache
+
+DEFAULT_SIZES = [10, 100, 1000, 10000]
+
+PLUGIN_MODULE = '''from sbtools.sbtool import SBTool
+from sbtools.sboptparse import SBToolOptionParser
+
+class %(name)s(SBTool):
+    """Synthetic benchmark plug-in."""
+    def __init__(self, sbtools):
+        self.sbtools = sbtools
+        self.parser = self.init_parser()
+
+    def init_parser(self):
+        """Populate and return the parser object."""
+        usage = "%%s [options]" %% (self.get_command())
+        description = "A synthetic SBTools benchmark plug-in."
+        return SBToolOptionParser(self, self.sbtools, usage, description=description)
+
+    def get_about(self):
+        """Return this tool's 'about' information."""
+        return "The %(name)s tool is a synthetic benchmark plug-in."
+
+    def print_help(self):
+        """Print this tool's help information."""
+        self.parser.print_help()
+
+    def run(self):
+        """Run the tool."""
+        (self.options, self.args) = self.parser.parse_args()
+        print "%(name)s"
+'''
+
+PKG_INFO = '''Metadata-Version: 1.0
+Name: %(project)s
+Version: %(version)s
+Summary: Synthetic SBTools benchmark plug-in.
+'''
+
+def get_python_tag():
+    """Return the -pyX.Y tag of egg file names for this interpreter."""
+    return "py%d.%d" % sys.version_info[:2]
+
+def write_file(path, data):
+    """Write the string data to the file at path."""
+    dirname = os.path.dirname(path)
+    if not os.path.isdir(dirname):
+        os.makedirs(dirname)
+    f = open(path, 'w')
+    try:
+        f.write(data)
+    finally:
+        f.close()
+
+def get_plugin_subcommands(i):
+    """Return the subcommands of synthetic plug-in i (one to three)."""
+    return ["sc%d" % (i)] + ["sc%d-%d" % (i, j) for j in range(i % 3)]
+
+def write_plugin(location, i):
+    """
+    Write synthetic plug-in distribution i to location. The plug-ins
+    cycle through egg directories, egg-info directories, and
+    dist-info directories, through one to three subcommands, and
+    through import weights (extra module-level definitions).
+    """
+    project = "BenchPlugin%d" % (i)
+    version = "1.%d" % (i % 10)
+    package = "benchplugin%d" % (i)
+    name = "BenchTool%d" % (i)
+    epldata = " ".join([name] + get_plugin_subcommands(i))
+    entry_points = "[SBTools.plugins]\n%s = %s.tool:%s\n" % (epldata, package, name)
+    info = {'project': project, 'version': version, 'name': name}
+    module = PLUGIN_MODULE % info
+    weight = (i % 4) * 50
+    module += "".join(["\ndef helper%d(x):\n    return x + %d\n" % (j, j) for j in range(weight)])
+
+    kind = i % 3
+    if kind == 0:
+        root = os.path.join(location, "%s-%s-%s.egg" % (project, version, get_python_tag()))
+        metadir = os.path.join(root, 'EGG-INFO')
+        metafile = 'PKG-INFO'
+    elif kind == 1:
+        root = location
+        metadir = os.path.join(location, "%s-%s.egg-info" % (project, version))
+        metafile = 'PKG-INFO'
+    else:
+        root = location
+        metadir = os.path.join(location, "%s-%s.dist-info" % (project, version))
+        metafile = 'METADATA'
+    write_file(os.path.join(metadir, metafile), PKG_INFO % info)
+    write_file(os.path.join(metadir, 'entry_points.txt'), entry_points)
+    write_file(os.path.join(root, package, '__init__.py'), "")
+    write_file(os.path.join(root, package, 'tool.py'), module)
+
+def generate_plugins(location, count):
+    """Write count synthetic plug-in distributions to location."""
+    for i in range(count):
+        write_plugin(location, i)
+
+def time_calls(func, repeat, reset=None):
+    """
+    Call func repeat times and return the list of times in seconds.
+    If reset is given, it is called (untimed) before each call.
+    """
+    times = []
+    for i in range(repeat):
+        if reset is not None:
+            reset()
+        start = time.time()
+        func()
+        times.append(time.time() - start)
+    return times
+
+def summarize(times):
+    """Return the minimum, median, and mean of the list times."""
+    ordered = sorted(times)
+    n = len(ordered)
+    if n % 2:
+        median = ordered[n//2]
+    else:
+        median = (ordered[n//2 - 1] + ordered[n//2]) / 2.0
+    return {'samples': times, 'min': ordered[0], 'median': median,
+            'mean': sum(ordered) / n}
+
+def build_sbtools(location, lazy=True):
+    """
+    Return an SBTools object whose tool list holds the builtin tools
+    and the plug-ins in location, scanned from scratch with a new,
+    empty registry cache. If lazy is False, every plug-in is imported.
+    """
+    sbtools = SBTools(DistributionMetadata())
+    cachedir = tempfile.mkdtemp()
+    sbtools.registry_cache = RegistryCache(cachedir)
+    try:
+        sbtools.build_tool_list(True, [location], lazy=lazy)
+    finally:
+        shutil.rmtree(cachedir, True)
+    return sbtools
+
+def unload_plugins(location, saved_path):
+    """
+    Forget the synthetic plug-in modules imported from location and
+    restore sys.path to saved_path, so the next eager build imports
+    them again.
+    """
+    for name in sys.modules.keys():
+        module = sys.modules[name]
+        if name.startswith('benchplugin') or \
+                getattr(module, '__file__', '').startswith(location):
+            del sys.modules[name]
+    sys.path[:] = saved_path
+
+def run_in_process(location, count, repeat):
+    """Time the in-process framework operations for one environment."""
+    results = {}
+    results['build_tool_list'] = summarize(time_calls(lambda: build_sbtools(location), repeat))
+    saved_path = sys.path[:]
+    try:
+        results['build_tool_list_eager'] = summarize(time_calls(lambda: build_sbtools(location, False), repeat,
+                                                                lambda: unload_plugins(location, saved_path)))
+    finally:
+        unload_plugins(location, saved_path)
+
+    sbtools = build_sbtools(location)
+    sc = get_plugin_subcommands(count - 1)[0]
+
+    def parse_options():
+        sys.argv = ['sbtools', sc, '--flag']
+        sbtools.parse_options()
+    saved_argv = sys.argv
+    try:
+        results['parse_options'] = summarize(time_calls(parse_options, repeat))
+    finally:
+        sys.argv = saved_argv
+
+    # The subcommand listing is rendered once and memoized; forget it
+    # so each sample renders it.
+    def reset_listing():
+        sbtools.subcommand_listing = None
+    results['get_help'] = summarize(time_calls(sbtools.parser.get_help, repeat, reset_listing))
+    results['get_tool_by_subcommand'] = summarize(time_calls(lambda: sbtools.get_tool_by_subcommand(sc), repeat))
+    return results
+
+def run_command(location, cachedir, sc, use_cache):
+    """Run 'sbtools sc' in a new interpreter with location on sys.path."""
+    env = os.environ.copy()
+    srcdir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env['PYTHONPATH'] = os.pathsep.join([location, srcdir])
+    env['SBTOOLS_CACHE_DIR'] = cachedir
+    if use_cache:
+        env.pop('SBTOOLS_NO_CACHE', None)
+    else:
+        env['SBTOOLS_NO_CACHE'] = '1'
+    cmd = [sys.executable, '-c', "import sys; sys.argv[0] = 'sbtools'; from sbtools.sbtools import main; main()", sc]
+    proc = subprocess.Popen(cmd, env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    output = proc.communicate()[0]
+    if proc.returncode != 0:
+        raise RuntimeError("'sbtools %s' failed: %s" % (sc, output))
+
+def run_end_to_end(location, count, repeat):
+    """Time 'sbtools <sc>' without and with the registry cache."""
+    results = {}
+    cachedir = tempfile.mkdtemp()
+    sc = get_plugin_subcommands(count - 1)[0]
+    try:
+        results['end_to_end_uncached'] = summarize(time_calls(lambda: run_command(location, cachedir, sc, False), repeat))
+        # The first run fills the cache.
+        run_command(location, cachedir, sc, True)
+        results['end_to_end_cached'] = summarize(time_calls(lambda: run_command(location, cachedir, sc, True), repeat))
+    finally:
+        shutil.rmtree(cachedir, True)
+    return results
+
+def run_benchmarks(sizes, repeat, end_to_end=True, out=None):
+    """
+    Run the benchmarks for each environment size in sizes and return
+    the results. Progress is written to out, if given.
+    """
+    report = {'python': sys.version.split()[0],
+              'platform': platform.platform(),
+              'repeat': repeat,
+              'timestamp': time.time(),
+              'results': []}
+    for count in sizes:
+        location = tempfile.mkdtemp()
+        try:
+            if out is not None:
+                out.write("Generating %d plug-ins...\n" % (count))
+            start = time.time()
+            generate_plugins(location, count)
+            generate = time.time() - start
+            if out is not None:
+                out.write("Benchmarking %d plug-ins...\n" % (count))
+            metrics = run_in_process(location, count, repeat)
+            if end_to_end:
+                metrics.update(run_end_to_end(location, count, repeat))
+        finally:
+            shutil.rmtree(location, True)
+        report['results'].append({'plugins': count, 'generate': generate,
+                                  'metrics': metrics})
+    return report
+
+def main():
+    parser = OptionParser(usage="%prog [--sizes N,N,...] [--repeat N] [--output FILE]")
+    parser.add_option("--sizes", dest="sizes", default=",".join([str(n) for n in DEFAULT_SIZES]),
+                      help="comma-separated numbers of plug-ins to generate (default: %default)")
+    parser.add_option("--repeat", type="int", dest="repeat", default=5,
+                      help="samples taken of each measurement (default: %default)")
+    parser.add_option("--no-end-to-end", action="store_false", dest="end_to_end", default=True,
+                      help="skip the 'sbtools <subcommand>' runs in new interpreters")
+    parser.add_option("-o", "--output", dest="output", default=None,
+                      help="write the JSON results to FILE instead of standard output")
+    (options, args) = parser.parse_args()
+    try:
+        sizes = [int(n) for n in options.sizes.split(",")]
+    except ValueError:
+        parser.error("invalid --sizes value: '%s'" % (options.sizes))
+    if [n for n in sizes if n < 1] or options.repeat < 1:
+        parser.error("sizes and --repeat must be positive")
+
+    report = run_benchmarks(sizes, options.repeat, options.end_to_end, sys.stderr)
+    data = json.dumps(report, indent=2, sort_keys=True)
+    if options.output is None:
+        print data
+    else:
+        write_file(os.path.abspath(options.output), data + "\n")
+
+if __name__ == '__main__':
+    main()
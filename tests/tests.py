@@ -1,11 +1,40 @@
 import unittest
 import sys
 import textwrap
+import tempfile
+import shutil
+import os
+from StringIO import StringIO
 from sbtools import sbtools
 from sbtools.sbtools import SBTools
-from sbtools.sbtool import SBTool, SBToolError, EntryPointError
-from sbtools.builtins import Help, About, File
+from sbtools import sbtool
+from sbtools.sbtool import SBTool, SBToolError, EntryPointError, PluginLoadError
+from sbtools.builtins import Help, About, File, RebuildIndex, Serve, Batch, Parallel, Chain, Cache
 from sbtools.sboptparse import SBToolsOptionParser, SBToolOptionParser
+from sbtools.sbregistry import PluginRecord, RegistryCache, ToolHandle
+from sbtools.sbmetadata import DistributionMetadata, get_shared_metadata
+from sbtools import sbdiscovery
+from sbtools import sbindex
+import imp
+import math
+import time
+import socket
+from sbtools import sbclient
+from sbtools import sbserver
+from sbtools.sbserver import SBToolsServer
+from sbtools import sbbatch
+from sbtools import sbchain
+from sbtools import sbasync
+from sbtools import sbresultcache
+from sbtools import sbprofile
+from sbtools import sbbench
+from sbtools import sbstatic
+from sbtools import sbscan
+from sbtools import sbimportlib
+from sbtools import sbregistry
+from sbtools import sbstartup
+from sbtools import sbconfig
+import threading
 
 class TestSBToolsOptionParserMethods(unittest.TestCase):
     """
@@ -26,12 +55,20 @@ Type 'sbtools help <subcommand>' for help on a specific subcommand.
 Type 'sbtools --version' to see the program version.
 Type 'sbtools --verbose-load' to see the packages and plug-ins detected, and
 if plug-ins are successfully loaded.
+Type 'sbtools --load-report' to see how long each plug-in takes to load.
+Type 'sbtools --timings <subcommand>' or 'sbtools --profile[=FILE]
+<subcommand>' to see where the time of a run is spent.
+Type 'sbtools --startup-report <subcommand>' to see how long sbtools takes to
+start.
 
 Subcommands consist of built-in subcommands and subcommands provided by
 installed plug-ins.
 
+%s
+
 Available subcommands:
-%s""" % (self.sbtools.get_subcommands())
+%s""" % (textwrap.fill("Set SBTOOLS_DISCOVERY to 'scan', 'importlib', or 'pkg_resources' to choose how plug-ins are found. The 'importlib' backend needs importlib.metadata (Python 3.8) or the importlib_metadata package, and is not available on Python 2 without it.", 78),
+       self.sbtools.get_subcommands())
         self.assertEqual(helpstr, exptstr)
 
     def test003_get_unknown_argument_error(self):
@@ -231,6 +268,24 @@ class TestFileMethods(unittest.TestCase):
 
         sys.argv = argv_saved
 
+    def test008_run_plugin(self):
+        if sys.version_info[:2] != (2, 7):
+            return
+        self.sbtools.build_tool_list(True, ['tests/testfiles/plugins'], lazy=True)
+        argv_saved = sys.argv
+        stdout_saved = sys.stdout
+        sys.argv = ['sbtools', 'file', 'blank']
+        sys.stdout = StringIO()
+        try:
+            self.file.run()
+            # The location comes from the plug-in's record.
+            self.assertEqual(sys.stdout.getvalue(),
+                             self.sbtools.get_record_by_subcommand('blank').location + "\n")
+            self.assertTrue(sys.stdout.getvalue().startswith(os.path.join('tests', 'testfiles', 'plugins', 'Blank-')))
+        finally:
+            sys.argv = argv_saved
+            sys.stdout = stdout_saved
+
 class TestSBToolMethods(unittest.TestCase):
     """
     Unit tests for the SBTool class.
@@ -263,6 +318,30 @@ class TestSBToolMethods(unittest.TestCase):
     def test008_get_version(self):
         self.assertEqual(self.sbtool.get_version(), "0.5")
 
+    def test011_get_full_epldata_indexed(self):
+        self.sbtools.build_tool_list(True, ['tests/testfiles/plugins'])
+
+        class SubHelp(Help):
+            pass
+
+        tools = [Help(self.sbtools), SubHelp(self.sbtools),
+                 self.sbtools.get_tool_by_subcommand('bl')(self.sbtools)]
+        for tool in tools:
+            del tool.epldata
+
+        # Indexed plug-ins must not look up distribution metadata.
+        class NoMetadata:
+            def __getattr__(self, name):
+                raise AssertionError("distribution metadata used")
+        self.sbtools.metadata = NoMetadata()
+        self.assertEqual(tools[0].get_full_epldata(), "Help help h ?")
+        self.assertEqual(tools[1].get_full_epldata(), "Help help h ?")
+        self.assertEqual(tools[2].get_full_epldata(), "Blank blank bl")
+        self.assertEqual(tools[2].get_command(), "blank")
+        self.assertTrue(tools[2].get_version().startswith("0.2a1.dev"))
+        self.assertEqual(sbtool.find_plugin_record(Help).get_target(), "sbtools.builtins:Help")
+        self.assertEqual(sbtool.find_plugin_record(SBTool), None)
+
     def test009_print_help(self):
         self.assertRaises(NotImplementedError, self.sbtool.print_help)
 
@@ -405,9 +484,9 @@ class TestSBToolsMethods(unittest.TestCase):
     def test006_build_tool_list(self):
         self.sbtools.build_tool_list(True, ['tests/testfiles/plugins'])
 
-        keys = ['about', 'blank', 'bl', 'file', 'help', 'h', '?']
-        names = ['About', 'Help', 'File', 'Blank']
-        self.assertEqual(self.sbtools.tcmdlist, [['about'], ['blank', 'bl'], ['file'], ['help', 'h', '?']])
+        keys = ['about', 'batch', 'blank', 'bl', 'cache', 'chain', 'file', 'help', 'h', '?', 'parallel', 'rebuild-index', 'serve']
+        names = ['About', 'Batch', 'Help', 'File', 'Blank', 'Cache', 'Chain', 'Parallel', 'RebuildIndex', 'Serve']
+        self.assertEqual(self.sbtools.tcmdlist, [['about'], ['batch'], ['blank', 'bl'], ['cache'], ['chain'], ['file'], ['help', 'h', '?'], ['parallel'], ['rebuild-index'], ['serve']])
         self.assertEqual(len(self.sbtools.cmdmap), len(keys))
         for key in keys:
             self.assertTrue(self.sbtools.cmdmap.has_key(key))
@@ -415,6 +494,26 @@ class TestSBToolsMethods(unittest.TestCase):
         for name in names:
             self.assertTrue(self.sbtools.namemap.has_key(name))
 
+    def test018_build_tool_list_lazy(self):
+        self.sbtools.build_tool_list(True, ['tests/testfiles/plugins'], lazy=True)
+
+        self.assertEqual(self.sbtools.tcmdlist, [['about'], ['batch'], ['blank', 'bl'], ['cache'], ['chain'], ['file'], ['help', 'h', '?'], ['parallel'], ['rebuild-index'], ['serve']])
+        for sc in ['about', 'batch', 'blank', 'bl', 'cache', 'chain', 'file', 'help', 'h', '?', 'parallel', 'rebuild-index', 'serve']:
+            self.assertTrue(isinstance(self.sbtools.cmdmap[sc][0], ToolHandle))
+        handle = self.sbtools.get_tool_by_subcommand('help')
+        self.assertFalse(handle.is_loaded())
+        self.assertTrue(isinstance(handle(self.sbtools), Help))
+        self.assertEqual(handle.load(), Help)
+
+        # Load failures are reported when the plug-in is used.
+        rec = PluginRecord('Broken', ['broken'], 'notamodule', ['Broken'], False, '', '0.1')
+        handle = ToolHandle(rec)
+        self.assertRaises(PluginLoadError, handle, self.sbtools)
+        try:
+            handle.load()
+        except PluginLoadError, msg:
+            self.assertTrue(str(msg).startswith("Cannot load the Broken plug-in (cannot import:"))
+
     def test007_get_full_toolname(self):
         t1 = ['tname']
         t2 = ['tname', 'alt1']
@@ -430,9 +529,15 @@ class TestSBToolsMethods(unittest.TestCase):
         self.sbtools.build_tool_list(True, ['tests/testfiles/plugins'])
         sclist = self.sbtools.get_subcommands()
         self.assertEqual(sclist, """   about
+   batch
    blank (bl)
+   cache
+   chain
    file
    help (h, ?)
+   parallel
+   rebuild-index
+   serve
 """)
 
     def test009_get_about(self):
@@ -441,7 +546,7 @@ class TestSBToolsMethods(unittest.TestCase):
     def test010_has_tool_by_name(self):
         self.sbtools.build_tool_list(True, ['tests/testfiles/plugins'])
 
-        good_names = ['About', 'Help', 'File', 'Blank']
+        good_names = ['About', 'Batch', 'Help', 'File', 'Blank', 'Cache', 'Chain', 'Parallel', 'RebuildIndex', 'Serve']
         bad_names = ['Blah', 'Check', 'Not a real plug-in']
         for name in good_names:
             self.assertTrue(self.sbtools.has_tool_by_name(name))
@@ -451,7 +556,7 @@ class TestSBToolsMethods(unittest.TestCase):
     def test011_has_tool_by_subcommand(self):
         self.sbtools.build_tool_list(True, ['tests/testfiles/plugins'])
 
-        good_scs = ['about', 'blank', 'bl', 'file', 'help', 'h', '?']
+        good_scs = ['about', 'batch', 'blank', 'bl', 'cache', 'chain', 'file', 'help', 'h', '?', 'parallel', 'rebuild-index', 'serve']
         bad_scs = ['blah', 'check', 'notreal']
         for sc in good_scs:
             self.assertTrue(self.sbtools.has_tool_by_subcommand(sc))
@@ -461,7 +566,7 @@ class TestSBToolsMethods(unittest.TestCase):
     def test012_get_tool_by_name(self):
         self.sbtools.build_tool_list(True, ['tests/testfiles/plugins'])
 
-        good_names = ['About', 'Help', 'File', 'Blank']
+        good_names = ['About', 'Batch', 'Help', 'File', 'Blank', 'Cache', 'Chain', 'Parallel', 'RebuildIndex', 'Serve']
         bad_names = ['Blah', 'Check', 'Not a real plug-in']
         for name in good_names:
             self.assertEqual(self.sbtools.get_tool_by_name(name), self.sbtools.namemap[name][0])
@@ -471,7 +576,7 @@ class TestSBToolsMethods(unittest.TestCase):
     def test013_get_tool_by_subcommand(self):
         self.sbtools.build_tool_list(True, ['tests/testfiles/plugins'])
 
-        good_scs = ['about', 'blank', 'bl', 'file', 'help', 'h', '?']
+        good_scs = ['about', 'batch', 'blank', 'bl', 'cache', 'chain', 'file', 'help', 'h', '?', 'parallel', 'rebuild-index', 'serve']
         bad_scs = ['blah', 'check', 'notreal']
         for sc in good_scs:
             self.assertEqual(self.sbtools.get_tool_by_subcommand(sc), self.sbtools.cmdmap[sc][0])
@@ -481,7 +586,7 @@ class TestSBToolsMethods(unittest.TestCase):
     def test014_is_tool_builtin_by_name(self):
         self.sbtools.build_tool_list(True, ['tests/testfiles/plugins'])
 
-        good_names = ['About', 'Help', 'File', 'Blank']
+        good_names = ['About', 'Batch', 'Help', 'File', 'Blank', 'Cache', 'Chain', 'Parallel', 'RebuildIndex', 'Serve']
         bad_names = ['Blah', 'Check', 'Not a real plug-in']
         for name in good_names:
             self.assertEqual(self.sbtools.is_tool_builtin_by_name(name), self.sbtools.namemap[name][1])
@@ -491,7 +596,7 @@ class TestSBToolsMethods(unittest.TestCase):
     def test015_is_tool_builtin_by_subcommand(self):
         self.sbtools.build_tool_list(True, ['tests/testfiles/plugins'])
 
-        good_scs = ['about', 'blank', 'bl', 'file', 'help', 'h', '?']
+        good_scs = ['about', 'batch', 'blank', 'bl', 'cache', 'chain', 'file', 'help', 'h', '?', 'parallel', 'rebuild-index', 'serve']
         bad_scs = ['blah', 'check', 'notreal']
         for sc in good_scs:
             self.assertEqual(self.sbtools.is_tool_builtin_by_subcommand(sc), self.sbtools.cmdmap[sc][1])
@@ -501,7 +606,7 @@ class TestSBToolsMethods(unittest.TestCase):
     def test016_get_toolname_list(self):
         self.sbtools.build_tool_list(True, ['tests/testfiles/plugins'])
 
-        names = ['About', 'Help', 'File', 'Blank']
+        names = ['About', 'Batch', 'Help', 'File', 'Blank', 'Cache', 'Chain', 'Parallel', 'RebuildIndex', 'Serve']
         tnlist = self.sbtools.get_toolname_list()
         self.assertEqual(len(tnlist), len(names))
         for name in names:
@@ -510,12 +615,1526 @@ class TestSBToolsMethods(unittest.TestCase):
     def test017_get_tool_subcommand_list(self):
         self.sbtools.build_tool_list(True, ['tests/testfiles/plugins'])
 
-        scs = ['about', 'blank', 'bl', 'file', 'help', 'h', '?']
+        scs = ['about', 'batch', 'blank', 'bl', 'cache', 'chain', 'file', 'help', 'h', '?', 'parallel', 'rebuild-index', 'serve']
         sclist = self.sbtools.get_tool_subcommand_list()
         self.assertEqual(len(sclist), len(scs))
         for sc in scs:
             self.assertTrue(sc in sclist)
 
+class TestRegistryCacheMethods(unittest.TestCase):
+    """
+    Unit tests for the RegistryCache class.
+    """
+    def setUp(self):
+        self.cachedir = tempfile.mkdtemp()
+        self.cache = RegistryCache(self.cachedir)
+        self.locations = ['tests/testfiles/plugins']
+
+    def tearDown(self):
+        shutil.rmtree(self.cachedir)
+
+    def test001_store_load(self):
+        rec = PluginRecord('Help', ['help', 'h', '?'], 'sbtools.builtins',
+                           ['Help'], True, '/some/location', '0.5')
+        fingerprint = self.cache.get_fingerprint(self.locations)
+        self.assertEqual(self.cache.load(self.locations, True, fingerprint), None)
+        self.cache.store(self.locations, True, fingerprint, [rec])
+
+        records = self.cache.load(self.locations, True, fingerprint)
+        self.assertEqual(len(records), 1)
+        self.assertEqual(records[0].to_dict(), rec.to_dict())
+        self.assertEqual(records[0].get_epldata(), "Help help h ?")
+        self.assertEqual(records[0].get_target(), "sbtools.builtins:Help")
+
+        # Cached registries are tied to their context and fingerprint.
+        self.assertEqual(self.cache.load(self.locations, False, fingerprint), None)
+        self.assertEqual(self.cache.load(self.locations, True, "stale"), None)
+
+    def test002_fingerprint(self):
+        fingerprint = self.cache.get_fingerprint([self.cachedir])
+        self.assertEqual(self.cache.get_fingerprint([self.cachedir]), fingerprint)
+        os.mkdir(os.path.join(self.cachedir, 'New-0.1-py2.5.egg'))
+        self.assertNotEqual(self.cache.get_fingerprint([self.cachedir]), fingerprint)
+
+    def test003_build_tool_list(self):
+        sbt = SBTools()
+        sbt.registry_cache = self.cache
+        sbt.build_tool_list(True, self.locations, use_cache=True)
+        self.assertEqual(len(os.listdir(self.cachedir)), 1)
+
+        # The second tool list is restored from the cache.
+        cached = SBTools()
+        cached.registry_cache = self.cache
+        cached.build_tool_list(True, self.locations, use_cache=True)
+        self.assertEqual(cached.tcmdlist, sbt.tcmdlist)
+        self.assertEqual(cached.cmdmap, sbt.cmdmap)
+        self.assertEqual(cached.namemap, sbt.namemap)
+
+    def test004_build_partial_tool_list(self):
+        sbt = SBTools()
+        sbt.registry_cache = self.cache
+        self.assertFalse(sbt.build_partial_tool_list('help'))
+        sbt.build_tool_list(use_cache=True, lazy=True)
+
+        partial = SBTools()
+        partial.registry_cache = self.cache
+        self.assertFalse(partial.build_partial_tool_list('unknown-sc'))
+        self.assertTrue(partial.build_partial_tool_list('h'))
+        self.assertEqual(partial.tcmdlist, [['help', 'h', '?']])
+        self.assertTrue(partial.cmdmap.has_key('?'))
+        self.assertFalse(partial.cmdmap.has_key('about'))
+
+        # Querying the tools completes the tool list.
+        self.assertTrue(partial.has_tool_by_subcommand('about'))
+        self.assertEqual(partial.tcmdlist, sbt.tcmdlist)
+        self.assertFalse(partial.partial_tool_list)
+
+    def test005_subcommand_listing(self):
+        sbt = SBTools()
+        sbt.registry_cache = self.cache
+        sbt.build_tool_list(use_cache=True, lazy=True)
+        listing = sbt.get_subcommands()
+        self.assertTrue(sbt.get_subcommands() is listing)
+
+        # The stored listing is used without completing the tool list.
+        partial = SBTools()
+        partial.registry_cache = self.cache
+        self.assertTrue(partial.build_partial_tool_list('help'))
+        self.assertEqual(partial.get_subcommands(), listing)
+        self.assertTrue(partial.partial_tool_list)
+        self.assertEqual(partial.tcmdlist, [['help', 'h', '?']])
+
+        # A listing stored for other plug-ins is not used.
+        self.cache.store_listing(sys.path, 'other', "   stale\n")
+        partial = SBTools()
+        partial.registry_cache = self.cache
+        self.assertTrue(partial.build_partial_tool_list('help'))
+        self.assertEqual(partial.get_subcommands(), listing)
+        self.assertFalse(partial.partial_tool_list)
+
+    def test006_load_failures(self):
+        location = tempfile.mkdtemp()
+        try:
+            metadir = os.path.join(location, 'Broken-1.0.egg-info')
+            os.mkdir(metadir)
+            for (fname, data) in [('PKG-INFO', "Metadata-Version: 1.0\nName: Broken\nVersion: 1.0\n"),
+                                  ('entry_points.txt', "[SBTools.plugins]\nBroken broken = brokenplugin:Broken\n")]:
+                f = open(os.path.join(metadir, fname), 'w')
+                f.write(data)
+                f.close()
+            searchpath = sys.path + [location]
+
+            def build():
+                sbt = SBTools(DistributionMetadata())
+                sbt.registry_cache = self.cache
+                # Activating the distribution modifies sys.path, which
+                # would change the context of the next build.
+                path_saved = sys.path[:]
+                stdout_saved = sys.stdout
+                sys.stdout = StringIO()
+                try:
+                    sbt.build_tool_list(True, [location], verbose_load=True, use_failure_cache=True)
+                    return (sbt, sys.stdout.getvalue())
+                finally:
+                    sys.stdout = stdout_saved
+                    sys.path[:] = path_saved
+
+            (sbt, output) = build()
+            self.assertTrue("'Broken' plug-in...cannot import: No module named brokenplugin...\n" in output)
+            self.assertFalse(sbt.has_tool_by_name('Broken'))
+            fingerprint = self.cache.get_fingerprint(searchpath)
+            failures = self.cache.load_failures(searchpath, fingerprint)
+            self.assertEqual(failures.keys(), [(location, 'Broken broken')])
+            failure = failures[(location, 'Broken broken')]
+            self.assertEqual((failure.project, failure.error_class), ('Broken', 'ImportError'))
+
+            # The failure is reported from the cache.
+            (sbt, output) = build()
+            self.assertTrue("'Broken' plug-in...cannot import: No module named brokenplugin (cached)...\n" in output)
+            self.assertEqual(self.cache.load_failures(searchpath, "stale"), {})
+
+            # Failures are forgotten when the distribution changes.
+            os.utime(metadir, (0, 0))
+            (sbt, output) = build()
+            self.assertFalse("(cached)" in output)
+        finally:
+            shutil.rmtree(location, True)
+
+    def test007_lazy_load_failures(self):
+        location = tempfile.mkdtemp()
+        logfile = os.path.join(self.cachedir, 'imports.log')
+        try:
+            metadir = os.path.join(location, 'Broken-1.0.egg-info')
+            os.mkdir(metadir)
+            for (fname, data) in [(os.path.join(metadir, 'PKG-INFO'), "Metadata-Version: 1.0\nName: Broken\nVersion: 1.0\n"),
+                                  (os.path.join(metadir, 'entry_points.txt'), "[SBTools.plugins]\nBroken broken = lazybrokenplugin:Broken\n"),
+                                  (os.path.join(location, 'lazybrokenplugin.py'),
+                                   "open(%r, 'a').write('imported\\n')\nimport notamodule\n" % (logfile))]:
+                f = open(fname, 'w')
+                f.write(data)
+                f.close()
+
+            def dispatch():
+                sbt = SBTools(DistributionMetadata(), config=sbconfig.DiscoveryConfig([location], False))
+                sbt.registry_cache = self.cache
+                # Loading the plug-in modifies sys.path, which would
+                # change the context of the next run, and writing its
+                # bytecode would change its distribution.
+                path_saved = sys.path[:]
+                argv_saved = sys.argv
+                stdout_saved = sys.stdout
+                bytecode_saved = sys.dont_write_bytecode
+                sys.argv = ['sbtools', 'broken']
+                sys.stdout = StringIO()
+                sys.dont_write_bytecode = True
+                try:
+                    status = sbt.run()
+                    return (status, sys.stdout.getvalue())
+                finally:
+                    sys.dont_write_bytecode = bytecode_saved
+                    sys.stdout = stdout_saved
+                    sys.argv = argv_saved
+                    sys.path[:] = path_saved
+
+            for i in range(2):
+                (status, output) = dispatch()
+                self.assertEqual(status, 1)
+                self.assertTrue(output.startswith("Cannot load the Broken plug-in (cannot import: No module named notamodule)."))
+            # The second dispatch did not import the plug-in.
+            self.assertEqual(open(logfile).read(), "imported\n")
+
+            # Failures are forgotten when the distribution changes.
+            os.utime(metadir, (0, 0))
+            dispatch()
+            self.assertEqual(open(logfile).read(), "imported\n" * 2)
+        finally:
+            sys.modules.pop('lazybrokenplugin', None)
+            shutil.rmtree(location, True)
+
+class TestDistributionMetadataMethods(unittest.TestCase):
+    """
+    Unit tests for the DistributionMetadata class.
+    """
+    def setUp(self):
+        self.metadata = DistributionMetadata()
+
+    def test001_shared(self):
+        self.assertTrue(get_shared_metadata() is get_shared_metadata())
+        self.assertTrue(SBTools().metadata is get_shared_metadata())
+
+    def test002_get_environment(self):
+        env = self.metadata.get_environment()
+        self.assertTrue(self.metadata.get_environment() is env)
+        suppenv = self.metadata.get_environment('tests/testfiles/plugins')
+        self.assertTrue(self.metadata.get_environment('tests/testfiles/plugins') is suppenv)
+        self.assertTrue(suppenv["blank"][0].version.startswith("0.2a1.dev"))
+
+        self.metadata.invalidate('tests/testfiles/plugins')
+        self.assertTrue(self.metadata.get_environment() is env)
+        self.assertFalse(self.metadata.get_environment('tests/testfiles/plugins') is suppenv)
+        self.metadata.invalidate()
+        self.assertFalse(self.metadata.get_environment() is env)
+
+    def test003_get_distribution(self):
+        dist = self.metadata.get_distribution('sbtools')
+        self.assertEqual(dist.project_name, "SBTools")
+        self.assertEqual(self.metadata.get_version('sbtools'), dist.version)
+        self.assertEqual(self.metadata.get_location('sbtools'), dist.location)
+        self.assertEqual(self.metadata.get_distribution('not-a-real-project'), None)
+        self.assertRaises(IndexError, self.metadata.get_version, 'not-a-real-project')
+
+class TestDiscoveryMethods(unittest.TestCase):
+    """
+    Unit tests for the plug-in discovery pipeline.
+    """
+    def setUp(self):
+        self.metadata = DistributionMetadata()
+        self.out = StringIO()
+        self.reporter = sbdiscovery.DiscoveryReporter(True, self.out)
+
+    def test001_validate_entry_points(self):
+        candidates = [sbdiscovery.PluginCandidate(None, " ", False),
+                      sbdiscovery.PluginCandidate(None, "NoSubcommands", False),
+                      sbdiscovery.PluginCandidate(None, "Good good g", False, "GoodDist")]
+        valid = list(sbdiscovery.validate_entry_points(candidates, self.reporter))
+        self.assertEqual(len(valid), 1)
+        self.assertEqual(valid[0].name, "GoodDist")
+        self.assertEqual(valid[0].subcommands, ['good', 'g'])
+        self.assertEqual(self.out.getvalue(), "Un-named plug-in...cannot load...'NoSubcommands' plug-in...no subcommands...cannot load...'Good' plug-in...")
+
+    def test002_discover_plugins(self):
+        locations = ['tests/testfiles/plugins']
+        candidates = list(sbdiscovery.discover_plugins(self.metadata, locations, 'sbtools',
+                                                       lazy=True, reporter=self.reporter))
+        self.assertEqual(len(candidates), 1)
+        self.assertEqual(candidates[0].name, "Blank")
+        self.assertEqual(candidates[0].subcommands, ['blank', 'bl'])
+        self.assertFalse(candidates[0].isbuiltin)
+        self.assertFalse(candidates[0].cls.is_loaded())
+        self.assertEqual(candidates[0].record.get_target(), "blank.blank:Blank")
+        self.assertEqual(self.out.getvalue(), "Found 'blank' package...'Blank' plug-in...\n")
+
+        # Only the builtin distribution is used from sys.path.
+        candidates = list(sbdiscovery.discover_plugins(self.metadata, [None], 'sbtools', builtin_only=True))
+        self.assertEqual(len(candidates), 9)
+        for candidate in candidates:
+            self.assertTrue(candidate.isbuiltin)
+
+class TestDispatchTableMethods(unittest.TestCase):
+    """
+    Unit tests for the generated dispatch table.
+    """
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.cachedir = os.path.join(self.tmpdir, 'cache')
+        self.path = sbindex.get_dispatch_table_file(self.cachedir)
+        self.sbtools = SBTools()
+        self.sbtools.registry_cache = RegistryCache(self.cachedir)
+        self.sbtools.build_tool_list(lazy=True)
+        self.searchpath = list(sys.path)
+        self.fingerprint = self.sbtools.registry_cache.get_fingerprint(self.searchpath)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test001_write_read(self):
+        self.assertEqual(self.path, os.path.join(self.cachedir, 'sbdispatch.py'))
+        self.assertEqual(sbindex.load_dispatch_table(self.cachedir, self.searchpath, self.fingerprint), None)
+        sbindex.write_dispatch_table(self.path, self.searchpath, self.fingerprint, self.sbtools.records)
+        self.assertTrue(os.path.exists(self.path + 'c'))
+        module = imp.load_source('sbdispatch_test', self.path)
+
+        records = sbindex.read_dispatch_table(module, self.searchpath, self.fingerprint)
+        self.assertEqual([rec.to_dict() for rec in records],
+                         [rec.to_dict() for rec in self.sbtools.records])
+        self.assertEqual(sbindex.read_dispatch_table(module, self.searchpath, "stale"), None)
+        self.assertEqual(sbindex.read_dispatch_table(module, self.searchpath + ['/new'], self.fingerprint), None)
+
+        # The table is imported from the cache directory only.
+        records = sbindex.load_dispatch_table(self.cachedir, self.searchpath, self.fingerprint)
+        self.assertEqual([rec.to_dict() for rec in records],
+                         [rec.to_dict() for rec in self.sbtools.records])
+        self.assertEqual(sbindex.load_dispatch_table(self.tmpdir, self.searchpath, self.fingerprint), None)
+
+        self.assertTrue(sbindex.remove_dispatch_table(self.path))
+        self.assertFalse(os.path.exists(self.path))
+        self.assertFalse(sbindex.remove_dispatch_table(self.path))
+
+    def test002_rebuild_index_init_parser(self):
+        rebuild = RebuildIndex(self.sbtools)
+        self.assertEqual(rebuild.parser.get_usage().strip(), "Usage: rebuild-index [options]")
+        self.assertEqual(rebuild.get_full_command_str(), "rebuild-index")
+
+class TestServerMethods(unittest.TestCase):
+    """
+    Unit tests for the sbtools server and client.
+    """
+    def setUp(self):
+        self.sbtools = SBTools()
+        self.sbtools.build_tool_list(True, ['tests/testfiles/plugins'], lazy=True)
+        self.server = SBToolsServer(self.sbtools, '/nonexistent/server.sock')
+
+    def run_request(self, argv, stdin=""):
+        (client, server) = socket.socketpair()
+        try:
+            sbclient.send_request(client, argv, os.getcwd(), {'SBTOOLS_TEST': '1'}, stdin)
+            self.server.handle_connection(server)
+            out = StringIO()
+            err = StringIO()
+            status = sbclient.receive_response(client, out, err)
+        finally:
+            client.close()
+            server.close()
+        return (status, out.getvalue(), err.getvalue())
+
+    def test001_frames(self):
+        f = StringIO()
+        sbclient.write_frame(f, sbclient.FRAME_ARG, "help")
+        sbclient.write_frame(f, sbclient.FRAME_END)
+        self.assertEqual(f.getvalue(), "a4:helpz0:")
+        f.seek(0)
+        self.assertEqual(sbclient.read_frame(f), ('a', "help"))
+        self.assertEqual(sbclient.read_frame(f), ('z', ""))
+        self.assertEqual(sbclient.read_frame(f), (None, None))
+
+    def test002_invoke(self):
+        saved_stdout = sys.stdout
+        sys.stdout = StringIO()
+        try:
+            self.assertEqual(self.sbtools.invoke(['sbtools', 'about']), 0)
+            self.assertEqual(self.sbtools.invoke(['sbtools', 'unknown-sc']), 0)
+            self.assertEqual(self.sbtools.invoke(['sbtools', 'blank', '--error']), 1)
+        finally:
+            sys.stdout = saved_stdout
+
+    def test003_handle_connection(self):
+        saved_argv = sys.argv[:]
+        self.assertEqual(self.run_request(['sbtools', 'blank']), (0, "Hello, world.\n", ""))
+        (status, out, err) = self.run_request(['sbtools', 'blank', '--error'])
+        self.assertEqual(status, 1)
+        self.assertTrue(out.startswith("This is the preferred way"))
+        (status, out, err) = self.run_request(['sbtools', '--version'])
+        self.assertEqual(status, 0)
+        self.assertTrue(out.startswith("sbtools "))
+
+        # The server state is restored after each request.
+        self.assertEqual(sys.argv, saved_argv)
+        self.assertFalse(os.environ.has_key('SBTOOLS_TEST'))
+
+    def test004_fork_connection(self):
+        server = SBToolsServer(self.sbtools, '/nonexistent/server.sock', True, ['textwrap', 'notamodule'])
+        saved_stderr = sys.stderr
+        sys.stderr = StringIO()
+        try:
+            server.preload()
+            self.assertEqual(sys.stderr.getvalue(), "Cannot preload module 'notamodule': No module named notamodule\n")
+        finally:
+            sys.stderr = saved_stderr
+
+        (client, conn) = socket.socketpair()
+        try:
+            # The child is still waiting for the request when the
+            # server collects finished children, so it is left to us.
+            pid = server.fork_connection(conn)
+            sbclient.send_request(client, ['sbtools', 'blank'], os.getcwd(), {})
+            out = StringIO()
+            err = StringIO()
+            status = sbclient.receive_response(client, out, err)
+        finally:
+            client.close()
+        self.assertEqual((status, out.getvalue(), err.getvalue()), (0, "Hello, world.\n", ""))
+        self.assertEqual(os.waitpid(pid, 0)[1], 0)
+
+    def test005_reap_idle_children(self):
+        import signal
+        server = SBToolsServer(self.sbtools, '/nonexistent/server.sock', True)
+        previous_handler = signal.signal(signal.SIGCHLD, server.handle_sigchld)
+        try:
+            (client, conn) = socket.socketpair()
+            try:
+                pid = server.fork_connection(conn)
+                sbclient.send_request(client, ['sbtools', 'blank'], os.getcwd(), {})
+                status = sbclient.receive_response(client, StringIO(), StringIO())
+            finally:
+                client.close()
+            self.assertEqual(status, 0)
+            # The child is collected when it exits, without another
+            # connection being accepted.
+            for i in range(100):
+                if not server.children:
+                    break
+                time.sleep(0.05)
+            self.assertEqual(server.children, [])
+            self.assertRaises(OSError, os.waitpid, pid, os.WNOHANG)
+        finally:
+            signal.signal(signal.SIGCHLD, previous_handler)
+
+    def test006_bind_private_socket(self):
+        tmpdir = tempfile.mkdtemp()
+        server = SBToolsServer(self.sbtools, os.path.join(tmpdir, 'run', 'server.sock'))
+        try:
+            server.bind()
+            self.assertEqual(os.stat(os.path.dirname(server.path)).st_mode & 0777, 0700)
+            self.assertEqual(os.stat(server.path).st_mode & 0777, 0600)
+            client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                client.connect(server.path)
+                (conn, addr) = server.sock.accept()
+                try:
+                    if sys.platform.startswith('linux'):
+                        self.assertEqual(sbserver.get_peer_uid(conn), os.getuid())
+                    self.assertTrue(server.is_peer_allowed(conn))
+                finally:
+                    conn.close()
+            finally:
+                client.close()
+        finally:
+            server.close()
+            shutil.rmtree(tmpdir)
+
+    def test007_serve_restores_sigterm_handler(self):
+        import signal
+        def serve_forever(server):
+            self.assertEqual(signal.getsignal(signal.SIGTERM), serve.terminate)
+            raise KeyboardInterrupt
+        saved = (SBToolsServer.preload, SBToolsServer.bind, SBToolsServer.serve_forever)
+        saved_argv = sys.argv
+        saved_stderr = sys.stderr
+        previous_handler = signal.signal(signal.SIGTERM, signal.SIG_IGN)
+        SBToolsServer.preload = SBToolsServer.bind = lambda server: None
+        SBToolsServer.serve_forever = serve_forever
+        try:
+            sys.argv = ['sbtools', 'serve']
+            sys.stderr = StringIO()
+            serve = Serve(self.sbtools)
+            serve.run()
+            self.assertEqual(signal.getsignal(signal.SIGTERM), signal.SIG_IGN)
+        finally:
+            (SBToolsServer.preload, SBToolsServer.bind, SBToolsServer.serve_forever) = saved
+            sys.argv = saved_argv
+            sys.stderr = saved_stderr
+            signal.signal(signal.SIGTERM, previous_handler)
+
+class TestBatchMethods(unittest.TestCase):
+    """
+    Unit tests for the Batch tool.
+    """
+    def setUp(self):
+        self.sbtools = SBTools()
+        self.sbtools.build_tool_list(True, ['tests/testfiles/plugins'], lazy=True)
+        self.saved_argv = sys.argv[:]
+        self.saved_streams = (sys.stdout, sys.stderr)
+        (sys.stdout, sys.stderr) = (StringIO(), StringIO())
+
+    def tearDown(self):
+        sys.argv = self.saved_argv
+        (sys.stdout, sys.stderr) = self.saved_streams
+
+    def test001_read_batch(self):
+        f = StringIO("about\n\n# A comment.\nblank --error 'a b'  # trailing\n")
+        commands = sbbatch.read_batch(f)
+        self.assertEqual([(c.lineno, c.argv) for c in commands],
+                         [(1, ['sbtools', 'about']), (4, ['sbtools', 'blank', '--error', 'a b'])])
+        self.assertRaises(sbbatch.BatchError, sbbatch.read_batch, StringIO("about 'open\n"))
+
+    def test002_run_captured(self):
+        command = sbbatch.BatchCommand(1, ['sbtools', 'blank'])
+        self.assertEqual(sbbatch.run_captured(self.sbtools, command), 0)
+        self.assertEqual(command.stdout, "Hello, world.\n")
+        command = sbbatch.BatchCommand(2, ['sbtools', 'blank', '--error'])
+        self.assertEqual(sbbatch.run_captured(self.sbtools, command), 1)
+        self.assertEqual(sys.argv, self.saved_argv)
+        self.assertEqual(sys.stdout.getvalue(), "")
+
+    def test003_run(self):
+        (fd, fname) = tempfile.mkstemp()
+        os.write(fd, "blank\nblank --error\nblank\n")
+        os.close(fd)
+        try:
+            batch = Batch(self.sbtools)
+            sys.argv = ['sbtools', 'batch', fname]
+            self.assertRaises(SBToolError, batch.run)
+            self.assertEqual(sys.stdout.getvalue().count("Hello, world.\n"), 2)
+            self.assertTrue(sys.stderr.getvalue().endswith("Line 2: 'blank --error' exited with status 1.\n"))
+
+            sys.stdout.truncate(0)
+            sys.argv = ['sbtools', 'batch', '--stop-on-error', fname]
+            self.assertRaises(SBToolError, batch.run)
+            self.assertEqual(sys.stdout.getvalue().count("Hello, world.\n"), 1)
+        finally:
+            os.remove(fname)
+
+    def test004_parallel(self):
+        (fd, fname) = tempfile.mkstemp()
+        os.write(fd, "blank\nblank --error\nabout blank\n")
+        os.close(fd)
+        try:
+            parallel = Parallel(self.sbtools)
+            sys.argv = ['sbtools', 'parallel', '--jobs', '2', fname]
+            self.assertRaises(SBToolError, parallel.run)
+            out = sys.stdout.getvalue()
+            self.assertTrue(out.startswith("Hello, world.\nThis is the preferred way"))
+            self.assertEqual(out.count("Hello, world.\n"), 1)
+            self.assertEqual(sys.stderr.getvalue(), "Line 2: 'blank --error' exited with status 1.\n")
+
+            sys.argv = ['sbtools', 'parallel', '--jobs', '0', fname]
+            self.assertRaises(SBToolError, parallel.run)
+        finally:
+            os.remove(fname)
+
+class TestChainMethods(unittest.TestCase):
+    """
+    Unit tests for the Chain tool.
+    """
+    def setUp(self):
+        self.sbtools = SBTools()
+        self.sbtools.build_tool_list(True, ['tests/testfiles/plugins'], lazy=True)
+
+        class Upper(SBTool):
+            def run_stream(self, records):
+                for rec in records:
+                    yield rec.upper()
+
+        stage_argv = self.stage_argv = []
+        class Length(SBTool):
+            def run_stream(self, records):
+                for rec in records:
+                    # Each stage sees its own command line.
+                    stage_argv.append(sys.argv[1:])
+                    yield len(rec.strip())
+
+        self.sbtools.add_tool(Upper, 'Upper', False, ['upper'])
+        self.sbtools.add_tool(Length, 'Length', False, ['length'])
+        self.saved = (sys.argv[:], sys.stdin, sys.stdout)
+        sys.stdout = StringIO()
+
+    def tearDown(self):
+        (sys.argv, sys.stdin, sys.stdout) = self.saved
+
+    def test001_split_chain(self):
+        self.assertEqual(sbchain.split_chain(['a', '-x', '::', 'b', '::']), [['a', '-x'], ['b'], []])
+
+    def test002_format_record(self):
+        self.assertEqual(sbchain.format_record("a"), "a\n")
+        self.assertEqual(sbchain.format_record(u"b\n"), "b\n")
+        self.assertEqual(sbchain.format_record(3), "3\n")
+
+    def test003_run_streaming(self):
+        sys.stdin = StringIO("ab\nabc\n")
+        sys.argv = ['sbtools', 'chain', 'upper', '::', 'length', '-v']
+        Chain(self.sbtools).run()
+        self.assertEqual(sys.stdout.getvalue(), "2\n3\n")
+        self.assertEqual(self.stage_argv, [['length', '-v'], ['length', '-v']])
+
+    def test004_run_fallback(self):
+        sys.argv = ['sbtools', 'chain', 'blank', '::', 'upper', '::', 'length']
+        Chain(self.sbtools).run()
+        self.assertEqual(sys.stdout.getvalue(), "13\n")
+        sys.stdout.truncate(0)
+        sys.argv = ['sbtools', 'chain', 'blank', '::', 'upper', '::', 'blank']
+        Chain(self.sbtools).run()
+        self.assertEqual(sys.stdout.getvalue(), "Hello, world.\n")
+
+    def test005_run_errors(self):
+        sys.argv = ['sbtools', 'chain', 'upper', '::', '::', 'length']
+        self.assertRaises(SBToolError, Chain(self.sbtools).run)
+        sys.argv = ['sbtools', 'chain', 'upper', '::', 'nosuch']
+        self.assertRaises(sbtools.UnknownSubcommandError, Chain(self.sbtools).run)
+        sys.argv = ['sbtools', 'chain']
+        self.assertRaises(SBToolError, Chain(self.sbtools).run)
+        sys.argv = ['sbtools', 'chain', '--nosuch', 'upper']
+        self.assertRaises(SBToolError, Chain(self.sbtools).run)
+
+    def test006_run_options(self):
+        # Options before the first stage are the chain's own, and the
+        # options of the stages are left to them.
+        chain = Chain(self.sbtools)
+        sys.argv = ['sbtools', 'chain', '--', 'upper', '::', 'length', '-v']
+        sys.stdin = StringIO("a\nbc\n")
+        chain.run()
+        self.assertEqual(chain.args, ['chain', 'upper', '::', 'length', '-v'])
+        self.assertEqual(self.stage_argv, [['length', '-v'], ['length', '-v']])
+
+class TestAsyncMethods(unittest.TestCase):
+    """
+    Unit tests for the event loop that runs asynchronous tools.
+    """
+    def setUp(self):
+        self.sbtools = SBTools()
+        self.sbtools.build_tool_list(True, ['tests/testfiles/plugins'], lazy=True)
+        self.saved = (sys.argv[:], sys.stdout)
+        sys.stdout = StringIO()
+
+    def tearDown(self):
+        (sys.argv, sys.stdout) = self.saved
+
+    def test001_run_coroutine(self):
+        event = threading.Event()
+        results = []
+        def coroutine():
+            # The first call only returns if the second one runs
+            # concurrently with it.
+            value = yield [lambda: event.wait(5) or event.isSet(), event.set]
+            results.append(value)
+            value = yield lambda: 42
+            results.append(value)
+            try:
+                yield lambda: 1/0
+            except ZeroDivisionError:
+                results.append('caught')
+        sbasync.run_coroutine(coroutine())
+        self.assertEqual(results, [[True, None], 42, 'caught'])
+
+    def test002_run_coroutine_errors(self):
+        def coroutine():
+            yield "not callable"
+        self.assertRaises(TypeError, sbasync.run_coroutine, coroutine())
+        def coroutine():
+            yield lambda: sbtool_error()
+        def sbtool_error():
+            raise SBToolError("Failed.")
+        self.assertRaises(SBToolError, sbasync.run_coroutine, coroutine())
+        # run_async() methods that do not yield are not generators.
+        self.assertRaises(SBToolError, sbasync.run_coroutine, None)
+        self.assertRaises(SBToolError, sbasync.run_coroutine, iter([lambda: None]))
+
+    def test003_bounded_workers(self):
+        lock = threading.Lock()
+        running = [0, 0] # [now, most]
+        def call(i):
+            lock.acquire()
+            running[0] += 1
+            running[1] = max(running)
+            lock.release()
+            time.sleep(0.01)
+            lock.acquire()
+            running[0] -= 1
+            lock.release()
+            return i
+        funcs = [lambda i=i: call(i) for i in range(6)]
+        self.assertEqual(sbasync.run_concurrently(funcs, 2), range(6))
+        self.assertTrue(running[1] <= 2)
+
+        saved = os.environ.get('SBTOOLS_ASYNC_WORKERS')
+        try:
+            os.environ['SBTOOLS_ASYNC_WORKERS'] = '3'
+            self.assertEqual(sbasync.get_max_workers(), 3)
+            os.environ['SBTOOLS_ASYNC_WORKERS'] = 'many'
+            self.assertEqual(sbasync.get_max_workers(), sbasync.DEFAULT_MAX_WORKERS)
+        finally:
+            if saved is None:
+                os.environ.pop('SBTOOLS_ASYNC_WORKERS', None)
+            else:
+                os.environ['SBTOOLS_ASYNC_WORKERS'] = saved
+
+    def test004_dispatch(self):
+        class AsyncTool(SBTool):
+            def run_async(self):
+                (a, b) = yield [lambda: "a", lambda: "b"]
+                print a + b
+        class FailingAsyncTool(SBTool):
+            def run_async(self):
+                yield lambda: None
+                raise SBToolError("Failed.")
+        class NoRunTool(SBTool):
+            pass
+        class NotAsyncTool(SBTool):
+            def run_async(self):
+                return "result"
+        self.sbtools.add_tool(AsyncTool, 'AsyncTool', False, ['async'])
+        self.sbtools.add_tool(FailingAsyncTool, 'FailingAsyncTool', False, ['fail'])
+        self.sbtools.add_tool(NoRunTool, 'NoRunTool', False, ['norun'])
+        self.sbtools.add_tool(NotAsyncTool, 'NotAsyncTool', False, ['notasync'])
+        self.assertEqual(self.sbtools.invoke(['sbtools', 'async']), 0)
+        self.assertEqual(sys.stdout.getvalue(), "ab\n")
+        self.assertEqual(self.sbtools.invoke(['sbtools', 'fail']), 1)
+        self.assertEqual(self.sbtools.invoke(['sbtools', 'norun']), 1)
+        self.assertTrue(sys.stdout.getvalue().endswith("does not implement run() method; not running tool.\n"))
+        self.assertEqual(self.sbtools.invoke(['sbtools', 'notasync']), 1)
+        self.assertTrue("run_async() returned 'result' instead of a generator" in sys.stdout.getvalue())
+
+class TestResultCacheMethods(unittest.TestCase):
+    """
+    Unit tests for the result cache.
+    """
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.cache = sbresultcache.ResultCache(os.path.join(self.tmpdir, 'results'))
+        self.sbtools = SBTools()
+        self.sbtools.build_tool_list(True, ['tests/testfiles/plugins'], lazy=True)
+        self.sbtools.result_cache = self.cache
+        self.infile = os.path.join(self.tmpdir, 'in.txt')
+        self.outfile = os.path.join(self.tmpdir, 'out.txt')
+        self.write_file(self.infile, "abc")
+
+        runs = self.runs = []
+        class Upper(SBTool):
+            def is_cacheable(self):
+                return True
+            def get_output_files(self, args):
+                return [args[-1]]
+            def get_name(self):
+                return 'Upper'
+            def get_version(self):
+                return '1.0'
+            def run(self):
+                runs.append(sys.argv[1:])
+                data = open(sys.argv[2]).read()
+                f = open(sys.argv[3], 'w')
+                f.write(data.upper())
+                f.close()
+                print "Converted %s." % (os.path.basename(sys.argv[2]))
+        self.sbtools.add_tool(Upper, 'Upper', False, ['upper', 'up'])
+        self.saved = (sys.argv[:], sys.stdin, sys.stdout)
+        sys.stdin = StringIO()
+        sys.stdout = StringIO()
+
+    def tearDown(self):
+        (sys.argv, sys.stdin, sys.stdout) = self.saved
+        shutil.rmtree(self.tmpdir)
+
+    def write_file(self, fname, data):
+        f = open(fname, 'w')
+        f.write(data)
+        f.close()
+
+    def test001_parse_size(self):
+        self.assertEqual(sbresultcache.parse_size("10"), 10)
+        self.assertEqual(sbresultcache.parse_size("2k"), 2048)
+        self.assertEqual(sbresultcache.parse_size("1M"), 1024**2)
+        self.assertRaises(ValueError, sbresultcache.parse_size, "big")
+
+    def test002_get_key(self):
+        key = self.cache.get_key('Upper', '1.0', [self.infile])
+        self.assertEqual(key, self.cache.get_key('Upper', '1.0', [self.infile]))
+        self.assertNotEqual(key, self.cache.get_key('Upper', '1.1', [self.infile]))
+        self.assertNotEqual(key, self.cache.get_key('Upper', '1.0', ['--in=' + self.infile]))
+        self.write_file(self.infile, "abd")
+        self.assertNotEqual(key, self.cache.get_key('Upper', '1.0', [self.infile]))
+        # Relative file names depend on the current directory.
+        key = self.cache.get_key('Upper', '1.0', ['in.txt'])
+        cwd_saved = os.getcwd()
+        os.chdir(self.tmpdir)
+        try:
+            self.assertNotEqual(key, self.cache.get_key('Upper', '1.0', ['in.txt']))
+        finally:
+            os.chdir(cwd_saved)
+        # Output files are keyed by name only.
+        self.assertEqual(self.cache.get_key('Upper', '1.0', [self.infile], [self.infile]),
+                         self.cache.get_key('Upper', '1.0', [self.infile], [self.infile]))
+        self.assertNotEqual(self.cache.get_key('Upper', '1.0', [self.infile], [], 'tty'),
+                            self.cache.get_key('Upper', '1.0', [self.infile], [], 'a' * 32))
+
+    def test003_run_cached(self):
+        self.assertEqual(self.sbtools.invoke(['sbtools', 'upper', self.infile, self.outfile]), 0)
+        os.remove(self.outfile)
+        self.assertEqual(self.sbtools.invoke(['sbtools', 'up', self.infile, self.outfile]), 0)
+        self.assertEqual(len(self.runs), 1)
+        self.assertEqual(open(self.outfile).read(), "ABC")
+        self.assertEqual(sys.stdout.getvalue(), "Converted in.txt.\n" * 2)
+
+        # A changed input file is run again.
+        self.write_file(self.infile, "xyz")
+        self.assertEqual(self.sbtools.invoke(['sbtools', 'upper', self.infile, self.outfile]), 0)
+        self.assertEqual(len(self.runs), 2)
+        self.assertEqual(open(self.outfile).read(), "XYZ")
+
+    def test004_prune(self):
+        for data in ("a", "bb", "ccc"):
+            self.cache.store(data, 'Tool', [data], data)
+        self.assertEqual(self.cache.get_size(), 6)
+        os.utime(os.path.join(self.cache.get_result_dir("a"), 'result'), (0, 0))
+        entries = self.cache.get_entries()
+        self.assertEqual(entries[-1][2], self.cache.get_result_dir("a"))
+        total = sum([size for (last_used, size, path) in entries])
+
+        # Pruning does not read the stored results.
+        self.cache.read_result = None
+        try:
+            self.assertEqual(self.cache.prune(total), 0)
+            self.assertEqual(self.cache.prune(total - 1), 1)
+        finally:
+            del self.cache.read_result
+        self.assertEqual(self.cache.lookup("a"), None)
+        self.assertEqual(self.cache.lookup("bb").stdout, "bb")
+        self.assertEqual(self.cache.clear(), 2)
+        self.assertEqual(self.cache.get_results(), [])
+
+    def test005_cache_tool(self):
+        self.cache.store("a", 'Tool', ['tool', 'x'], "abc")
+        cache = Cache(self.sbtools)
+        sys.argv = ['sbtools', 'cache']
+        cache.run()
+        self.assertTrue(sys.stdout.getvalue().endswith("3  Tool  tool x\n1 results, 3 bytes in %s.\n" % (self.cache.cachedir)))
+        sys.argv = ['sbtools', 'cache', 'prune', '--max-size', 'x']
+        self.assertRaises(SBToolError, cache.run)
+        sys.argv = ['sbtools', 'cache', 'clear']
+        cache.run()
+        self.assertTrue(sys.stdout.getvalue().endswith("Removed 1 results.\n"))
+
+    def test006_stdin_digest(self):
+        # Regular files are keyed by their remaining contents, which
+        # are left unread.
+        f = open(self.infile)
+        try:
+            self.assertEqual(sbresultcache.get_stdin_digest(f), sbresultcache.hash_file(self.infile))
+            self.assertEqual(f.read(1), "a")
+            self.assertNotEqual(sbresultcache.get_stdin_digest(f), sbresultcache.hash_file(self.infile))
+            self.assertEqual(f.read(), "bc")
+        finally:
+            f.close()
+        stream = StringIO("abc")
+        self.assertEqual(sbresultcache.get_stdin_digest(stream), sbresultcache.hash_file(self.infile))
+        self.assertEqual(stream.read(), "abc")
+
+        # Pipes are not keyed, so their results are not cached.
+        (rfd, wfd) = os.pipe()
+        pipe = os.fdopen(rfd)
+        os.close(wfd)
+        try:
+            self.assertEqual(sbresultcache.get_stdin_digest(pipe), None)
+            sys.stdin = pipe
+            self.assertEqual(self.sbtools.invoke(['sbtools', 'upper', self.infile, self.outfile]), 0)
+            self.assertEqual(self.sbtools.invoke(['sbtools', 'upper', self.infile, self.outfile]), 0)
+            self.assertEqual(len(self.runs), 2)
+        finally:
+            pipe.close()
+
+        # Different input is run again.
+        for (data, runs) in (("x", 3), ("x", 3), ("y", 4)):
+            sys.stdin = StringIO(data)
+            self.assertEqual(self.sbtools.invoke(['sbtools', 'upper', self.infile, self.outfile]), 0)
+            self.assertEqual(len(self.runs), runs)
+
+class TestProfileMethods(unittest.TestCase):
+    """
+    Unit tests for the --profile and --timings support.
+    """
+    def test001_pop_global_options(self):
+        argv = ['sbtools', '--timings', '--profile', 'help', '--timings']
+        self.assertEqual(sbprofile.pop_global_options(argv), ('sbtools.pstats', True, None))
+        self.assertEqual(argv, ['sbtools', 'help', '--timings'])
+        argv = ['sbtools', '--verbose-load', '--profile=out.pstats']
+        self.assertEqual(sbprofile.pop_global_options(argv), ('out.pstats', False, None))
+        self.assertEqual(argv, ['sbtools', '--verbose-load'])
+        argv = ['sbtools', '--startup-report', 'about']
+        self.assertEqual(sbprofile.pop_global_options(argv), (None, False, 0))
+        self.assertEqual(argv, ['sbtools', 'about'])
+        argv = ['sbtools', '--startup-report=3', 'about']
+        self.assertEqual(sbprofile.pop_global_options(argv), (None, False, 3))
+
+    def test002_phase_timer(self):
+        timer = sbprofile.PhaseTimer()
+        for i in range(2):
+            timer.stop(timer.start("phase one"))
+        timer.add("phase two", 0.5, 0.25)
+        lines = timer.get_report().splitlines()
+        self.assertEqual(len(lines), 3)
+        self.assertTrue(lines[1].startswith("phase one"))
+        self.assertTrue(lines[1].endswith(" 2"))
+        self.assertEqual(lines[2].split(), ["phase", "two", "500.0", "250.0", "1"])
+
+    def test003_dispatch_timings(self):
+        timer = sbprofile.PhaseTimer()
+        sbt = SBTools(timer=timer)
+        sbt.build_tool_list(True, ['tests/testfiles/plugins'], lazy=True)
+        saved_stdout = sys.stdout
+        sys.stdout = StringIO()
+        try:
+            self.assertEqual(sbt.invoke(['sbtools', 'blank']), 0)
+        finally:
+            sys.stdout = saved_stdout
+        names = [phase[0] for phase in timer.phases]
+        self.assertEqual(names, ["parser construction", "entry point scan", "add_tool",
+                                 "option parsing", "plug-in import (Blank)",
+                                 "tool construction", "tool run"])
+
+    def test004_run_profiled(self):
+        (fd, fname) = tempfile.mkstemp()
+        os.close(fd)
+        saved_stderr = sys.stderr
+        sys.stderr = StringIO()
+        try:
+            self.assertEqual(sbprofile.run_profiled(lambda: 7, fname), 7)
+            import pstats
+            self.assertTrue(pstats.Stats(fname).total_calls > 0)
+        finally:
+            sys.stderr = saved_stderr
+            os.remove(fname)
+
+class TestLoadReportMethods(unittest.TestCase):
+    """
+    Unit tests for the --load-report support.
+    """
+    def test001_get_report(self):
+        report = sbprofile.LoadReport()
+        report.add('Fast', 'fast', (0.0, 10, 1024), (0.001, 10, 1024), (0.002, 12, 3072))
+        report.add('Slow', 'slow', (0.0, 10, None), None, (0.5, 20, 4096), "cannot import: x")
+        lines = report.get_report().splitlines()
+        self.assertEqual(len(lines), 3)
+        self.assertEqual(lines[1].split(), ["Slow", "(slow)", "500.0", "0.0", "10", "?",
+                                            "cannot", "import:", "x"])
+        self.assertEqual(lines[2].split(), ["Fast", "(fast)", "1.0", "1.0", "2", "2", "loaded"])
+
+    def test002_build_tool_list(self):
+        report = sbprofile.LoadReport()
+        sbt = SBTools()
+        sbt.build_tool_list(True, ['tests/testfiles/plugins'], load_report=report)
+        names = [entry[0] for entry in report.entries]
+        self.assertTrue('Blank' in names)
+        self.assertEqual(len(names), len(sbt.get_toolname_list()))
+
+class TestBenchMethods(unittest.TestCase):
+    """
+    Unit tests for the sbtools-bench runner.
+    """
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test001_median(self):
+        self.assertEqual(sbbench.median([3, 1, 2]), 2)
+        self.assertEqual(sbbench.median([4, 1, 2, 3]), 2.5)
+
+    def test002_mann_whitney_u(self):
+        (u, pvalue) = sbbench.mann_whitney_u([5, 6, 7, 8, 9], [1, 2, 3, 4, 5])
+        self.assertEqual(u, 24.5)
+        self.assertAlmostEqual(pvalue, 0.008, 3)
+        (u, pvalue) = sbbench.mann_whitney_u([1, 2, 3, 4, 5], [5, 6, 7, 8, 9])
+        self.assertEqual(u, 0.5)
+        self.assertTrue(pvalue > 0.99)
+        self.assertEqual(sbbench.mann_whitney_u([1, 1], [1, 1]), (2.0, 1.0))
+
+    def test003_erfc(self):
+        for x in (-2.0, -0.5, 0.0, 0.3, 1.7):
+            self.assertAlmostEqual(sbbench.erfc_approx(x), math.erfc(x), 6)
+
+    def test004_history(self):
+        path = os.path.join(self.tmpdir, 'history.json')
+        history = sbbench.BenchHistory(path)
+        history.load()
+        first = history.add('aaa111', 'm1', {'startup': [1.0, 1.1]})
+        history.add('bbb222', 'm2', {'startup': [1.0, 1.1]})
+        history.save()
+        history = sbbench.BenchHistory(path)
+        history.load()
+        current = history.add('ccc333', 'm1', {'startup': [2.0, 2.1]})
+        self.assertEqual(history.find_baseline('m1', None, current)['commit'], 'aaa111')
+        self.assertEqual(history.find_baseline('m1', 'aaa', current)['commit'], 'aaa111')
+        self.assertEqual(history.find_baseline('m2', 'aaa', current), None)
+        self.assertEqual(history.find_baseline('m3', None, current), None)
+
+    def test005_compare_runs(self):
+        baseline = {'metrics': {'startup': [1.0, 1.1, 1.0, 1.05, 0.95, 1.0],
+                                'dispatch': [1.0, 1.1, 1.0, 1.05, 0.95, 1.0]}}
+        current = {'metrics': {'startup': [2.0, 2.1, 2.0, 2.05, 1.95, 2.0],
+                               'dispatch': [1.0, 1.1, 1.0, 1.05, 0.95, 1.0]}}
+        comparison = sbbench.compare_runs(current, baseline, 0.1, 0.05)
+        self.assertEqual([(item[0], item[5]) for item in comparison],
+                         [('startup', True), ('dispatch', False)])
+        self.assertAlmostEqual(comparison[0][3], 1.0)
+        # A large threshold hides the slowdown.
+        comparison = sbbench.compare_runs(current, baseline, 1.5, 0.05)
+        self.assertFalse(comparison[0][5])
+        self.assertTrue(sbbench.format_comparison(comparison).splitlines()[1].startswith("startup"))
+
+class TestStaticMetadataMethods(unittest.TestCase):
+    """
+    Unit tests for the static help and about metadata of plug-ins.
+    """
+    def setUp(self):
+        self.metadata = {'StaticTool': {'usage': "static [options]",
+                                        'description': "Do nothing, statically.",
+                                        'options': [("-o FILE, --output=FILE", "write to FILE"),
+                                                    ("-q, --quiet", "print nothing")],
+                                        'about': "The StaticTool tool.\n\nIt is never imported."}}
+        self.location = tempfile.mkdtemp()
+        # The plug-in module does not exist, so the tests fail if the
+        # plug-in is imported.
+        metadir = os.path.join(self.location, 'Static-1.0.egg-info')
+        os.mkdir(metadir)
+        for (fname, data) in [('PKG-INFO', "Metadata-Version: 1.0\nName: Static\nVersion: 1.0\n"),
+                              ('entry_points.txt', "[SBTools.plugins]\nStaticTool static st = statictool:StaticTool\n"),
+                              (sbstatic.METADATA_FILE, sbstatic.format_metadata(self.metadata))]:
+            f = open(os.path.join(metadir, fname), 'w')
+            f.write(data)
+            f.close()
+        self.cachedir = tempfile.mkdtemp()
+        self.sbtools = SBTools(DistributionMetadata())
+        self.sbtools.registry_cache = RegistryCache(self.cachedir)
+        self.sbtools.build_tool_list(True, [self.location], lazy=True)
+        self.argv_saved = sys.argv
+        self.stdout_saved = sys.stdout
+
+    def tearDown(self):
+        sys.argv = self.argv_saved
+        sys.stdout = self.stdout_saved
+        shutil.rmtree(self.location, True)
+        shutil.rmtree(self.cachedir)
+
+    def test001_format_parse(self):
+        text = sbstatic.format_metadata(self.metadata)
+        self.assertEqual(sbstatic.parse_metadata(text), self.metadata)
+        self.assertEqual(sbstatic.parse_metadata("not an INI file"), {})
+
+    def test002_check_metadata(self):
+        from distutils.errors import DistutilsSetupError
+        sbstatic.check_metadata(None, 'sbtools_metadata', self.metadata)
+        self.assertRaises(DistutilsSetupError, sbstatic.check_metadata, None,
+                          'sbtools_metadata', {'StaticTool': {'author': "Nobody"}})
+        self.assertRaises(DistutilsSetupError, sbstatic.check_metadata, None,
+                          'sbtools_metadata', {'StaticTool': {'options': [("output", "")]}})
+
+    def test003_parse_option_flags(self):
+        self.assertEqual(sbstatic.parse_option_flags("-o FILE, --output=FILE"),
+                         (['-o', '--output'], 'FILE'))
+        self.assertEqual(sbstatic.parse_option_flags("-q, --quiet"), (['-q', '--quiet'], None))
+        self.assertRaises(ValueError, sbstatic.parse_option_flags, "quiet")
+
+    def test004_static_help(self):
+        record = self.sbtools.get_record_by_subcommand('st')
+        self.assertEqual(record.static, self.metadata['StaticTool'])
+        helpstr = self.sbtools.get_static_help_by_subcommand('st')
+        self.assertTrue(helpstr.startswith("Usage: static [options]\n\nstatic (st): Do nothing, statically.\n"))
+        self.assertTrue("  -o FILE, --output=FILE\n" in helpstr)
+        self.assertTrue("  -q, --quiet" in helpstr)
+
+        sys.argv = ['sbtools', 'help', 'st']
+        sys.stdout = StringIO()
+        Help(self.sbtools).run()
+        self.assertEqual(sys.stdout.getvalue(), helpstr)
+        self.assertFalse(self.sbtools.get_tool_by_subcommand('st').is_loaded())
+
+    def test005_static_about(self):
+        sys.argv = ['sbtools', 'about', 'static']
+        sys.stdout = StringIO()
+        About(self.sbtools).run()
+        self.assertEqual(sys.stdout.getvalue(), "The StaticTool tool.\n\nIt is never imported.\n")
+        self.assertFalse(self.sbtools.get_tool_by_subcommand('static').is_loaded())
+
+    def test006_no_static_metadata(self):
+        self.assertEqual(self.sbtools.get_static_help_by_subcommand('help'), None)
+        self.assertEqual(self.sbtools.get_static_about_by_subcommand('help'), None)
+        self.assertEqual(self.sbtools.get_static_help_by_subcommand('unknown-sc'), None)
+
+class TestScanMethods(unittest.TestCase):
+    """
+    Unit tests for the entry point scanner.
+    """
+    def setUp(self):
+        self.location = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.location, True)
+
+    def write_dist(self, dirname, entry_points, metafile='PKG-INFO', version=None):
+        metadir = os.path.join(self.location, dirname)
+        if dirname.endswith('.egg'):
+            metadir = os.path.join(metadir, 'EGG-INFO')
+        os.makedirs(metadir)
+        f = open(os.path.join(metadir, 'entry_points.txt'), 'w')
+        f.write(entry_points)
+        f.close()
+        if version is not None:
+            f = open(os.path.join(metadir, metafile), 'w')
+            f.write("Metadata-Version: 1.0\nName: X\nVersion: %s\n\nVersion: 9\n" % (version))
+            f.close()
+
+    def test001_parse_version(self):
+        pv = sbscan.parse_version
+        self.assertTrue(pv("1.0") == pv("1.0.0"))
+        self.assertTrue(pv("0.2a1.dev") < pv("0.2a1") < pv("0.2") < pv("0.10"))
+        self.assertTrue(pv("1.0rc1") < pv("1.0") < pv("1.0-r1") < pv("1.1"))
+
+    def test002_parse_entry_points(self):
+        text = "[console_scripts]\nx = x:main\n\n[SBTools.plugins]\n# A comment.\nHelp help h ? = sbtools.builtins:Help\nX x = x.y:X.Z [extra1, extra2]\n"
+        entries = sbscan.parse_entry_points(text, 'SBTools.plugins')
+        self.assertEqual(entries, [("Help help h ?", "sbtools.builtins:Help"),
+                                   ("X x", "x.y:X.Z [extra1, extra2]")])
+        ep = sbscan.ScannedEntryPoint(entries[1][0], entries[1][1], None)
+        self.assertEqual((ep.module_name, ep.attrs, ep.extras), ('x.y', ('X', 'Z'), ('extra1', 'extra2')))
+        self.assertRaises(ValueError, sbscan.ScannedEntryPoint, "X x", ":X", None)
+
+    def test003_scan_path_entry(self):
+        epdata = "[SBTools.plugins]\nA a = a:A\n"
+        egg = 'A_Plugin-1.0-py%s.egg' % (sbscan.get_python_version())
+        self.write_dist(egg, epdata)
+        self.write_dist('B-2.0-py1.5.egg', epdata)
+        self.write_dist('C-1.0.dist-info', epdata, 'METADATA')
+        self.write_dist('D.egg-info', epdata, version='0.3')
+        self.write_dist('E-1.0.egg-info', "[console_scripts]\ne = e:main\n")
+        dists = list(sbscan.scan_path_entry(self.location, 'SBTools.plugins'))
+        self.assertEqual([(d.project_name, d.version) for d in dists],
+                         [('A-Plugin', '1.0'), ('C', '1.0'), ('D', '0.3')])
+        self.assertEqual(dists[0].location, os.path.join(self.location, egg))
+        self.assertEqual(dists[1].location, self.location)
+        self.assertEqual(dists[0].get_entry_map('SBTools.plugins').keys(), ['A a'])
+        self.assertEqual(dists[2].requires(), ['D==0.3'])
+
+    def test004_scan_zipped_egg(self):
+        dists = list(sbscan.scan_path_entry('tests/testfiles/plugins', 'SBTools.plugins'))
+        names = [(d.project_name, d.zipped) for d in dists]
+        if sys.version_info[:2] == (2, 7):
+            self.assertEqual(names, [('Blank', True)])
+            self.assertEqual(dists[0].get_entry_map('SBTools.plugins').keys(), ['Blank blank bl'])
+            self.assertTrue(dists[0].has_metadata('PKG-INFO'))
+            self.assertFalse(dists[0].has_metadata('sbtools_metadata.txt'))
+
+    def test005_scan_distributions(self):
+        epdata = "[SBTools.plugins]\nA a = a:A\n"
+        self.write_dist('A-1.0.egg-info', epdata)
+        self.write_dist('A-1.10.egg-info', epdata)
+        self.write_dist('sbtools-0.1.egg-info', epdata)
+        found = list(sbscan.scan_distributions([self.location], 'SBTools.plugins', 'sbtools'))
+        self.assertEqual([(d.project_name, d.version, isbuiltin, toolname) for (d, isbuiltin, toolname) in found],
+                         [('A', '1.10', False, 'A'), ('sbtools', '0.1', False, 'sbtools')])
+
+        # The builtin project is recognized on sys.path, whatever the
+        # case of its name.
+        found = list(sbscan.scan_distributions([None], 'SBTools.plugins', 'sbtools', True))
+        self.assertEqual(len(found), 1)
+        self.assertEqual(found[0][0].key, 'sbtools')
+        self.assertTrue(found[0][1])
+        self.assertEqual(found[0][0].requires(), [])
+
+    def test006_build_tool_list(self):
+        scanned = SBTools(DistributionMetadata())
+        scanned.build_tool_list(True, ['tests/testfiles/plugins'], lazy=True)
+        loaded = SBTools(DistributionMetadata())
+        loaded.build_tool_list(True, ['tests/testfiles/plugins'])
+        self.assertEqual(scanned.tcmdlist, loaded.tcmdlist)
+        self.assertEqual([rec.get_epldata() for rec in scanned.records],
+                         [rec.get_epldata() for rec in loaded.records])
+
+    def test007_scan_project(self):
+        epdata = "[SBTools.plugins]\nA a = a:A\n"
+        self.write_dist('A-1.0.egg-info', epdata)
+        self.write_dist('SBTools-0.1.egg-info', epdata)
+        dists = list(sbscan.scan_path_entry(self.location, 'SBTools.plugins', 'sbtools'))
+        self.assertEqual([d.project_name for d in dists], ['SBTools'])
+
+        # Path entries given as a tuple are searched like sys.path, but
+        # the builtin project is not taken from them.
+        found = list(sbscan.scan_distributions([(self.location,)], 'SBTools.plugins', 'sbtools', True))
+        self.assertEqual([(d.project_name, isbuiltin, toolname) for (d, isbuiltin, toolname) in found],
+                         [('A', False, None)])
+
+    def test008_directory_index(self):
+        epdata = "[SBTools.plugins]\nA a = a:A\n"
+        self.write_dist('A-1.0.egg-info', epdata)
+        cachedir = tempfile.mkdtemp()
+        try:
+            self.check_directory_index(RegistryCache(cachedir))
+        finally:
+            shutil.rmtree(cachedir)
+
+    def check_directory_index(self, cache):
+        epdata = "[SBTools.plugins]\nA a = a:A\n"
+        index = sbscan.DirectoryIndex(cache)
+        dists = index.scan(self.location, 'SBTools.plugins')
+        self.assertEqual([(d.project_name, d.version) for d in dists], [('A', '1.0')])
+
+        # An unchanged directory is not read again.
+        saved_scan_path_entry = sbscan.scan_path_entry
+        sbscan.scan_path_entry = None
+        try:
+            dists = index.scan(self.location, 'SBTools.plugins')
+        finally:
+            sbscan.scan_path_entry = saved_scan_path_entry
+        self.assertEqual([(d.project_name, d.version, d.location) for d in dists],
+                         [('A', '1.0', self.location)])
+        self.assertEqual(dists[0].get_entry_map('SBTools.plugins').keys(), ['A a'])
+
+        self.write_dist('B-2.0.egg-info', epdata)
+        os.utime(self.location, (0, 0))
+        dists = index.scan(self.location, 'SBTools.plugins')
+        self.assertEqual([d.project_name for d in dists], ['A', 'B'])
+
+    def test009_check_requirements(self):
+        import pkg_resources
+        epdata = "[SBTools.plugins]\nA a = a:A\n"
+        self.write_dist('A-1.0.egg-info', epdata)
+        f = open(os.path.join(self.location, 'A-1.0.egg-info', 'requires.txt'), 'w')
+        f.write("B>=2.0\n\n[x]\nC\n")
+        f.close()
+        self.write_dist('B-2.1.egg-info', "")
+        dist = list(sbscan.scan_path_entry(self.location, 'SBTools.plugins'))[0]
+        self.assertEqual(dist.requires(), ['A==1.0'])
+        self.assertEqual(dist.requires(('x',)), ['A[x]==1.0'])
+
+        # The distribution is resolved with pkg_resources, together
+        # with its dependencies.
+        state = pkg_resources.working_set.__getstate__()
+        try:
+            dist.check_requirements()
+            self.assertTrue(self.location in pkg_resources.working_set.entries)
+            self.assertRaises(pkg_resources.DistributionNotFound, dist.check_requirements, ('x',))
+        finally:
+            pkg_resources.working_set.__setstate__(state)
+
+class TestDiscoveryConfigMethods(unittest.TestCase):
+    """
+    Unit tests for the plug-in search configuration.
+    """
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.environ_saved = {}
+        for name in ('SBTOOLS_PATH', 'SBTOOLS_NO_SITE_PACKAGES', 'SBTOOLS_CACHE_DIR'):
+            self.environ_saved[name] = os.environ.pop(name, None)
+        os.environ['SBTOOLS_CACHE_DIR'] = os.path.join(self.tmpdir, 'cache')
+        self.path_saved = sys.path[:]
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+        for (name, value) in self.environ_saved.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+        sys.path[:] = self.path_saved
+
+    def write_config(self, text):
+        path = os.path.join(self.tmpdir, 'sbtools.cfg')
+        f = open(path, 'w')
+        f.write(text)
+        f.close()
+        return path
+
+    def test001_read_config(self):
+        config = sbconfig.read_config(os.path.join(self.tmpdir, 'missing.cfg'))
+        self.assertEqual((config.plugin_dirs, config.site_packages), ([], True))
+        self.assertEqual(config.get_search_path(), sys.path)
+        self.assertEqual(config.get_location(), None)
+
+        path = self.write_config("[discovery]\nplugin_path = tests/testfiles/plugins\n  /opt/plugins\nsite_packages = no\n")
+        config = sbconfig.read_config(path)
+        self.assertEqual(config.plugin_dirs, [os.path.abspath('tests/testfiles/plugins'), '/opt/plugins'])
+        self.assertFalse(config.site_packages)
+        self.assertEqual(config.get_search_path(), [sbconfig.get_framework_entry()] + config.plugin_dirs)
+        self.assertEqual(config.get_location(), tuple(config.plugin_dirs))
+
+        os.environ['SBTOOLS_PATH'] = os.pathsep.join(['/a', '', '/b', '/a'])
+        os.environ['SBTOOLS_NO_SITE_PACKAGES'] = '1'
+        path = self.write_config("[discovery]\nplugin_path = /c\n")
+        config = sbconfig.read_config(path)
+        self.assertEqual((config.plugin_dirs, config.site_packages), (['/a', '/b'], False))
+
+    def test002_read_bad_config(self):
+        path = self.write_config("plugin_path = /c\n")
+        out = StringIO()
+        config = sbconfig.read_config(path, out)
+        self.assertEqual((config.plugin_dirs, config.site_packages), ([], True))
+        self.assertTrue(out.getvalue().startswith("WARNING: cannot read %s" % (path)))
+
+    def test003_build_tool_list(self):
+        plugins = os.path.abspath('tests/testfiles/plugins')
+        config = sbconfig.DiscoveryConfig([plugins], False)
+        for lazy in (True, False):
+            sbt = SBTools(DistributionMetadata(), config=config)
+            sbt.registry_cache = RegistryCache(os.path.join(self.tmpdir, 'cache'))
+            sbt.build_tool_list(lazy=lazy)
+            self.assertTrue(sbt.is_tool_builtin_by_subcommand('about'))
+            if sys.version_info[:2] == (2, 7):
+                self.assertFalse(sbt.is_tool_builtin_by_subcommand('blank'))
+                self.assertTrue(sbt.has_tool_by_name('Blank'))
+            self.assertEqual([tool for tool in sbt.tcmdlist if tool[0] == 'bad'], [])
+            sys.path[:] = self.path_saved
+
+        # Configured directories are not searched for builtin-only
+        # tool lists.
+        sbt = SBTools(DistributionMetadata(), config=config)
+        sbt.build_tool_list(True, lazy=True)
+        self.assertFalse(sbt.has_tool_by_subcommand('blank'))
+
+class FakeEntryPoint:
+    def __init__(self, name, value, group):
+        (self.name, self.value, self.group) = (name, value, group)
+
+class FakeMetadataDistribution:
+    """A distribution as returned by importlib.metadata."""
+    def __init__(self, location, name, version, entry_points, requires=None, files={}):
+        self.location = location
+        self.metadata = {'Name': name}
+        self.version = version
+        self.entry_points = [FakeEntryPoint(n, v, 'SBTools.plugins') for (n, v) in entry_points]
+        self.requires = requires
+        self.files = files
+
+    def locate_file(self, path):
+        return os.path.join(self.location, path)
+
+    def read_text(self, name):
+        return self.files.get(name)
+
+class FakeMetadataModule:
+    """A stand-in for the importlib.metadata module."""
+    class PackageNotFoundError(Exception):
+        pass
+
+    def __init__(self, dists):
+        self.dists = dists
+        self.paths = []
+
+    def distributions(self, path, name=None):
+        self.paths.append(path)
+        return [dist for dist in self.dists if dist.location in path and
+                (name is None or dist.metadata['Name'].lower() == name.lower())]
+
+    def distribution(self, name):
+        for dist in self.dists:
+            if dist.metadata['Name'] == name:
+                return dist
+        raise self.PackageNotFoundError(name)
+
+class TestDiscoveryBackendMethods(unittest.TestCase):
+    """
+    Unit tests for the discovery backends.
+    """
+    def setUp(self):
+        self.cachedir = tempfile.mkdtemp()
+        self.environ_saved = {}
+        for name in ('SBTOOLS_DISCOVERY', 'SBTOOLS_CACHE_DIR'):
+            self.environ_saved[name] = os.environ.get(name)
+        os.environ['SBTOOLS_CACHE_DIR'] = self.cachedir
+
+    def tearDown(self):
+        shutil.rmtree(self.cachedir)
+        for (name, value) in self.environ_saved.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
+    def test001_get_discovery_backend(self):
+        metadata = DistributionMetadata()
+        os.environ.pop('SBTOOLS_DISCOVERY', None)
+        backend = sbdiscovery.get_discovery_backend(metadata)
+        if sbimportlib.get_metadata_module() is None:
+            backend_name = 'scan'
+        else:
+            backend_name = 'importlib'
+        self.assertEqual(backend.name, backend_name)
+        backend = sbdiscovery.get_discovery_backend(metadata, 'pkg_resources')
+        self.assertEqual(backend.name, 'pkg_resources')
+        self.assertTrue(backend.metadata is metadata)
+        os.environ['SBTOOLS_DISCOVERY'] = 'scan'
+        self.assertEqual(sbdiscovery.get_discovery_backend(metadata).name, 'scan')
+
+        # Backends that were asked for but cannot be used are reported.
+        out = StringIO()
+        self.assertEqual(sbdiscovery.get_discovery_backend(metadata, 'nosuch', out=out).name, backend_name)
+        self.assertEqual(out.getvalue(), "WARNING: unknown discovery backend 'nosuch'; using '%s'.\n" % (backend_name))
+        saved_get_metadata_module = sbdiscovery.get_metadata_module
+        sbdiscovery.get_metadata_module = lambda: None
+        try:
+            out = StringIO()
+            self.assertEqual(sbdiscovery.get_discovery_backend(metadata, 'importlib', out=out).name, 'scan')
+            self.assertEqual(out.getvalue(), "WARNING: the 'importlib' discovery backend needs importlib.metadata (Python 3.8) or the importlib_metadata package; using 'scan'.\n")
+        finally:
+            sbdiscovery.get_metadata_module = saved_get_metadata_module
+
+    def test002_classify_load_error(self):
+        import pkg_resources
+        self.assertEqual(sbregistry.classify_load_error(ImportError("x")), 'ImportError')
+        self.assertEqual(sbregistry.classify_load_error(pkg_resources.VersionConflict("x")), 'VersionConflict')
+        self.assertEqual(sbregistry.classify_load_error(pkg_resources.DistributionNotFound("x")), 'DistributionNotFound')
+        self.assertEqual(sbregistry.classify_load_error(ValueError("x")), None)
+        self.assertEqual(sbregistry.describe_load_error('ImportError', "No module named x"),
+                         "cannot import: No module named x")
+
+    def test003_importlib_backend(self):
+        module = FakeMetadataModule([
+            FakeMetadataDistribution('/site', 'SBTools', '0.5', [('Help help h ?', 'sbtools.builtins:Help')]),
+            FakeMetadataDistribution('/site', 'Other', '1.0', []),
+            FakeMetadataDistribution('/site', 'Blank', '0.1', [('Blank blank', 'blank:Blank')]),
+            FakeMetadataDistribution('/other', 'Blank', '0.2', [('Blank blank', 'blank:Blank')],
+                                     ['Other (>=1.0)', 'Missing; python_version < "2.0"'],
+                                     {'sbtools_metadata.txt': "[Blank]\nabout = Blank.\n"})])
+        backend = sbdiscovery.ImportlibMetadataBackend()
+        backend.module = module
+        path_saved = sys.path[:]
+        sys.path[:] = ['/site', '/other', '/site']
+        try:
+            found = list(backend.locate([None], 'sbtools'))
+        finally:
+            sys.path[:] = path_saved
+        self.assertEqual(module.paths, [['/site', '/other']])
+        self.assertEqual([(d.project_name, d.version, d.location, isbuiltin) for (d, isbuiltin, toolname) in found],
+                         [('SBTools', '0.5', '/site', True), ('Blank', '0.2', '/other', False)])
+
+        blank = found[1][0]
+        self.assertEqual(blank.get_entry_map('SBTools.plugins').keys(), ['Blank blank'])
+        self.assertTrue(blank.has_metadata('sbtools_metadata.txt'))
+        self.assertFalse(blank.has_metadata('PKG-INFO'))
+        self.assertEqual(blank.requires(), ['Blank==0.2'])
+        self.assertEqual(found[0][0].requires(), [])
+
+    def test004_importlib_backend_builtin_only(self):
+        framework = sbconfig.get_framework_entry()
+        plugins = tempfile.mkdtemp()
+        module = FakeMetadataModule([
+            FakeMetadataDistribution(framework, 'SBTools', '0.5', [('Help help h ?', 'sbtools.builtins:Help')]),
+            FakeMetadataDistribution(framework, 'Local', '1.0', [('Local local', 'local:Local')]),
+            FakeMetadataDistribution('/site', 'Site', '1.0', [('Site site', 'site:Site')]),
+            FakeMetadataDistribution(plugins, 'Blank', '0.2', [('Blank blank', 'blank:Blank')])])
+        backend = sbdiscovery.ImportlibMetadataBackend()
+        backend.module = module
+        path_saved = sys.path[:]
+        sys.path[:] = ['/site', framework]
+        try:
+            found = list(backend.locate([None, (plugins,)], 'sbtools', True))
+        finally:
+            sys.path[:] = path_saved
+            shutil.rmtree(plugins)
+        # Only the entry of the framework is read for the builtin
+        # project; the plug-in directories are searched as usual.
+        self.assertEqual(module.paths, [[framework], [plugins]])
+        self.assertEqual([(d.project_name, isbuiltin) for (d, isbuiltin, toolname) in found],
+                         [('SBTools', True), ('Blank', False)])
+
+    def test005_get_search_entries(self):
+        entries = sbimportlib.get_search_entries('tests/testfiles/plugins')
+        self.assertEqual(entries[0], 'tests/testfiles/plugins')
+        eggs = [os.path.basename(entry) for entry in entries[1:]]
+        self.assertEqual(eggs, [name for name in sorted(os.listdir('tests/testfiles/plugins'))
+                                if name.endswith('-py%s.egg' % (sbscan.get_python_version()))])
+
+class TestStartupReportMethods(unittest.TestCase):
+    """
+    Unit tests for the --startup-report support and the import budget
+    of the fast dispatch path.
+    """
+    # The framework modules that a warm 'sbtools about' or 'sbtools
+    # blank' may import, and standard modules that only other tools,
+    # the environment scan, or the requirement check of an installed
+    # plug-in need.
+    framework_budget = ['sbtools', 'sbtools.sbtools', 'sbtools.sbtool', 'sbtools.sboptparse',
+                        'sbtools.sbregistry', 'sbtools.sbindex', 'sbtools.sbmetadata',
+                        'sbtools.sbresultcache', 'sbtools.sbprofile', 'sbtools.sbconfig',
+                        'sbtools.sbscan', 'sbtools.builtins']
+    excluded_modules = ['pkg_resources', 'inspect', 'zipfile', 'shutil', 'socket', 'signal',
+                        'threading', 'subprocess', 'ConfigParser', 'py_compile']
+    module_budget = 40
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.env = os.environ.copy()
+        self.env['SBTOOLS_CACHE_DIR'] = self.tmpdir
+        self.env.pop('SBTOOLS_NO_CACHE', None)
+        self.env.pop('SBTOOLS_DISCOVERY', None)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test001_get_rows(self):
+        result = {'interpreter start': 0.01, 'import time': 0.02, 'run time': 0.04,
+                  'imports': [[['sbtools.sbtool'], 0.003, 0.002, 'import'],
+                              [['textwrap', 'string'], 0.001, 0.001, 'import'],
+                              [['sbtools.sbdiscovery'], 0.004, 0.004, 'run']],
+                  'phases': [["registry cache lookup", 0.005, 0.0, 1],
+                             ["tool run", 0.01, 0.0, 1]],
+                  'modules': ['sbtools.sbtool'], 'status': 0}
+        rows = dict(sbstartup.get_rows(result))
+        self.assertEqual(rows["  sbtools.sbtool"], 0.002)
+        self.assertEqual(rows["  other modules (2)"], 0.001)
+        self.assertEqual(rows["discovery"], 0.005)
+        self.assertEqual(rows["dispatch"], 0.01)
+        self.assertAlmostEqual(rows["other"], 0.025)
+        self.assertEqual(rows["  sbtools.sbdiscovery"], 0.004)
+        self.assertAlmostEqual(rows["total"], 0.07)
+        report = sbstartup.format_report(result, [result, result])
+        self.assertTrue(report.splitlines()[1].startswith("interpreter start"))
+
+    def test002_warm_dispatch_import_budget(self):
+        modules = self.check_warm_dispatch(['about'], self.env)
+        self.assertEqual([name for name in self.excluded_modules if name in modules], [])
+        self.assertTrue(len(modules) <= self.module_budget,
+                        "%d modules imported: %s" % (len(modules), sorted(modules)))
+
+        # An installed plug-in, found in a plug-in directory, takes the
+        # fast path as well, but its requirements are resolved with
+        # pkg_resources when it is dispatched.
+        if sys.version_info[:2] == (2, 7):
+            env = self.env.copy()
+            env['SBTOOLS_PATH'] = os.path.abspath('tests/testfiles/plugins')
+            modules = self.check_warm_dispatch(['blank'], env)
+            self.assertTrue('pkg_resources' in modules)
+
+    def check_warm_dispatch(self, args, env):
+        # The first run fills the registry cache; the second takes the
+        # fast path.
+        first = sbstartup.run_child(args, env)
+        result = sbstartup.run_child(args, env)
+        self.assertEqual(result['status'], 0)
+        self.assertTrue([phase for phase in first['phases'] if phase[0] == "entry point scan"])
+        self.assertFalse([phase for phase in result['phases'] if phase[0] == "entry point scan"])
+        modules = result['modules']
+        framework = [name for name in modules if sbstartup.is_framework_module(name)]
+        self.assertEqual([name for name in framework if name not in self.framework_budget], [])
+        return modules
+
 class SBToolsTestSuite(unittest.TestSuite):
     """
     Test suite for the SBTools tests.
@@ -530,6 +2149,23 @@ class SBToolsTestSuite(unittest.TestSuite):
         self.addTest(unittest.makeSuite(TestFileMethods))
         self.addTest(unittest.makeSuite(TestSBToolMethods))
         self.addTest(unittest.makeSuite(TestSBToolsMethods))
+        self.addTest(unittest.makeSuite(TestRegistryCacheMethods))
+        self.addTest(unittest.makeSuite(TestDistributionMetadataMethods))
+        self.addTest(unittest.makeSuite(TestDiscoveryMethods))
+        self.addTest(unittest.makeSuite(TestDispatchTableMethods))
+        self.addTest(unittest.makeSuite(TestServerMethods))
+        self.addTest(unittest.makeSuite(TestBatchMethods))
+        self.addTest(unittest.makeSuite(TestChainMethods))
+        self.addTest(unittest.makeSuite(TestAsyncMethods))
+        self.addTest(unittest.makeSuite(TestResultCacheMethods))
+        self.addTest(unittest.makeSuite(TestProfileMethods))
+        self.addTest(unittest.makeSuite(TestLoadReportMethods))
+        self.addTest(unittest.makeSuite(TestBenchMethods))
+        self.addTest(unittest.makeSuite(TestStaticMetadataMethods))
+        self.addTest(unittest.makeSuite(TestScanMethods))
+        self.addTest(unittest.makeSuite(TestDiscoveryConfigMethods))
+        self.addTest(unittest.makeSuite(TestDiscoveryBackendMethods))
+        self.addTest(unittest.makeSuite(TestStartupReportMethods))
 
 def runTests():
     suite = SBToolsTestSuite()